@@ -0,0 +1,104 @@
+"""Compares the validated and the raw serialization paths of a diary feed.
+
+Builds synthetic documents shaped like the ones MongoDB returns for the
+`diaries` collection, half of them written before the summary and version
+fields existed, and times, per feed:
+    validated: Diary.convert_results_to_objects -> jsonable_encoder -> json.dumps
+    raw:       Diary.convert_results_to_documents -> base.dumps (orjson)
+
+usage: python3 benchmarks/feed_serialization.py [--diaries 10000] [--blocks 12] [--rounds 5]
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(dir_path, ".."))
+
+from core.models import base, diaries
+
+
+def make_documents(count, blocks):
+    started = datetime(2024, 1, 1)
+    documents = []
+    for i in range(count):
+        document = {
+            "_id": ObjectId(),
+            "content": {
+                "time": 1717200000000 + i,
+                "blocks": [
+                    {
+                        "id": f"block-{i}-{b}",
+                        "type": "header" if b == 0 else "paragraph",
+                        "data": {"text": f"Diary {i} block {b} " + "lorem ipsum dolor sit amet " * 4},
+                    }
+                    for b in range(blocks)
+                ],
+                "version": "2.29.1",
+            },
+            "published": True,
+            "team": f"team-{i % 8}",
+            "creator": {"id": str(ObjectId()), "username": f"user{i % 50}"},
+            "created_stamp": started + timedelta(seconds=i, microseconds=i * 1000 % 1000000),
+        }
+        # every other diary predates the summary and version fields
+        if i % 2 == 0:
+            document["summary"] = diaries.summarize(document["content"])
+            document["version"] = i % 5
+        documents.append(document)
+    return documents
+
+
+def validated_path(documents):
+    objects = diaries.Diary.convert_results_to_objects(documents)
+    encoded = jsonable_encoder({"diaries": objects, "count": len(objects), "next_cursor": None})
+    return json.dumps(encoded, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def raw_path(documents):
+    documents = diaries.Diary.convert_results_to_documents(documents)
+    return base.dumps({"diaries": documents, "count": len(documents), "next_cursor": None})
+
+
+def measure(path, documents, rounds):
+    timings = []
+    body = None
+    for _ in range(rounds):
+        # both paths rename _id in place, so each round gets fresh documents
+        batch = copy.deepcopy(documents)
+        started = time.perf_counter()
+        body = path(batch)
+        timings.append(time.perf_counter() - started)
+    return min(timings), sum(timings) / len(timings), body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--diaries", type=int, default=10000)
+    parser.add_argument("--blocks", type=int, default=12)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    documents = make_documents(args.diaries, args.blocks)
+    print(f"{args.diaries} diaries x {args.blocks} blocks, best/mean of {args.rounds} rounds"
+          f" (orjson {'available' if base.orjson is not None else 'missing, using json'})")
+
+    results = {}
+    for name, path in (("validated", validated_path), ("raw", raw_path)):
+        best, mean, body = measure(path, documents, args.rounds)
+        results[name] = (best, body)
+        print(f"{name:>10}: best {best * 1000:8.1f} ms  mean {mean * 1000:8.1f} ms  {len(body) / 1024:8.0f} KiB")
+
+    assert json.loads(results["validated"][1]) == json.loads(results["raw"][1]), "the two paths produced different JSON"
+    print(f"   speedup: {results['validated'][0] / results['raw'][0]:.1f}x, identical output")
+
+
+if __name__ == "__main__":
+    main()
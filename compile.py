@@ -1,20 +1,59 @@
 import os
+import re
+import sys
+import time
+import gzip
+import json
+import hashlib
 import shutil
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import htmlmin
 import csscompressor
 from rjsmin import jsmin
-from datetime import datetime
-import pytz
 
-def minify_file(file_path, file_type, file_versionstamp_map = {}):
+try:
+    import brotli
+except ImportError:
+    # without it only the .gz variants are written
+    brotli = None
+
+# kept in the output directory; clear_directory skips dotfiles, so it survives
+MANIFEST_FILE = ".pack-manifest.json"
+# bump to rebuild everything when the pipeline output changes
+PIPELINE_VERSION = 1
+HASH_LENGTH = 10
+# extensions of the outputs worth precompressing, and the smallest size worth it
+COMPRESSIBLE_EXTENSIONS = {".html", ".css", ".js", ".mjs", ".json", ".svg", ".txt", ".xml", ".map"}
+MIN_COMPRESS_SIZE = 256
+
+class Reference_Map:
+    """Rewrites references to assets, by file name, to their hashed names in a single pass."""
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.pattern = None
+        if mapping:
+            # longest first, so a name never matches the tail of a longer one
+            names = sorted(mapping, key=len, reverse=True)
+            self.pattern = re.compile(r"(?<![\w.-])(" + "|".join(re.escape(name) for name in names) + r")(?![\w-])")
+
+    def rewrite(self, content):
+        if self.pattern is None:
+            return content
+        return self.pattern.sub(lambda match: self.mapping[match.group(1)], content)
+
+    def digest(self):
+        return hashlib.sha256(json.dumps(self.mapping, sort_keys=True).encode("utf-8")).hexdigest()
+
+def minify_file(file_path, file_type, references=None):
     if file_type == 'html':
         with open(file_path, 'r', encoding="utf-8") as file:
             file_content = file.read()
         
-        # replace all references to *.ext with *.versionstamp.ext
-        for before, after in file_versionstamp_map.items():
-            file_content = file_content.replace(before, after)
+        # replace all references to *.ext with *.<content hash>.ext
+        if references is not None:
+            file_content = references.rewrite(file_content)
 
         return htmlmin.minify(file_content, remove_comments=True, remove_empty_space=True), False
     elif file_type == 'css':
@@ -41,9 +80,98 @@ def clear_directory(directory):
         elif os.path.isdir(file_path):
             shutil.rmtree(file_path)
 
-def pack_web_project(input_directory, output_directory, ignore_directories=[], ignore_files=[]):
-    # generate datestamp version string for cache busting
-    versionstamp = datetime.now(tz=pytz.utc).strftime("v%Y%m%d%H%M%S")
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def write_output(output_directory, relative_path, content):
+    """Writes an output file and its .gz and .br siblings. Returns the relative paths written."""
+    output_path = os.path.join(output_directory, relative_path)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'wb') as output_file:
+        output_file.write(content)
+    return [relative_path] + [relative_path + suffix for suffix in write_compressed(output_path, content)]
+
+def write_compressed(output_path, content=None):
+    """Writes the .gz and .br siblings of a file worth compressing. Returns the suffixes written."""
+    if os.path.splitext(output_path)[1] not in COMPRESSIBLE_EXTENSIONS:
+        return []
+    if content is None:
+        with open(output_path, 'rb') as file:
+            content = file.read()
+    if len(content) < MIN_COMPRESS_SIZE:
+        return []
+    variants = [(".gz", gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(content, quality=11)))
+    written = []
+    for suffix, compressed in variants:
+        # a variant that saves nothing is only extra work for the server
+        if len(compressed) < len(content):
+            with open(output_path + suffix, 'wb') as output_file:
+                output_file.write(compressed)
+            written.append(suffix)
+    return written
+
+def _encode(content, is_binary):
+    return content if is_binary else content.encode("utf-8")
+
+def build_asset(file_path, file_type, relative_path, output_directory):
+    """Minifies one asset and writes it under its content-hash name. Runs in a worker process."""
+    minified_content, is_binary = minify_file(file_path, file_type)
+    content = _encode(minified_content, is_binary)
+    stem, extension = os.path.splitext(relative_path)
+    output_relative_path = f"{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{extension}"
+    return output_relative_path, write_output(output_directory, output_relative_path, content)
+
+def build_html(file_path, relative_path, output_directory, references):
+    minified_content, _ = minify_file(file_path, 'html', references)
+    return relative_path, write_output(output_directory, relative_path, _encode(minified_content, False))
+
+def load_manifest(output_directory):
+    try:
+        with open(os.path.join(output_directory, MANIFEST_FILE), 'r', encoding="utf-8") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != PIPELINE_VERSION:
+        return {}
+    return manifest.get("files", {})
+
+def save_manifest(output_directory, files):
+    os.makedirs(output_directory, exist_ok=True)
+    path = os.path.join(output_directory, MANIFEST_FILE)
+    with open(path + ".tmp", 'w', encoding="utf-8") as file:
+        json.dump({"version": PIPELINE_VERSION, "files": files}, file, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def _is_current(entry, key, output_directory):
+    return (
+        entry is not None
+        and entry["key"] == key
+        and all(os.path.exists(os.path.join(output_directory, path)) for path in entry["written"])
+    )
+
+def pack_web_project(input_directory, output_directory, ignore_directories=[], ignore_files=[], max_workers=None):
+    """Minifies `input_directory` into `output_directory`, rebuilding only what changed since the last run.
+
+    Every asset other than HTML is written under a name holding the hash of
+    its minified content (app.js -> app.<hash>.js), so an unchanged asset
+    keeps its name and stays cached by browsers across deploys. The HTML pages
+    keep their names and have their references rewritten to the hashed names.
+    Text outputs also get .gz and .br (with the brotli package) siblings.
+
+    A manifest in the output directory maps every source to the hash of its
+    content and the files built from it; a source whose hash matches and
+    whose outputs still exist is skipped. Assets are minified in a pool of
+    `max_workers` processes (one per CPU by default). Outputs of removed or
+    changed sources are deleted.
+    """
+    previous = load_manifest(output_directory)
+    manifest = {}
     other_files = []
     html_files = []
     for root, _, files in os.walk(input_directory):
@@ -66,62 +194,179 @@ def pack_web_project(input_directory, output_directory, ignore_directories=[], i
 
             other_files.append((file_path, file_type))
 
-        
-    file_versionstamp_map = {}
-
-    # minify other files
+    reference_map = {}
+    pending = []
     for file_path, file_type in other_files:
         relative_path = os.path.relpath(file_path, input_directory)
-        # replace *.ext with *.versionstamp.ext
-        relative_path = os.path.splitext(relative_path)[0] + "." + versionstamp + os.path.splitext(relative_path)[1]
-        output_path = os.path.join(output_directory, relative_path)
+        key = file_digest(file_path)
+        entry = previous.get(relative_path)
+        if _is_current(entry, key, output_directory):
+            manifest[relative_path] = entry
+        else:
+            pending.append((file_path, file_type, relative_path, key))
 
-        file_versionstamp_map[os.path.basename(file_path)] = os.path.basename(output_path)
+    if pending:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [
+                (relative_path, key, pool.submit(build_asset, file_path, file_type, relative_path, output_directory))
+                for file_path, file_type, relative_path, key in pending
+            ]
+            for relative_path, key, future in futures:
+                output_relative_path, written = future.result()
+                manifest[relative_path] = {"key": key, "output": output_relative_path, "written": written}
 
-        minified_content, is_binary = minify_file(file_path, file_type)
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        if is_binary:
-            with open(output_path, 'wb') as output_file:
-                output_file.write(minified_content)
-        else:
-            with open(output_path, 'w', encoding="utf-8") as output_file:
-                output_file.write(minified_content)
+    for relative_path, entry in manifest.items():
+        reference_map[os.path.basename(relative_path)] = os.path.basename(entry["output"])
+    references = Reference_Map(reference_map)
 
-    # now minify html files
-    for file_path, file_type in html_files:
+    # pages are rebuilt when they or any asset name they may reference changed
+    references_digest = references.digest()
+    rebuilt = len(pending)
+    for file_path, _ in html_files:
         relative_path = os.path.relpath(file_path, input_directory)
-        output_path = os.path.join(output_directory, relative_path)
+        key = file_digest(file_path) + references_digest
+        entry = previous.get(relative_path)
+        if _is_current(entry, key, output_directory):
+            manifest[relative_path] = entry
+            continue
+        output_relative_path, written = build_html(file_path, relative_path, output_directory, references)
+        manifest[relative_path] = {"key": key, "output": output_relative_path, "written": written}
+        rebuilt += 1
+
+    # outputs no source produces any more
+    current_outputs = {path for entry in manifest.values() for path in entry["written"]}
+    for entry in previous.values():
+        for path in entry["written"]:
+            if path not in current_outputs and os.path.exists(os.path.join(output_directory, path)):
+                os.remove(os.path.join(output_directory, path))
 
-        minified_content, _ = minify_file(file_path, file_type, file_versionstamp_map)
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        with open(output_path, 'w', encoding="utf-8") as output_file:
-            output_file.write(minified_content)
+    save_manifest(output_directory, manifest)
+    print(f"Packed {len(manifest)} files, {rebuilt} rebuilt")
 
     # copy the resources folder
     os.makedirs(os.path.join(output_directory, "resources"), exist_ok=True)
     shutil.copytree(os.path.join(input_directory, "resources"), os.path.join(output_directory, "resources"), dirs_exist_ok=True)
 
-def build_react_app():
+CLIENT_DIR = os.path.join('web', 'client')
+# what the build output depends on, besides the installed packages
+BUILD_INPUTS = ["src", "public", "index.html", "vite.config.ts", "tsconfig.json", "tsconfig.node.json", "tailwind.config.js", "postcss.config.js"]
+# where the fingerprints of the last successful install and build are kept
+FINGERPRINT_DIR = os.path.join("node_modules", ".cache", "compile")
+
+def fingerprint(base_directory, paths, max_workers=None):
+    """Hashes the files under `paths` (files or directories, relative to `base_directory`), names and contents.
+
+    Files are hashed on a thread pool; hashlib releases the GIL on large inputs.
+    """
+    files = []
+    for path in paths:
+        full_path = os.path.join(base_directory, path)
+        if os.path.isfile(full_path):
+            files.append(path)
+        for root, directories, names in os.walk(full_path):
+            directories.sort()
+            for name in sorted(names):
+                files.append(os.path.relpath(os.path.join(root, name), base_directory))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        digests = pool.map(file_digest, [os.path.join(base_directory, file) for file in files])
+        combined = hashlib.sha256()
+        for file, digest in zip(files, digests):
+            combined.update(file.replace(os.sep, "/").encode("utf-8") + b"\0" + digest.encode("ascii") + b"\n")
+    return combined.hexdigest()
+
+def read_fingerprint(client_dir, name):
     try:
-        # Define the path to the client directory
-        client_dir = os.path.join('web', 'client')
-        
-        # Change the current working directory to the client directory
-        os.chdir(client_dir)
-        result = subprocess.run(['npm', 'i'], capture_output=True, text=True)
-        print(f"<npm i> Standard Output:\n{result.stdout}")
-        print(f"<npm i> Standard Errors:\n{result.stderr if result.stderr else 'None'}")
-
-        # Run the npm build command
-        result = subprocess.run(['npm', 'run', 'build'], capture_output=True, text=True)        
-        print(f"<npm run build> Standard Output:\n{result.stdout}")
-        print(f"<npm run build> Standard Errors:\n{result.stderr if result.stderr else 'None'}")
+        with open(os.path.join(client_dir, FINGERPRINT_DIR, name), 'r', encoding="utf-8") as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+def write_fingerprint(client_dir, name, value):
+    directory = os.path.join(client_dir, FINGERPRINT_DIR)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, name), 'w', encoding="utf-8") as file:
+        file.write(value)
+
+def run_streamed(command, cwd, label):
+    """Runs `command`, printing its output live with `label` on every line. Returns the exit code."""
+    process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+    for line in process.stdout:
+        print(f"<{label}> {line}", end="", flush=True)
+    return process.wait()
+
+def precompress_directory(directory, max_workers=None):
+    """Writes .gz and .br siblings next to every compressible file of `directory`, in a process pool."""
+    paths = [
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names
+    ]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return sum(1 for written in pool.map(write_compressed, paths, chunksize=16) if written)
+
+def build_react_app(client_dir=CLIENT_DIR, force=False):
+    """Installs the client dependencies and builds it into `client_dir`/dist, skipping the stages that are up to date.
+
+    `npm i` runs only when package.json or package-lock.json changed since the
+    last successful install, or node_modules is missing. The build runs only
+    when the dependencies or BUILD_INPUTS changed, or dist is missing. `force`
+    runs every stage. The output of npm is streamed as it comes and the time of
+    every stage is printed at the end. Returns whether every stage succeeded.
+    """
+    timings = []
+
+    def timed(stage, started):
+        timings.append((stage, time.perf_counter() - started))
+
+    try:
+        started = time.perf_counter()
+        dependencies = fingerprint(client_dir, ["package.json", "package-lock.json"])
+        installed = os.path.isdir(os.path.join(client_dir, "node_modules"))
+        timed("fingerprint dependencies", started)
+
+        started = time.perf_counter()
+        if force or not installed or read_fingerprint(client_dir, "install") != dependencies:
+            if run_streamed(['npm', 'i'], client_dir, "npm i") != 0:
+                print("Error during React build: npm i failed")
+                return False
+            # npm i may have updated the lock file
+            dependencies = fingerprint(client_dir, ["package.json", "package-lock.json"])
+            write_fingerprint(client_dir, "install", dependencies)
+            timed("npm i", started)
+        else:
+            timed("npm i (skipped, dependencies unchanged)", started)
+
+        started = time.perf_counter()
+        sources = hashlib.sha256((dependencies + fingerprint(client_dir, BUILD_INPUTS)).encode("ascii")).hexdigest()
+        built = os.path.isfile(os.path.join(client_dir, "dist", "index.html"))
+        timed("fingerprint sources", started)
+
+        started = time.perf_counter()
+        if force or not built or read_fingerprint(client_dir, "build") != sources:
+            # a failed build must not leave the previous fingerprint behind
+            write_fingerprint(client_dir, "build", "")
+            if run_streamed(['npm', 'run', 'build'], client_dir, "npm run build") != 0:
+                print("Error during React build: npm run build failed")
+                return False
+            timed("npm run build", started)
+
+            started = time.perf_counter()
+            compressed = precompress_directory(os.path.join(client_dir, "dist"))
+            write_fingerprint(client_dir, "build", sources)
+            timed(f"precompress ({compressed} files)", started)
+        else:
+            timed("npm run build (skipped, sources unchanged)", started)
+        return True
     except Exception as e:
         print(f"Error during React build: {e}")
+        return False
+    finally:
+        for stage, seconds in timings:
+            print(f"[build] {stage}: {seconds:.2f}s")
+        print(f"[build] total: {sum(seconds for _, seconds in timings):.2f}s")
 
 if __name__ == '__main__':
     # output_directory = 'build'
-    build_react_app()
-    # os.makedirs(output_directory, exist_ok=True)
-    # clear_directory(output_directory)
-    # pack_web_project("web", output_directory, ["resources"], [".gitignore"])
\ No newline at end of file
+    if not build_react_app(force="--force" in sys.argv[1:]):
+        sys.exit(1)
+    # pack_web_project("web", output_directory, ["resources"], [".gitignore"])
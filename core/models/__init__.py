@@ -1,7 +1,7 @@
 from pydantic import BaseModel
 from typing import Optional, List, Any
 from datetime import datetime, timedelta
-from . import users, diaries
+from . import base, users, diaries
 
 
 class Token(BaseModel):
@@ -12,4 +12,6 @@ class Token(BaseModel):
 
 def initialize(db_session):
     users.initialize(db_session)
-    diaries.initialize(db_session)
\ No newline at end of file
+    diaries.initialize(db_session)
+    # report any registered query that the planner cannot serve from an index
+    base.find_collection_scans(db_session)
@@ -1,7 +1,17 @@
+import json
+import logging
 from pydantic import BaseModel
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Dict, Tuple
 from datetime import datetime, timedelta
 from enum import Enum
+from bson.objectid import ObjectId
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
 
 
 class Mongo_Object(BaseModel):
@@ -33,6 +43,66 @@ class Mongo_Object(BaseModel):
                 objects.append(cls(**r))
             return objects
 
+    @classmethod
+    def convert_results_to_documents(cls, results, id_key="_id"):
+        """Like `convert_results_to_objects` but skips pydantic validation and returns plain dicts.
+
+        Only for documents read back from our own collections, which were
+        validated when they were written. Combine with `projection()` so no
+        field outside the model reaches the client. Optional fields missing
+        from a document, such as the ones added after it was written, get
+        their default as they would with validation.
+        """
+        if results is None:
+            return None
+        defaults = cls.defaults()
+        if isinstance(results, dict):
+            results["id"] = str(results.pop(id_key))
+            for field, value in defaults.items():
+                results.setdefault(field, value)
+            return results
+        documents = []
+        for r in results:
+            r["id"] = str(r.pop(id_key))
+            for field, value in defaults.items():
+                r.setdefault(field, value)
+            documents.append(r)
+        return documents
+
+    @classmethod
+    def defaults(cls):
+        """Default of every optional field of this model."""
+        return {field: info.get_default() for field, info in cls.__fields__.items() if not info.required}
+
+    @classmethod
+    def projection(cls):
+        """MongoDB projection selecting exactly the fields of this model."""
+        return {field: 1 for field in cls.__fields__ if field != "id"}
+
+
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """Encodes raw documents straight to JSON bytes, converting ObjectId and datetime like jsonable_encoder."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_json_default)
+    return json.dumps(content, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(content):
+    """Decodes JSON bytes or text, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
 
 class Session(BaseModel):
     user_id: str
@@ -40,3 +110,89 @@ class Session(BaseModel):
     updated_stamp: datetime
     closed: Optional[bool] = False
 
+
+
+class Index_Spec(BaseModel):
+    """A MongoDB index the model needs; `keys` uses pymongo's [(field, direction)] form."""
+    keys: List[Tuple[str, Any]]
+    unique: bool = False
+    name: Optional[str] = None
+    # relative weights of the fields of a text index
+    weights: Optional[Dict[str, int]] = None
+
+
+class Query_Shape(BaseModel):
+    """A representative query a model runs, used to check the planner picks an index."""
+    name: str
+    filter: Dict[str, Any]
+    sort: Optional[List[Tuple[str, int]]] = None
+
+
+class Collection_Indexes(BaseModel):
+    collection: str
+    indexes: List[Index_Spec] = []
+    query_shapes: List[Query_Shape] = []
+
+
+# collection name -> the indexes and query shapes declared by its model
+index_registry: Dict[str, Collection_Indexes] = {}
+
+
+def register_indexes(collection, indexes=None, query_shapes=None):
+    """Declares the indexes a model needs and the query shapes that rely on them."""
+    entry = index_registry.setdefault(collection, Collection_Indexes(collection=collection))
+    entry.indexes.extend(indexes or [])
+    entry.query_shapes.extend(query_shapes or [])
+    return entry
+
+
+def build_indexes(db_session, collection=None):
+    """Creates every registered index (or only those of `collection`) in the background."""
+    entries = [index_registry[collection]] if collection else list(index_registry.values())
+    for entry in entries:
+        db_collection = db_session.get_collection(entry.collection)
+        for spec in entry.indexes:
+            options = {"background": True, "unique": spec.unique}
+            if spec.name is not None:
+                options["name"] = spec.name
+            if spec.weights is not None:
+                options["weights"] = spec.weights
+            try:
+                db_collection.create_index(spec.keys, **options)
+            except Exception as e:
+                logger.error("Failed to create index %s on %s: %s", spec.keys, entry.collection, e)
+
+
+def _plan_stages(plan):
+    """Yields every stage name in an explain plan tree."""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+def find_collection_scans(db_session, collection=None):
+    """Explains every registered query shape and returns the names of those that fall back to COLLSCAN."""
+    entries = [index_registry[collection]] if collection else list(index_registry.values())
+    collscans = []
+    for entry in entries:
+        db_collection = db_session.get_collection(entry.collection)
+        for shape in entry.query_shapes:
+            try:
+                cursor = db_collection.find(shape.filter)
+                if shape.sort:
+                    cursor = cursor.sort(shape.sort)
+                explanation = cursor.explain()
+            except Exception as e:
+                logger.error("Failed to explain query %s on %s: %s", shape.name, entry.collection, e)
+                continue
+            winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+            if "COLLSCAN" in _plan_stages(winning_plan):
+                logger.warning("Query %s on %s falls back to COLLSCAN: %s", shape.name, entry.collection, shape.filter)
+                collscans.append(f"{entry.collection}.{shape.name}")
+    return collscans
@@ -1,26 +1,40 @@
 # core/models/diaries.py
-import logging
+import base64
+import html
+import json
 import os
+import re
 import pytz
 
-from pymongo import DESCENDING, ASCENDING
+from pymongo import DESCENDING, ASCENDING, TEXT, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
 from datetime import datetime
 from bson.objectid import ObjectId
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict
 from . import base, users
+from ..services import logs
 from enum import Enum
 
-# Set up the logging configuration based on environment
-APP_ENV = os.getenv("APP_ENV", "prod")
-LOG_LEVEL = logging.DEBUG if APP_ENV in ["dev", "debug-diariesModel"] else logging.INFO
+logger = logs.get_logger(__name__, "debug-diariesModel")
 
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format='[%(asctime)s] [%(filename)s:%(lineno)s - %(funcName)20s() ] %(levelname)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-logger = logging.getLogger(__name__)
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# newest first; `_id` breaks ties between diaries created in the same millisecond
+FEED_SORT = [("created_stamp", DESCENDING), ("_id", DESCENDING)]
+# diaries written per insert_many call of a bulk import
+IMPORT_BATCH_SIZE = 500
+# an import report lists at most this many failed records; the rest are only counted
+MAX_IMPORT_ERRORS = 1000
+# longest title/snippet kept in a diary summary, in characters
+SUMMARY_TEXT_LENGTH = 280
+# longest text of a diary that is indexed for search, in characters
+SEARCH_TEXT_LENGTH = 100000
+# searches page by offset, so deep pages are capped
+MAX_SEARCH_RESULTS = 1000
+_TAGS = re.compile(r"<[^>]*>")
+# block data keys holding URLs or settings rather than text
+_NON_TEXT_KEYS = {"url", "link", "file", "source", "embed", "service", "style", "alignment"}
 
 # class EditorJsBlockType(str, Enum):
 #     header = "header"
@@ -53,32 +67,89 @@ class New_Diary(BaseModel):
 class Edited_Diary(BaseModel):
     content: Optional[EditorJs] = None
     published: Optional[bool] = False
+    # the version the edit is based on; when given, a newer stored diary is a conflict
+    version: Optional[int] = None
     # comments: Optional[List[Comment]] = None
    
 class Creator(BaseModel):
     id: str
     username: str
 
+# precomputed on write so feeds can be listed without the blocks
+class Diary_Summary(BaseModel):
+    title: str = ""
+    snippet: str = ""
+    block_count: int = 0
+    byte_size: int = 0
+
 # what to be add in the model
 class Diary(base.Mongo_Object, New_Diary):
     creator: Creator
     created_stamp: datetime
+    summary: Optional[Diary_Summary] = None
+    # incremented by every update, see Edited_Diary.version
+    version: int = 0
     
     class Config:
         json_encoders = {
             ObjectId: str,
         }
 
+# a diary as listed in the summary view: everything but the content
+class Diary_Preview(base.Mongo_Object):
+    published: bool
+    team: str
+    creator: Creator
+    created_stamp: datetime
+    summary: Optional[Diary_Summary] = None
+
+    class Config:
+        json_encoders = {
+            ObjectId: str,
+        }
+
+class Diary_Conflict(Exception):
+    """Raised when a diary was modified since the version an edit is based on."""
+
+    def __init__(self, diary_id, version):
+        super().__init__(f"Diary {diary_id} is no longer at version {version}")
+        self.diary_id = diary_id
+        self.version = version
+
+# listing view -> model whose fields are projected
+LISTING_VIEWS = {
+    "full": Diary,
+    "summary": Diary_Preview,
+}
+
+base.register_indexes(
+    "diaries",
+    indexes=[
+        base.Index_Spec(keys=[("published", ASCENDING), ("created_stamp", DESCENDING), ("_id", DESCENDING)]),
+        base.Index_Spec(keys=[("published", ASCENDING), ("team", ASCENDING), ("created_stamp", DESCENDING), ("_id", DESCENDING)]),
+        base.Index_Spec(keys=[("creator.id", ASCENDING), ("published", ASCENDING), ("created_stamp", DESCENDING), ("_id", DESCENDING)]),
+        base.Index_Spec(keys=[("summary.title", TEXT), ("search_text", TEXT)], name="diary_text", weights={"summary.title": 5, "search_text": 1}),
+    ],
+    query_shapes=[
+        base.Query_Shape(name="public_feed", filter={"published": True}, sort=FEED_SORT),
+        base.Query_Shape(name="public_team_feed", filter={"published": True, "team": ""}, sort=FEED_SORT),
+        base.Query_Shape(name="creator_feed", filter={"published": True, "creator.id": ""}, sort=FEED_SORT),
+        base.Query_Shape(name="creator_diary", filter={"_id": ObjectId(), "creator.id": ""}),
+        base.Query_Shape(name="text_search", filter={"$text": {"$search": "diary"}, "published": True}),
+    ],
+)
+
 def initialize(db_session):
     try:
         diary_db = db_session.get_collection("diaries")
-        # Drop the existing unique index on the creator field if it exists
+        # Drop the legacy indexes on the creator field, they are superseded by the compound indexes
         existing_indexes = diary_db.index_information()
-        if 'creator' in existing_indexes:
-            diary_db.drop_index('creator')
-        diary_db.create_index([("creator", ASCENDING)])
+        for legacy_index in ("creator", "creator_1"):
+            if legacy_index in existing_indexes:
+                diary_db.drop_index(legacy_index)
+        base.build_indexes(db_session, "diaries")
     except Exception as e:
-        pass
+        logger.error("Error initializing diary collection: %s", e)
 
 def add(db_session, new_diary: New_Diary, user: users.User):
     """Adds a new diary to the database. Returns the new diary's ID, or an error if one occurred."""
@@ -87,9 +158,7 @@ def add(db_session, new_diary: New_Diary, user: users.User):
     assert user is not None, "user cannot be None"
 
     diary_db = db_session.get_collection("diaries")
-    diary = new_diary.dict()
-    diary["created_stamp"] = datetime.now(pytz.utc)
-    diary["creator"] = {"id": str(user.id), "username": user.username}
+    diary = _new_diary_document(new_diary, user)
     try:
         result = diary_db.insert_one(diary)
     except Exception as e:
@@ -100,79 +169,214 @@ def add(db_session, new_diary: New_Diary, user: users.User):
     
     return str(result.inserted_id)
 
+def _new_diary_document(new_diary: New_Diary, user: users.User):
+    diary = new_diary.dict()
+    diary["created_stamp"] = datetime.now(pytz.utc)
+    diary["creator"] = {"id": str(user.id), "username": user.username}
+    diary.update(_derived_fields(diary["content"]))
+    diary["version"] = 0
+    return diary
+
+def summarize(content: dict):
+    """Builds the Diary_Summary fields of an EditorJS `content` dict."""
+    blocks = content.get("blocks") or []
+    summary = {
+        "title": "",
+        "snippet": "",
+        "block_count": len(blocks),
+        "byte_size": len(base.dumps(content)),
+    }
+    for block in blocks:
+        field = {"header": "title", "paragraph": "snippet"}.get(block.get("type"))
+        if field is None or summary[field]:
+            continue
+        summary[field] = _plain_text(block.get("data", {}).get("text", ""))[:SUMMARY_TEXT_LENGTH]
+        if summary["title"] and summary["snippet"]:
+            break
+    return summary
+
+def extract_text(content: dict):
+    """Returns the plain text of every block of an EditorJS `content` dict, as indexed for search."""
+    parts = []
+    for block in content.get("blocks") or []:
+        _collect_text(block.get("data"), parts)
+    return " ".join(parts)[:SEARCH_TEXT_LENGTH]
+
+def _collect_text(value, parts):
+    # block types nest their text differently (list items, table rows, checklist entries...)
+    if isinstance(value, str):
+        text = _plain_text(value)
+        if text:
+            parts.append(text)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            if key not in _NON_TEXT_KEYS:
+                _collect_text(item, parts)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_text(item, parts)
+
+def _plain_text(text):
+    # EditorJS stores inline markup (<b>, <a>, &nbsp;...) in block text
+    return " ".join(html.unescape(_TAGS.sub("", str(text))).split())
+
+def _derived_fields(content: dict):
+    # stored next to the content and recomputed whenever it changes
+    return {"summary": summarize(content), "search_text": extract_text(content)}
+
+def backfill_derived_fields(db_session, batch_size=500):
+    """Stores the summary, search text and version of every diary written before they existed. Returns how many were updated."""
+    diary_db = db_session.get_collection("diaries")
+    # unversioned diaries start at 0, which is what clients send for them
+    versioned = diary_db.update_many({"version": {"$exists": False}}, {"$set": {"version": 0}}).modified_count
+    logger.info("Backfilled the version of %s diaries", versioned)
+    updated = 0
+    operations = []
+    missing = {"$or": [{"summary": {"$exists": False}}, {"search_text": {"$exists": False}}]}
+    for diary in diary_db.find(missing, {"content": 1}):
+        operations.append(UpdateOne({"_id": diary["_id"]}, {"$set": _derived_fields(diary.get("content") or {})}))
+        if len(operations) >= batch_size:
+            updated += diary_db.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        updated += diary_db.bulk_write(operations, ordered=False).modified_count
+    logger.info("Backfilled summaries and search text of %s diaries", updated)
+    return updated
+
 def get_diary_by_id(db_session, diary_id, user: users.User):
-    allowed = verify_right_to_modify(db_session, diary_id, user)
-    if not allowed:
-        raise RuntimeError("Failed to verify right to modify diary")
-    
+    """Returns the diary with the given ID if `user` created it, otherwise None."""
     diary_db = db_session.get_collection("diaries")
-    result = diary_db.find_one({
-        "_id": ObjectId(diary_id),
-        "creator.id": str(user.id)
-    })
-    if result is None:
-        return None
-    else:
-        result = Diary.convert_results_to_objects(result)
-        # result["id"] = str(result["_id"])
-        # result["created_stamp"] = str(result["created_stamp"])
-        
-    return result
+    result = diary_db.find_one(_owned_query(diary_id, user), Diary.projection())
+    return Diary.convert_results_to_objects(result)
+
+def get_visible_diary(db_session, diary_id, user: users.User):
+    """Returns the diary with the given ID if it is published or `user` created it, otherwise None."""
+    diary_db = db_session.get_collection("diaries")
+    result = diary_db.find_one(_visible_query(diary_id, user), Diary.projection())
+    return Diary.convert_results_to_objects(result)
+
+def _visible_query(diary_id, user: users.User):
+    return {"_id": ObjectId(diary_id), "$or": [{"published": True}, {"creator.id": str(user.id)}]}
+
+def _owned_query(diary_id, user: users.User, version=None):
+    # ownership is part of the filter, so reads and writes need no separate check
+    query = {"_id": ObjectId(diary_id), "creator.id": str(user.id)}
+    if version is not None:
+        # diaries written before versioning have no version field; null matches them
+        query["version"] = version if version else {"$in": [0, None]}
+    return query
 
 # get public diaries of all users
-def get_public_diaries(db_session, team):
+def get_public_diaries(db_session, team, limit=DEFAULT_PAGE_SIZE, cursor=None, validate=True, view="full"):
     diary_db = db_session.get_collection("diaries")
+    query = _public_query(team)
+    logger.debug("Query: %s", query)
+    return paginate(diary_db, query, limit, cursor, validate, view)
+
+def _public_query(team):
     query = {"published": True}
     if team != "all":
         query['team'] = team
-    logger.debug("Query: %s", query)
-    diaries_cursor = diary_db.find(query)
-    logger.debug("Diaries cursor: %s", diaries_cursor)
-    diaries_list = []
-    for diary in diaries_cursor:
-        diary_obj = Diary.convert_results_to_objects(diary)
-        logger.debug("Diary object: %s", diary_obj)
-        diaries_list.append(diary_obj)
-    diaries_list = sort_diaries(diaries_list, sort_by="created_stamp", sort_type="desc")
-    return diaries_list, len(diaries_list)
+    return query
+
+def _published_query(user: users.User):
+    return {"published": True, "creator.id": str(user.id)}
+
+def _private_query(user: users.User):
+    return {"published": False, "creator.id": str(user.id)}
+
+# listing name -> builds its query from the team name or the user
+LISTING_QUERIES = {
+    "public": _public_query,
+    "published": _published_query,
+    "private": _private_query,
+}
 
 # get published diaries of current user
-def get_published_diaries(db_session, user: users.User):
+def get_published_diaries(db_session, user: users.User, limit=DEFAULT_PAGE_SIZE, cursor=None, validate=True, view="full"):
     diary_db = db_session.get_collection("diaries")
-    query = {"published": True, "creator.id": str(user.id)}
+    query = _published_query(user)
     logger.debug("Query: %s", query)
-    diaries_cursor = diary_db.find(query)
-    logger.debug("Diaries cursor: %s", diaries_cursor)
-    diaries_list = []
-    for diary in diaries_cursor:
-        diary_obj = Diary.convert_results_to_objects(diary)
-        logger.debug("Diary object: %s", diary_obj)
-        diaries_list.append(diary_obj)
-    diaries_list = sort_diaries(diaries_list, sort_by="created_stamp", sort_type="desc")
-    return diaries_list, len(diaries_list)
+    return paginate(diary_db, query, limit, cursor, validate, view)
 
 # get private diaries of current user
-def get_private_diaries(db_session, user: users.User):
+def get_private_diaries(db_session, user: users.User, limit=DEFAULT_PAGE_SIZE, cursor=None, validate=True, view="full"):
     if db_session is None or user is None:
         raise ValueError("db_session and user cannot be None")
 
     diary_db = db_session.get_collection("diaries")
     if diary_db is None:
         raise RuntimeError("Diary database not available")
-    query = {"published": False, "creator.id": str(user.id)}
-    diaries_cursor = diary_db.find(query)
-    diaries_list = []
-    for diary in diaries_cursor:
-        diary_obj = Diary.convert_results_to_objects(diary)
-        logger.debug("Diary object: %s", diary_obj)
-        diaries_list.append(diary_obj)
-    diaries_list = sort_diaries(diaries_list, sort_by="created_stamp", sort_type="desc")
-    return diaries_list, len(diaries_list)
+    query = _private_query(user)
+    return paginate(diary_db, query, limit, cursor, validate, view)
+
+def encode_cursor(created_stamp: datetime, diary_id) -> str:
+    """Encodes the position of a diary in the feed ordering as an opaque cursor string."""
+    payload = json.dumps({"t": created_stamp.isoformat(), "i": str(diary_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Decodes a cursor produced by `encode_cursor`. Raises ValueError if it is malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(payload["t"]), ObjectId(payload["i"])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def paginate(diary_db, query, limit=DEFAULT_PAGE_SIZE, cursor=None, validate=True, view="full"):
+    """Returns one page of diaries matching `query`, newest first.
+
+    Pagination is keyset based on (`created_stamp`, `_id`) so MongoDB only reads
+    the requested page. Returns a tuple of (diaries, total count, next cursor);
+    the next cursor is None on the last page.
+
+    With `validate=False` the diaries are returned as plain dicts shaped like
+    `Diary` (see `Mongo_Object.convert_results_to_documents`), ready for
+    `base.dumps`, instead of pydantic objects.
+
+    `view` is a key of LISTING_VIEWS; "summary" leaves the content out and
+    returns `Diary_Preview`s.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    page_query = _page_query(query, cursor)
+
+    count = diary_db.count_documents(query)
+    # fetch one extra document to know whether another page exists
+    model = LISTING_VIEWS[view]
+    documents = list(diary_db.find(page_query, model.projection()).sort(FEED_SORT).limit(limit + 1))
+    return _page_result(documents, count, limit, validate, model)
+
+def _page_query(query, cursor):
+    page_query = dict(query)
+    if cursor:
+        created_stamp, last_id = decode_cursor(cursor)
+        page_query["$or"] = [
+            {"created_stamp": {"$lt": created_stamp}},
+            {"created_stamp": created_stamp, "_id": {"$lt": last_id}},
+        ]
+    return page_query
+
+def _page_result(documents, count, limit, validate=True, model=Diary):
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        last = documents[-1]
+        next_cursor = encode_cursor(last["created_stamp"], last["_id"])
+    if validate:
+        return model.convert_results_to_objects(documents), count, next_cursor
+    return model.convert_results_to_documents(documents), count, next_cursor
 
 # update the selected diary
 def update(db_session, diary_id, user: users.User, edited_diary: Edited_Diary):
-    """Updates the diary with the given ID in the database.
-    Returns whether the update was successful.
+    """Updates the diary with the given ID in a single round trip.
+
+    Only the fields set on `edited_diary` are written, and only a diary
+    created by `user` matches. When `edited_diary.version` is given the update
+    applies only if the stored diary still has that version, otherwise
+    Diary_Conflict is raised. Returns the updated Diary and whether the diary
+    was published before the update, or (None, None) if the user has no diary
+    with this ID.
     """
     if diary_id is None:
         raise ValueError("diary_id cannot be None")
@@ -181,58 +385,64 @@ def update(db_session, diary_id, user: users.User, edited_diary: Edited_Diary):
     diary_db = db_session.get_collection("diaries")
     if diary_db is None:
         raise RuntimeError("Diary database not available")
-    
-    allowed = verify_right_to_modify(db_session, diary_id, user)
-    if not allowed:
-        raise RuntimeError("Failed to verify right to modify diary")
-    
-    diary_data = edited_diary.dict(exclude_unset=True)
-    if diary_data is None:
-        raise RuntimeError("Failed to convert diary data to dict")
-
-    diary = diary_db.find_one({
-        "_id": ObjectId(diary_id),
-        "creator.id": str(user.id)
-    })
-    if diary is None:
-        return False
-
-    for field in diary:
-        if field not in diary_data:
-            diary_data[field] = diary[field]
 
+    query = _owned_query(diary_id, user, edited_diary.version)
+    update = _update_document(edited_diary)
     try:
-        result = diary_db.update_one({
-            "_id": ObjectId(diary_id),
-            "creator.id": str(user.id)
-        }, {
-            "$set": diary_data
-        })
+        previous = diary_db.find_one_and_update(query, update, projection=Diary.projection(), return_document=ReturnDocument.BEFORE)
     except Exception as e:
         raise RuntimeError("Failed to update diary in database") from e
 
-    return result.modified_count > 0
+    if previous is None:
+        # tell a stale version apart from a missing diary, only on the failure path
+        if edited_diary.version is not None and diary_db.find_one(_owned_query(diary_id, user), {"_id": 1}) is not None:
+            raise Diary_Conflict(diary_id, edited_diary.version)
+        return None, None
+    return _updated_diary(previous, update), previous.get("published", False)
+
+def _updated_diary(previous, update):
+    # the diary as stored after `update`, built from the document it replaced so one round trip gives both states
+    projection = Diary.projection()
+    document = dict(previous)
+    for field, value in update.get("$set", {}).items():
+        if field in projection:
+            document[field] = value
+    for field, value in update.get("$inc", {}).items():
+        document[field] = document.get(field, 0) + value
+    return Diary.convert_results_to_objects(document)
+
+def _update_document(edited_diary: Edited_Diary):
+    diary_data = edited_diary.dict(exclude_unset=True, exclude={"version"})
+    if diary_data.get("content") is not None:
+        diary_data.update(_derived_fields(diary_data["content"]))
+    update = {"$inc": {"version": 1}}
+    if diary_data:
+        update["$set"] = diary_data
+    return update
 
 # delete the selected diary
-def delete(db_session, diary_id, user: users.User):
+def delete(db_session, diary_id, user: users.User, version=None):
+    """Deletes the diary with the given ID if `user` created it, in a single round trip.
+
+    With `version`, the diary is deleted only if it still has that version,
+    otherwise Diary_Conflict is raised. Returns the deleted diary as a
+    Diary_Preview, or None if the user has no diary with this ID.
+    """
     if diary_id is None:
-        return ValueError("diary_id cannot be None")
+        raise ValueError("diary_id cannot be None")
     diary_db = db_session.get_collection("diaries")
     if diary_db is None:
         raise RuntimeError("Diary database not available")
-    allowed = verify_right_to_modify(db_session, diary_id, user)
-    if not allowed:
-        raise RuntimeError("Failed to verify right to modify diary")
 
     try:
-        result = diary_db.delete_one({
-            "_id": ObjectId(diary_id),
-            "creator.id": str(user.id)
-        })
+        result = diary_db.find_one_and_delete(_owned_query(diary_id, user, version), projection=Diary_Preview.projection())
     except Exception as e:
         raise RuntimeError("Failed to delete diary") from e
 
-    return result.deleted_count > 0
+    if result is None and version is not None:
+        if diary_db.find_one(_owned_query(diary_id, user), {"_id": 1}) is not None:
+            raise Diary_Conflict(diary_id, version)
+    return Diary_Preview.convert_results_to_objects(result)
 
 def verify_right_to_modify(db_session, diary_id, user: users.User):
     logger.debug("Verifying right to modify diary: %s", diary_id)
@@ -251,6 +461,9 @@ def verify_right_to_modify(db_session, diary_id, user: users.User):
     except Exception as e:
         raise RuntimeError("Failed to find diary") from e
 
+    return _is_creator(diary, diary_id, user)
+
+def _is_creator(diary, diary_id, user: users.User):
     if diary is None:
         logger.debug("Diary not found: %s", diary_id)
         return False
@@ -265,4 +478,267 @@ def verify_right_to_modify(db_session, diary_id, user: users.User):
 # General function to sort diaries by a specified attribute and sort type
 def sort_diaries(diaries_list, sort_by, sort_type="desc"):
     reverse = True if sort_type == "desc" else False
-    return sorted(diaries_list, key=lambda x: getattr(x, sort_by), reverse=reverse)
\ No newline at end of file
+    return sorted(diaries_list, key=lambda x: getattr(x, sort_by), reverse=reverse)
+
+# asyncio variants of the functions above, for callers holding a session from
+# `database.get_async_session()` (Motor). They behave exactly like their blocking
+# counterparts but never block the event loop on a database round trip.
+
+async def add_async(db_session, new_diary: New_Diary, user: users.User):
+    """Adds a new diary to the database. Returns the new diary's ID, or an error if one occurred."""
+    assert db_session is not None, "db_session cannot be None"
+    assert new_diary is not None, "new_diary cannot be None"
+    assert user is not None, "user cannot be None"
+
+    diary_db = db_session.get_collection("diaries")
+    diary = _new_diary_document(new_diary, user)
+    try:
+        result = await diary_db.insert_one(diary)
+    except Exception as e:
+        return f"Error adding diary to database: {e}"
+
+    if result.inserted_id is None:
+        return "Error adding diary to database: no ID returned"
+
+    return str(result.inserted_id)
+
+async def get_diary_by_id_async(db_session, diary_id, user: users.User):
+    diary_db = db_session.get_collection("diaries")
+    result = await diary_db.find_one(_owned_query(diary_id, user), Diary.projection())
+    return Diary.convert_results_to_objects(result)
+
+async def get_visible_diary_async(db_session, diary_id, user: users.User):
+    """Async version of `get_visible_diary`."""
+    diary_db = db_session.get_collection("diaries")
+    result = await diary_db.find_one(_visible_query(diary_id, user), Diary.projection())
+    return Diary.convert_results_to_objects(result)
+
+async def get_public_diaries_async(db_session, team, limit=DEFAULT_PAGE_SIZE, cursor=None, validate=True, view="full"):
+    diary_db = db_session.get_collection("diaries")
+    query = _public_query(team)
+    logger.debug("Query: %s", query)
+    return await paginate_async(diary_db, query, limit, cursor, validate, view)
+
+async def get_published_diaries_async(db_session, user: users.User, limit=DEFAULT_PAGE_SIZE, cursor=None, validate=True, view="full"):
+    diary_db = db_session.get_collection("diaries")
+    query = _published_query(user)
+    logger.debug("Query: %s", query)
+    return await paginate_async(diary_db, query, limit, cursor, validate, view)
+
+async def get_private_diaries_async(db_session, user: users.User, limit=DEFAULT_PAGE_SIZE, cursor=None, validate=True, view="full"):
+    if db_session is None or user is None:
+        raise ValueError("db_session and user cannot be None")
+
+    diary_db = db_session.get_collection("diaries")
+    query = _private_query(user)
+    return await paginate_async(diary_db, query, limit, cursor, validate, view)
+
+async def paginate_async(diary_db, query, limit=DEFAULT_PAGE_SIZE, cursor=None, validate=True, view="full"):
+    """Async version of `paginate`."""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    page_query = _page_query(query, cursor)
+
+    count = await diary_db.count_documents(query)
+    model = LISTING_VIEWS[view]
+    diaries_cursor = diary_db.find(page_query, model.projection()).sort(FEED_SORT).limit(limit + 1)
+    documents = await diaries_cursor.to_list(length=limit + 1)
+    return _page_result(documents, count, limit, validate, model)
+
+async def stream_listing_async(db_session, listing, subject, limit=DEFAULT_PAGE_SIZE, cursor=None, view="full"):
+    """Streaming variant of the get_*_diaries_async listings.
+
+    `listing` is a key of LISTING_QUERIES and `subject` the team or user it
+    takes; `view` is a key of LISTING_VIEWS. Returns (count, page, documents):
+    `documents` is an async generator yielding JSON-ready diaries as they
+    arrive from the cursor, and once it is exhausted `page["next_cursor"]`
+    holds the cursor of the next page.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = LISTING_QUERIES[listing](subject)
+    # decode the cursor now so a bad one fails before the response starts
+    page_query = _page_query(query, cursor)
+    diary_db = db_session.get_collection("diaries")
+    count = await diary_db.count_documents(query)
+    page = {"next_cursor": None}
+    return count, page, _stream_page(diary_db, page_query, limit, page, LISTING_VIEWS[view])
+
+async def _stream_page(diary_db, page_query, limit, page, model):
+    diaries_cursor = diary_db.find(page_query, model.projection()).sort(FEED_SORT).limit(limit + 1)
+    sent = 0
+    last_position = None
+    async for document in diaries_cursor:
+        if sent == limit:
+            page["next_cursor"] = encode_cursor(*last_position)
+            break
+        last_position = (document["created_stamp"], document["_id"])
+        yield model.convert_results_to_documents(document)
+        sent += 1
+
+async def search_async(db_session, text, user: users.User, team=None, published=True, limit=DEFAULT_PAGE_SIZE, cursor=None, view="summary"):
+    """Full-text search over diaries, best matches first.
+
+    Searches the public diaries (of `team` unless it is None or "all"), or
+    with `published=False` the private diaries of `user`. Each result carries
+    its text `score`. Returns (diaries, total count, next cursor) like the
+    listings; pages are offsets, so at most MAX_SEARCH_RESULTS are reachable.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    offset = decode_search_cursor(cursor) if cursor else 0
+    if published:
+        query = _public_query(team or "all")
+    else:
+        query = _private_query(user)
+    query["$text"] = {"$search": text}
+
+    diary_db = db_session.get_collection("diaries")
+    count = await diary_db.count_documents(query)
+    projection = LISTING_VIEWS[view].projection()
+    projection["score"] = {"$meta": "textScore"}
+    diaries_cursor = (
+        diary_db.find(query, projection)
+        .sort([("score", {"$meta": "textScore"}), ("created_stamp", DESCENDING)])
+        .skip(offset)
+        .limit(limit)
+    )
+    documents = await diaries_cursor.to_list(length=limit)
+
+    next_offset = offset + len(documents)
+    next_cursor = None
+    if next_offset < min(count, MAX_SEARCH_RESULTS):
+        next_cursor = encode_search_cursor(next_offset)
+    return LISTING_VIEWS[view].convert_results_to_documents(documents), count, next_cursor
+
+def encode_search_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"o": offset}).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_search_cursor(cursor: str) -> int:
+    """Decodes a cursor produced by `encode_search_cursor`. Raises ValueError if it is malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        offset = int(json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))["o"])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not 0 <= offset < MAX_SEARCH_RESULTS:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return offset
+
+async def import_async(db_session, records, user: users.User, batch_size=IMPORT_BATCH_SIZE):
+    """Bulk-inserts diaries created by `user`.
+
+    `records` is an async iterable of (line number, JSON bytes), one diary
+    each, or (line number, exception) for a line the reader rejected. Every
+    record is validated as a New_Diary; invalid records and failed inserts are
+    reported by line number and do not stop the import. Valid
+    diaries are written with unordered `insert_many` calls of `batch_size`.
+
+    Returns {"inserted": count, "failed": count, "errors": [{"line", "error"}],
+    "teams": teams that received diaries}.
+    """
+    diary_db = db_session.get_collection("diaries")
+    report = {"inserted": 0, "failed": 0, "errors": [], "teams": set()}
+    batch, lines = [], []
+    async for line, raw in records:
+        if isinstance(raw, Exception):
+            _import_error(report, line, raw)
+            continue
+        try:
+            new_diary = New_Diary.parse_obj(base.loads(raw))
+        except Exception as e:
+            _import_error(report, line, e)
+            continue
+        batch.append(_new_diary_document(new_diary, user))
+        lines.append(line)
+        if len(batch) >= batch_size:
+            await _insert_batch_async(diary_db, batch, lines, report)
+            batch, lines = [], []
+    if batch:
+        await _insert_batch_async(diary_db, batch, lines, report)
+
+    report["teams"] = sorted(report["teams"])
+    logger.info("Imported %s diaries for %s, %s failed", report["inserted"], user.id, report["failed"])
+    return report
+
+async def _insert_batch_async(diary_db, batch, lines, report):
+    failed = {}
+    try:
+        await diary_db.insert_many(batch, ordered=False)
+    except BulkWriteError as e:
+        failed = {error["index"]: error.get("errmsg", "insert failed") for error in e.details.get("writeErrors", [])}
+    except Exception as e:
+        failed = {index: str(e) for index in range(len(batch))}
+
+    for index, diary in enumerate(batch):
+        if index in failed:
+            _import_error(report, lines[index], failed[index])
+        else:
+            report["inserted"] += 1
+            report["teams"].add(diary["team"])
+
+def _import_error(report, line, error):
+    report["failed"] += 1
+    if len(report["errors"]) < MAX_IMPORT_ERRORS:
+        report["errors"].append({"line": line, "error": str(error)})
+
+async def export_async(db_session, user: users.User, team=None):
+    """Yields diaries as JSON-ready dicts straight from the cursor, in storage order.
+
+    Without `team`, every diary created by `user`; with it, the public
+    diaries of that team, as in the public feed. The dicts are shaped like
+    Diary, so they can be imported again as New_Diary records.
+    """
+    query = _public_query(team) if team else {"creator.id": str(user.id)}
+    diaries_cursor = db_session.get_collection("diaries").find(query, Diary.projection(), batch_size=IMPORT_BATCH_SIZE)
+    async for diary in diaries_cursor:
+        yield Diary.convert_results_to_documents(diary)
+
+async def update_async(db_session, diary_id, user: users.User, edited_diary: Edited_Diary):
+    """Async version of `update`."""
+    if diary_id is None:
+        raise ValueError("diary_id cannot be None")
+    if edited_diary is None:
+        raise ValueError("edited_diary cannot be None or empty")
+    diary_db = db_session.get_collection("diaries")
+
+    query = _owned_query(diary_id, user, edited_diary.version)
+    update = _update_document(edited_diary)
+    try:
+        previous = await diary_db.find_one_and_update(query, update, projection=Diary.projection(), return_document=ReturnDocument.BEFORE)
+    except Exception as e:
+        raise RuntimeError("Failed to update diary in database") from e
+
+    if previous is None:
+        if edited_diary.version is not None and await diary_db.find_one(_owned_query(diary_id, user), {"_id": 1}) is not None:
+            raise Diary_Conflict(diary_id, edited_diary.version)
+        return None, None
+    return _updated_diary(previous, update), previous.get("published", False)
+
+async def delete_async(db_session, diary_id, user: users.User, version=None):
+    """Async version of `delete`."""
+    if diary_id is None:
+        raise ValueError("diary_id cannot be None")
+    diary_db = db_session.get_collection("diaries")
+
+    try:
+        result = await diary_db.find_one_and_delete(_owned_query(diary_id, user, version), projection=Diary_Preview.projection())
+    except Exception as e:
+        raise RuntimeError("Failed to delete diary") from e
+
+    if result is None and version is not None:
+        if await diary_db.find_one(_owned_query(diary_id, user), {"_id": 1}) is not None:
+            raise Diary_Conflict(diary_id, version)
+    return Diary_Preview.convert_results_to_objects(result)
+
+async def verify_right_to_modify_async(db_session, diary_id, user: users.User):
+    logger.debug("Verifying right to modify diary: %s", diary_id)
+    if diary_id is None:
+        return False
+
+    diary_db = db_session.get_collection("diaries")
+    try:
+        diary = await diary_db.find_one({
+            "_id": ObjectId(diary_id)
+        })
+    except Exception as e:
+        raise RuntimeError("Failed to find diary") from e
+
+    return _is_creator(diary, diary_id, user)
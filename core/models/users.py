@@ -1,26 +1,17 @@
-import logging
 import os
 from pymongo import DESCENDING, ASCENDING
 from datetime import datetime
 from bson.objectid import ObjectId
 from bson import json_util
-import bcrypt
 from pydantic import BaseModel, validator
 from typing import Optional, List, Any
 from . import base
+from ..services import hashing, logs
 from enum import Enum
 import pytz
 
 
-# Set up the logging configuration based on environment
-APP_ENV = os.getenv("APP_ENV", "prod")
-LOG_LEVEL = logging.DEBUG if APP_ENV in ["dev", "debug-usersMoodel"] else logging.INFO
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format='[%(asctime)s] [%(filename)s:%(lineno)s - %(funcName)20s() ] %(levelname)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-logger = logging.getLogger(__name__)
+logger = logs.get_logger(__name__, "debug-usersMoodel")
 
 class LoginForm(BaseModel):
     username: str
@@ -91,18 +82,29 @@ class User_Record(User):
     hashpwd: str
 
 
+base.register_indexes(
+    "users",
+    indexes=[
+        base.Index_Spec(keys=[("username", ASCENDING)], unique=True),
+        base.Index_Spec(keys=[("email", ASCENDING)], unique=True),
+    ],
+    query_shapes=[
+        base.Query_Shape(name="by_username", filter={"username": ""}, sort=[("username", ASCENDING)]),
+        base.Query_Shape(name="by_email", filter={"email": ""}, sort=[("email", ASCENDING)]),
+    ],
+)
+
+
 def initialize(db_session):
     try:
         logger.info("Initializing user collection")
-        user_db = db_session.get_collection("users")
-        user_db.create_index([("username", ASCENDING)], unique=True)
-        user_db.create_index([("email", ASCENDING)], unique=True)
+        base.build_indexes(db_session, "users")
     except Exception as e:
-        logger.error(f"Error initializing user collection: {str(e)}")
+        logger.error("Error initializing user collection: %s", e)
 
 
 def activate_user(db_session, user_id):
-    logger.info(f"Activating user with id: {user_id}")
+    logger.info("Activating user with id: %s", user_id)
     user_db = db_session.get_collection("users")
     result = user_db.update_one({
         "_id": ObjectId(user_id)
@@ -120,7 +122,7 @@ def activate_user(db_session, user_id):
 
 
 def check_password(db_session, username: str, password: str):
-    logger.info(f"Checking password for user: {username}")
+    logger.info("Checking password for user: %s", username)
     user_db = db_session.get_collection("users")
     user_data = user_db.find_one({
         "username": username
@@ -134,7 +136,7 @@ def check_password(db_session, username: str, password: str):
             logger.error("User not found")
             return False, None
 
-    result = bcrypt.checkpw(password.encode('utf-8'), user_data["hashpwd"])
+    result = hashing.check_password_sync(password, user_data["hashpwd"])
     if not result:
         logger.error("Password check failed")
         return False, None
@@ -143,9 +145,20 @@ def check_password(db_session, username: str, password: str):
 
 
 def add(db_session, new_user: New_User, user_type: User_Type):
-    logger.info(f"Adding new user with username: {new_user.username}")
+    logger.info("Adding new user with username: %s", new_user.username)
     user_db = db_session.get_collection("users")
-    hashedpwd = bcrypt.hashpw(new_user.password.encode('utf-8'), bcrypt.gensalt())
+    hashedpwd = hashing.hash_password_sync(new_user.password)
+    user_data = _new_user_document(new_user, user_type, hashedpwd)
+    try:
+        result = user_db.insert_one(user_data)
+        logger.info("User added successfully")
+        return str(result.inserted_id)
+    except Exception as e:
+        logger.error("Error adding new user: %s", e)
+        return None
+
+
+def _new_user_document(new_user: New_User, user_type: User_Type, hashedpwd: bytes):
     user_data = new_user.dict()
     user_data["user_type"] = user_type
     user_data["hashpwd"] = hashedpwd
@@ -154,17 +167,11 @@ def add(db_session, new_user: New_User, user_type: User_Type):
     user_data['activated'] = True
     # user_data["activated"] = user_data["member_since"] <= datetime(2024, 5, 25, tzinfo=pytz.timezone('Asia/Bangkok'))
     # user_data["user_type"] = User_Type.Admin if user_data["activated"] else User_Type.Client
-    try:
-        result = user_db.insert_one(user_data)
-        logger.info("User added successfully")
-        return str(result.inserted_id)
-    except Exception as e:
-        logger.error(f"Error adding new user: {str(e)}")
-        return None
+    return user_data
 
 
 def get_by_id(db_session, user_id: str):
-    logger.info(f"Fetching user by id: {user_id}")
+    logger.info("Fetching user by id: %s", user_id)
     user_db = db_session.get_collection("users")
     try:
         if not ObjectId.is_valid(user_id):
@@ -182,46 +189,46 @@ def get_by_id(db_session, user_id: str):
         logger.info("User found")
         return User.convert_results_to_objects(result)
     except Exception as e:
-        logger.error(f"Error fetching user by id: {str(e)}")
+        logger.error("Error fetching user by id: %s", e)
         return None
 
 
 def get_users(db_session, search_criteria, value, order="asc"):
     # sorting descending = -1, ascending = 1
-    logger.info(f"Fetching users with {search_criteria}={value} ordered by {order}")
+    logger.info("Fetching users with %s=%s ordered by %s", search_criteria, value, order)
     sort_order = DESCENDING if order == "desc" else ASCENDING
-    logger.debug(f"Sort order: {sort_order}")
+    logger.debug("Sort order: %s", sort_order)
     query = {search_criteria: value}
-    logger.debug(f"Query: {query}")
+    logger.debug("Query: %s", query)
     
     try:
         # users_cursor = db_session.get_collection("users").find({"user_type": "admin"}).sort({"username":1})
         users_cursor = db_session.get_collection("users").find(query).sort([(search_criteria, sort_order)])
 
-        logger.debug(f"Users cursor: {users_cursor}")
+        logger.debug("Users cursor: %s", users_cursor)
         users_list = []
         
         for user in users_cursor:
-            logger.debug(f"User: {user}")
+            logger.debug("User: %s", user)
             try:
                 user_obj = User.convert_results_to_objects(user)
-                logger.debug(f"User object: {user_obj}")
+                logger.debug("User object: %s", user_obj)
                 users_list.append(user_obj)
             except Exception as e:
-                logger.error(f"Error converting user data: {json_util.dumps(user)}, Error: {str(e)}")
+                logger.error("Error converting user data: %s, Error: %s", json_util.dumps(user), e)
                 
         logger.info("Users fetched successfully")
         return users_list
     except Exception as e:
-        logger.error(f"Error fetching users: {str(e)}")
+        logger.error("Error fetching users: %s", e)
         return []
     
 def update(db_session, user_id: str, edited_user: Edited_User_Data):
-    logger.info(f"Updating user with id: {user_id}")
+    logger.info("Updating user with id: %s", user_id)
     user_db = db_session.get_collection("users")
     user_data = edited_user.dict(exclude_unset=True)
     if "password" in user_data:
-        user_data["hashpwd"] = bcrypt.hashpw(user_data["password"].encode('utf-8'), bcrypt.gensalt())
+        user_data["hashpwd"] = hashing.hash_password_sync(user_data["password"])
         del user_data["password"]
     try:
         result = user_db.update_one({
@@ -236,12 +243,12 @@ def update(db_session, user_id: str, edited_user: Edited_User_Data):
             logger.error("Failed to update user")
         return success
     except Exception as e:
-        logger.error(f"Error updating user data: {str(e)}")
+        logger.error("Error updating user data: %s", e)
         return False
 
 
 def delete_user(db_session, user_id: str):
-    logger.info(f"Deleting user with id: {user_id}")
+    logger.info("Deleting user with id: %s", user_id)
     user_db = db_session.get_collection("users")
     try:
         result = user_db.delete_one({
@@ -254,5 +261,160 @@ def delete_user(db_session, user_id: str):
             logger.error("Failed to delete user")
         return success
     except Exception as e:
-        logger.error(f"Error deleting user: {str(e)}")
+        logger.error("Error deleting user: %s", e)
+        return False
+
+
+# asyncio variants of the functions above, for callers holding a session from
+# `database.get_async_session()` (Motor).
+
+async def activate_user_async(db_session, user_id):
+    logger.info("Activating user with id: %s", user_id)
+    user_db = db_session.get_collection("users")
+    result = await user_db.update_one({
+        "_id": ObjectId(user_id)
+    }, {
+        "$set": {
+            "activated": True
+        }
+    })
+    success = result.modified_count > 0
+    if success:
+        logger.info("User activated successfully")
+    else:
+        logger.error("Failed to activate user")
+    return success
+
+
+async def check_password_async(db_session, username: str, password: str):
+    logger.info("Checking password for user: %s", username)
+    user_db = db_session.get_collection("users")
+    user_data = await user_db.find_one({
+        "username": username
+    })
+    if user_data is None:
+        # try with e-mail
+        user_data = await user_db.find_one({
+            "email": username
+        })
+        if user_data is None:
+            logger.error("User not found")
+            return False, None
+
+    result = await hashing.check_password(password, user_data["hashpwd"])
+    if not result:
+        logger.error("Password check failed")
+        return False, None
+    logger.info("Password check successful")
+    return True, User.convert_results_to_objects(user_data)
+
+
+async def add_async(db_session, new_user: New_User, user_type: User_Type):
+    logger.info("Adding new user with username: %s", new_user.username)
+    user_db = db_session.get_collection("users")
+    hashedpwd = await hashing.hash_password(new_user.password)
+    user_data = _new_user_document(new_user, user_type, hashedpwd)
+    try:
+        result = await user_db.insert_one(user_data)
+        logger.info("User added successfully")
+        return str(result.inserted_id)
+    except Exception as e:
+        logger.error("Error adding new user: %s", e)
+        return None
+
+
+async def get_by_id_async(db_session, user_id: str):
+    logger.info("Fetching user by id: %s", user_id)
+    user_db = db_session.get_collection("users")
+    try:
+        if not ObjectId.is_valid(user_id):
+            logger.error("Invalid user ID format")
+            return None
+
+        result = await user_db.find_one({
+            "_id": ObjectId(user_id)
+        })
+
+        if result is None:
+            logger.info("User not found")
+            return None
+
+        logger.info("User found")
+        return User.convert_results_to_objects(result)
+    except Exception as e:
+        logger.error("Error fetching user by id: %s", e)
+        return None
+
+
+async def get_users_async(db_session, search_criteria, value, order="asc"):
+    logger.info("Fetching users with %s=%s ordered by %s", search_criteria, value, order)
+    sort_order = DESCENDING if order == "desc" else ASCENDING
+    query = {search_criteria: value}
+
+    try:
+        users_cursor = db_session.get_collection("users").find(query).sort([(search_criteria, sort_order)])
+        users_list = []
+
+        async for user in users_cursor:
+            try:
+                users_list.append(User.convert_results_to_objects(user))
+            except Exception as e:
+                logger.error("Error converting user data: %s, Error: %s", json_util.dumps(user), e)
+
+        logger.info("Users fetched successfully")
+        return users_list
+    except Exception as e:
+        logger.error("Error fetching users: %s", e)
+        return []
+
+
+async def iter_users_async(db_session, search_criteria, value, order="asc"):
+    """Yields the users matching `get_users_async` as JSON-ready dicts, straight from the cursor.
+    The projection keeps stored fields such as the password hash out of the result.
+    """
+    sort_order = DESCENDING if order == "desc" else ASCENDING
+    users_cursor = db_session.get_collection("users").find({search_criteria: value}, User.projection()).sort([(search_criteria, sort_order)])
+    async for user in users_cursor:
+        yield User.convert_results_to_documents(user)
+
+
+async def update_async(db_session, user_id: str, edited_user: Edited_User_Data):
+    logger.info("Updating user with id: %s", user_id)
+    user_db = db_session.get_collection("users")
+    user_data = edited_user.dict(exclude_unset=True)
+    if "password" in user_data:
+        user_data["hashpwd"] = await hashing.hash_password(user_data["password"])
+        del user_data["password"]
+    try:
+        result = await user_db.update_one({
+            "_id": ObjectId(user_id)
+        }, {
+            "$set": user_data
+        })
+        success = result.modified_count > 0
+        if success:
+            logger.info("User updated successfully")
+        else:
+            logger.error("Failed to update user")
+        return success
+    except Exception as e:
+        logger.error("Error updating user data: %s", e)
+        return False
+
+
+async def delete_user_async(db_session, user_id: str):
+    logger.info("Deleting user with id: %s", user_id)
+    user_db = db_session.get_collection("users")
+    try:
+        result = await user_db.delete_one({
+            "_id": ObjectId(user_id)
+        })
+        success = result.deleted_count > 0
+        if success:
+            logger.info("User deleted successfully")
+        else:
+            logger.error("Failed to delete user")
+        return success
+    except Exception as e:
+        logger.error("Error deleting user: %s", e)
         return False
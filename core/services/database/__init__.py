@@ -1,16 +1,50 @@
-from .mongo import Mongo
+from .mongo import Mongo, Async_Mongo, AsyncIOMotorClient
 import os
 from .. import tunnel
 
 database = None
+async_database = None
 
 def get_session():
     # for postgres
     return database.get_session()
 
 
+def get_async_session():
+    # asyncio-native session (Motor), for use inside async route handlers
+    return async_database.get_session()
+
+
+def client_options():
+    """MongoClient pool and connection settings from the environment; unset variables keep the driver defaults."""
+    options = {
+        "maxPoolSize": int(os.getenv("APP_MONGO_MAX_POOL_SIZE", 100)),
+        "minPoolSize": int(os.getenv("APP_MONGO_MIN_POOL_SIZE", 0)),
+        "serverSelectionTimeoutMS": int(os.getenv("APP_MONGO_SERVER_SELECTION_TIMEOUT_MS", 30000)),
+    }
+    wait_queue_timeout = os.getenv("APP_MONGO_WAIT_QUEUE_TIMEOUT_MS")
+    if wait_queue_timeout:
+        # how long an operation may wait for a free connection before failing
+        options["waitQueueTimeoutMS"] = int(wait_queue_timeout)
+    compressors = os.getenv("APP_MONGO_COMPRESSORS")
+    if compressors:
+        # e.g. "zstd,snappy,zlib"; zstd and snappy need the zstandard / python-snappy packages
+        options["compressors"] = compressors
+    return options
+
+
+def get_metrics():
+    """Command latencies and pool usage of the open clients."""
+    metrics = {"options": client_options()}
+    if database is not None:
+        metrics["sync"] = database.telemetry.snapshot()
+    if async_database is not None:
+        metrics["async"] = async_database.telemetry.snapshot()
+    return metrics
+
+
 def initialize():
-    global database
+    global database, async_database
 
     mongo_connection = os.getenv("APP_MONGO_CONNECTION", None)
     mongo_table = os.getenv("APP_MONGO_DBNAME", None)
@@ -23,8 +57,17 @@ def initialize():
         mongo_connection = mongo_connection.replace("<BIND_PORT>", str(override_port))
 
     if mongo_connection is not None:
-        database = Mongo(mongo_connection, mongo_table)
+        options = client_options()
+        database = Mongo(mongo_connection, mongo_table, **options)
+        if AsyncIOMotorClient is not None:
+            async_database = Async_Mongo(mongo_connection, mongo_table, **options)
 
 
 def terminate():
-    pass
+    global database, async_database
+    if async_database is not None:
+        async_database.close()
+        async_database = None
+    if database is not None:
+        database.close()
+        database = None
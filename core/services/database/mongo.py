@@ -1,10 +1,38 @@
 from pymongo import MongoClient, DESCENDING, ASCENDING
 
+from .telemetry import Mongo_Telemetry
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    # motor is only installed in services that serve requests from an event loop
+    AsyncIOMotorClient = None
+
 
 class Mongo:
-    def __init__(self, url, database):
-        self.client = MongoClient(url)
+    def __init__(self, url, database, **options):
+        # options are MongoClient keyword arguments, such as the pool settings
+        self.telemetry = Mongo_Telemetry()
+        self.client = MongoClient(url, event_listeners=self.telemetry.listeners(), **options)
+        self.database = database
+
+    def get_session(self):
+        return self.client[self.database]
+
+    def close(self):
+        self.client.close()
+
+
+class Async_Mongo:
+    def __init__(self, url, database, **options):
+        if AsyncIOMotorClient is None:
+            raise RuntimeError("motor is not installed, the asyncio database session is not available")
+        self.telemetry = Mongo_Telemetry()
+        self.client = AsyncIOMotorClient(url, event_listeners=self.telemetry.listeners(), **options)
         self.database = database
 
     def get_session(self):
         return self.client[self.database]
+
+    def close(self):
+        self.client.close()
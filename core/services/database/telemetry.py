@@ -0,0 +1,192 @@
+import bisect
+import threading
+import time
+
+from pymongo import monitoring
+
+from .. import metrics
+
+# upper bounds of the latency buckets, in milliseconds; the last bucket is unbounded
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Latency_Histogram:
+    """Fixed-bucket histogram of durations in milliseconds. Not thread-safe; callers hold a lock."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, duration_ms):
+        self.counts[bisect.bisect_left(self.bounds, duration_ms)] += 1
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the `q` quantile, or the largest observation for the last bucket."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return float(min(bound, self.max_ms))
+        return self.max_ms
+
+    def snapshot(self):
+        buckets = {f"le_{bound}": count for bound, count in zip(self.bounds, self.counts)}
+        buckets["le_inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class Command_Listener(monitoring.CommandListener):
+    """Per-command latency, as measured by the driver from send to reply."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}  # command name -> Latency_Histogram
+        self.failures = {}  # command name -> count
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._observe(event.command_name, event.duration_micros / 1000)
+
+    def failed(self, event):
+        with self.lock:
+            self.failures[event.command_name] = self.failures.get(event.command_name, 0) + 1
+        self._observe(event.command_name, event.duration_micros / 1000)
+
+    def _observe(self, command_name, duration_ms):
+        with self.lock:
+            histogram = self.latencies.get(command_name)
+            if histogram is None:
+                histogram = self.latencies[command_name] = Latency_Histogram()
+            histogram.observe(duration_ms)
+        metrics.observe_mongo_command(command_name, duration_ms)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: dict(histogram.snapshot(), failures=self.failures.get(name, 0))
+                for name, histogram in self.latencies.items()
+            }
+
+
+class Pool_Listener(monitoring.ConnectionPoolListener):
+    """Connection pool activity, mainly how long operations wait to check out a connection."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkout_wait = Latency_Histogram()
+        self.counters = {
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checked_out": 0,
+            "checkout_failed": 0,
+            "pool_cleared": 0,
+        }
+        self.checkout_failures = {}  # reason -> count
+        self.in_use = 0
+        self.max_in_use = 0
+        # checkout start per thread, for drivers whose events carry no duration
+        self.local = threading.local()
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._count("pool_cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._count("connections_created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._count("connections_closed")
+
+    def connection_check_out_started(self, event):
+        self.local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        reason = str(event.reason)
+        with self.lock:
+            self.counters["checkout_failed"] += 1
+            self.checkout_failures[reason] = self.checkout_failures.get(reason, 0) + 1
+        self._observe_wait(event)
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            self.counters["checked_out"] += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+        self._observe_wait(event)
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.in_use -= 1
+
+    def _observe_wait(self, event):
+        duration = getattr(event, "duration", None)
+        if duration is not None:
+            wait_ms = duration * 1000
+        else:
+            started = getattr(self.local, "started", None)
+            if started is None:
+                return
+            wait_ms = (time.perf_counter() - started) * 1000
+        self.local.started = None
+        with self.lock:
+            self.checkout_wait.observe(wait_ms)
+        metrics.observe_mongo_checkout_wait(wait_ms)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(
+                self.counters,
+                in_use=self.in_use,
+                max_in_use=self.max_in_use,
+                checkout_failures=dict(self.checkout_failures),
+                checkout_wait=self.checkout_wait.snapshot(),
+            )
+
+
+class Mongo_Telemetry:
+    """The listeners of one client; pass `listeners()` as the client's event_listeners."""
+
+    def __init__(self):
+        self.commands = Command_Listener()
+        self.pool = Pool_Listener()
+
+    def listeners(self):
+        return [self.commands, self.pool]
+
+    def snapshot(self):
+        return {"commands": self.commands.snapshot(), "pool": self.pool.snapshot()}
@@ -0,0 +1,223 @@
+import asyncio
+import collections
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+import weakref
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = "x-request-id"
+# a stack is reported at most this deep, innermost frames last
+MAX_STACK_DEPTH = 64
+
+
+class Request_Info:
+    """What is known about the request being handled in the current context."""
+
+    def __init__(self, request_id, method, path, scope):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.scope = scope
+
+    @property
+    def route(self):
+        # the router stores the matched route in the scope once it has routed the request
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or self.path
+
+
+# set by Request_Context_Middleware for everything that runs on behalf of a request
+current_request = contextvars.ContextVar("current_request", default=None)
+# task -> Request_Info, so other threads can tell which request a task serves;
+# a task's context is not readable from outside before Python 3.12
+request_tasks = weakref.WeakKeyDictionary()
+
+
+class Request_Context_Middleware:
+    """ASGI middleware giving every HTTP request an ID, available through `current_request`.
+
+    The ID is taken from the X-Request-ID header when the client sends one and
+    is echoed back in the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER.encode("latin-1"):
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(REQUEST_ID_HEADER.encode("latin-1"), request_id.encode("latin-1"))]
+            await send(message)
+
+        request = Request_Info(request_id, scope["method"], scope["path"], scope)
+        token = current_request.set(request)
+        task = asyncio.current_task()
+        request_tasks[task] = request
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_tasks.pop(task, None)
+            current_request.reset(token)
+
+
+def _install_task_factory(loop):
+    """Makes tasks created while handling a request known in `request_tasks`, like the one running the route."""
+    previous = loop.get_task_factory()
+
+    def task_factory(loop, coro, **kwargs):
+        if previous is not None:
+            task = previous(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        # runs in the creator's context, which the new task inherits
+        request = current_request.get()
+        if request is not None:
+            request_tasks[task] = request
+        return task
+
+    loop.set_task_factory(task_factory)
+
+
+def _format_frame(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{code.co_name}"
+
+
+def _frame_names(frame):
+    """Returns the function names of a stack, outermost first."""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        names.append(_format_frame(frame))
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+class Loop_Watchdog:
+    """Reports callbacks that block the event loop for longer than `threshold_ms`.
+
+    A heartbeat task on the loop records when it last ran. A thread checks the
+    heartbeat every `check_interval_ms`; once it is overdue, the thread takes
+    the loop thread's stack and logs it with the route and request ID of the
+    task that is running, once per stall. The loop pays for one timer wakeup
+    per heartbeat; everything else happens on the watchdog thread.
+    """
+
+    def __init__(self, threshold_ms=100, heartbeat_ms=50, check_interval_ms=None):
+        self.threshold = threshold_ms / 1000
+        self.heartbeat = heartbeat_ms / 1000
+        self.check_interval = (check_interval_ms or max(threshold_ms / 2, 10)) / 1000
+
+        self.loop = None
+        self.loop_thread_id = None
+        self.last_beat = 0.0
+        self.task = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.stalls = 0
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        _install_task_factory(self.loop)
+        self.stopping.clear()
+        self.task = asyncio.create_task(self._beat())
+        self.thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+        logger.info("Event loop watchdog started, reporting stalls over %.0f ms", self.threshold * 1000)
+
+    async def stop(self):
+        self.stopping.set()
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+
+    async def _beat(self):
+        while True:
+            self.last_beat = time.monotonic()
+            await asyncio.sleep(self.heartbeat)
+
+    def _watch(self):
+        reported_beat = None
+        while not self.stopping.wait(self.check_interval):
+            beat = self.last_beat
+            blocked = time.monotonic() - beat - self.heartbeat
+            if blocked < self.threshold or beat == reported_beat:
+                continue
+            reported_beat = beat
+            self.stalls += 1
+            self._report(blocked)
+
+    def _report(self, blocked):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = "".join(traceback.format_stack(frame, limit=MAX_STACK_DEPTH)) if frame is not None else "  <no stack>\n"
+        task = asyncio.current_task(self.loop)
+        request = request_tasks.get(task) if task is not None else None
+        if request is None:
+            logger.warning("Event loop blocked for over %.0f ms outside of a request:\n%s", blocked * 1000, stack)
+        else:
+            logger.warning(
+                "Event loop blocked for over %.0f ms in %s %s (request %s):\n%s",
+                blocked * 1000, request.method, request.route, request.request_id, stack
+            )
+
+
+# only one profile runs at a time, sampling is not free
+profile_lock = threading.Lock()
+
+
+def sample_stacks(seconds, hz=100, thread_ids=None):
+    """Samples the stacks of the running threads for `seconds`, `hz` times per second.
+
+    Returns the samples in the collapsed format read by flamegraph.pl and
+    speedscope: one line per distinct stack, "thread;outer;...;inner count".
+    `thread_ids` limits sampling to those threads. The sampling thread itself
+    is never included. Raises RuntimeError if a profile is already running.
+    """
+    if not profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        counts = collections.Counter()
+        interval = 1 / hz
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me or (thread_ids is not None and thread_id not in thread_ids):
+                    continue
+                thread_name = names.get(thread_id, str(thread_id))
+                counts[";".join([thread_name] + _frame_names(frame))] += 1
+            time.sleep(interval)
+    finally:
+        profile_lock.release()
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def enabled():
+    """Whether the diagnostic mode is switched on with APP_DIAGNOSTICS."""
+    return os.getenv("APP_DIAGNOSTICS", "").lower() in ("1", "true", "yes")
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+executor = None
+pending_slots = None
+rounds = int(os.getenv("APP_BCRYPT_ROUNDS", 12))
+max_pending = 0
+
+# counters are updated from the worker threads as well as the event loop
+metrics_lock = threading.Lock()
+metrics = {
+    # callers waiting for a free slot because max_pending jobs are already queued
+    "waiting": 0,
+    # jobs handed to the pool, either queued or being hashed
+    "in_pool": 0,
+    "completed": 0,
+    "failed": 0,
+    "seconds_in_pool": 0.0,
+}
+
+
+def initialize():
+    """Creates the password hashing pool.
+
+    Configured from the environment:
+        APP_HASH_WORKERS: number of workers, defaults to the number of cores
+        APP_HASH_MAX_PENDING: jobs allowed to queue before callers wait, defaults to 8 per worker
+        APP_HASH_POOL: "thread" (default, bcrypt releases the GIL) or "process"
+        APP_BCRYPT_ROUNDS: bcrypt cost factor for new hashes, defaults to 12
+    """
+    global executor, pending_slots, rounds, max_pending
+
+    if executor is not None:
+        return
+
+    workers = int(os.getenv("APP_HASH_WORKERS", os.cpu_count() or 1))
+    max_pending = int(os.getenv("APP_HASH_MAX_PENDING", workers * 8))
+    rounds = int(os.getenv("APP_BCRYPT_ROUNDS", 12))
+
+    if os.getenv("APP_HASH_POOL", "thread").lower() == "process":
+        executor = ProcessPoolExecutor(max_workers=workers)
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+    pending_slots = asyncio.Semaphore(max_pending)
+    logger.info("Password hashing pool started with %s workers, cost factor %s", workers, rounds)
+
+
+def terminate():
+    global executor, pending_slots
+    if executor is not None:
+        executor.shutdown(wait=True)
+    executor = None
+    pending_slots = None
+
+
+def _hashpw(password: bytes, cost: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=cost))
+
+
+def _checkpw(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+def _update(**deltas):
+    with metrics_lock:
+        for key, delta in deltas.items():
+            metrics[key] += delta
+
+
+async def _submit(func, *args):
+    if executor is None:
+        initialize()
+
+    _update(waiting=1)
+    async with pending_slots:
+        _update(waiting=-1, in_pool=1)
+        started = time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        except Exception:
+            _update(failed=1)
+            raise
+        else:
+            _update(completed=1)
+        finally:
+            _update(in_pool=-1, seconds_in_pool=time.perf_counter() - started)
+    return result
+
+
+async def hash_password(password: str) -> bytes:
+    """Hashes `password` on the hashing pool with the configured cost factor."""
+    return await _submit(_hashpw, password.encode('utf-8'), rounds)
+
+
+async def check_password(password: str, hashed: bytes) -> bool:
+    """Checks `password` against a stored bcrypt hash on the hashing pool."""
+    return await _submit(_checkpw, password.encode('utf-8'), hashed)
+
+
+def hash_password_sync(password: str) -> bytes:
+    """Blocking variant of `hash_password` for callers that are not on an event loop."""
+    return _hashpw(password.encode('utf-8'), rounds)
+
+
+def check_password_sync(password: str, hashed: bytes) -> bool:
+    """Blocking variant of `check_password` for callers that are not on an event loop."""
+    return _checkpw(password.encode('utf-8'), hashed)
+
+
+def get_metrics():
+    """Returns a snapshot of the pool's queue depth and throughput counters."""
+    with metrics_lock:
+        snapshot = dict(metrics)
+    snapshot["max_pending"] = max_pending
+    snapshot["cost_factor"] = rounds
+    return snapshot
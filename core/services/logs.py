@@ -0,0 +1,118 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+
+from . import diagnostics
+
+APP_ENV = os.getenv("APP_ENV", "prod")
+TEXT_FORMAT = '[%(asctime)s] [%(filename)s:%(lineno)s - %(funcName)20s() ] %(levelname)s: [%(request_id)s] %(message)s'
+TEXT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+configured = False
+queue_listener = None
+
+
+def get_logger(name, debug_env=None):
+    """Returns the logger of a module. It logs at DEBUG when APP_ENV is "dev" or `debug_env`
+    (such as "debug-DiaryRouter"), otherwise at the root level.
+    """
+    logger = logging.getLogger(name)
+    if APP_ENV in ("dev", debug_env):
+        logger.setLevel(logging.DEBUG)
+    return logger
+
+
+class Request_Id_Filter(logging.Filter):
+    """Adds the ID of the request being handled, or "-", to every record as `request_id`."""
+
+    def filter(self, record):
+        request = diagnostics.current_request.get()
+        record.request_id = request.request_id if request is not None else "-"
+        return True
+
+
+class Json_Formatter(logging.Formatter):
+    """Formats a record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+            "location": f"{record.filename}:{record.lineno}",
+            "function": record.funcName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # already formatted by the queue handler
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _Queue_Handler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # the stock prepare() formats the whole record here; only merge the
+        # message arguments, the listener thread formats and writes
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure():
+    """Sets up the root logger once per process; call it from the service entrypoint.
+
+    APP_LOG_FORMAT is "json" or "text". It defaults to text when APP_ENV is
+    "dev", json otherwise. APP_LOG_LEVEL sets the root level (INFO by default,
+    DEBUG when APP_ENV is "dev"). With APP_LOG_QUEUE=1, records are handed to a
+    queue and written by a background thread, so the calling thread never
+    waits on log I/O.
+    """
+    global configured, queue_listener
+    if configured:
+        return
+    configured = True
+
+    log_format = os.getenv("APP_LOG_FORMAT") or ("text" if APP_ENV == "dev" else "json")
+    handler = logging.StreamHandler(sys.stderr)
+    if log_format == "json":
+        handler.setFormatter(Json_Formatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT, datefmt=TEXT_DATE_FORMAT))
+
+    if os.getenv("APP_LOG_QUEUE", "").lower() in ("1", "true", "yes"):
+        front = _Queue_Handler(queue.SimpleQueue())
+        queue_listener = logging.handlers.QueueListener(front.queue, handler, respect_handler_level=True)
+        queue_listener.start()
+        atexit.register(terminate)
+    else:
+        front = handler
+    # filters run in the logging thread, where the request context is
+    front.addFilter(Request_Id_Filter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(front)
+    root.setLevel((os.getenv("APP_LOG_LEVEL") or ("DEBUG" if APP_ENV == "dev" else "INFO")).upper())
+
+
+def terminate():
+    """Writes out the queued records and stops the queue thread."""
+    global queue_listener
+    if queue_listener is not None:
+        queue_listener.stop()
+        queue_listener = None
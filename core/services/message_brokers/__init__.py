@@ -1,20 +1,39 @@
 import os
 import json
 import socket
+import asyncio
+import functools
+import threading
+from collections import namedtuple
 from contextlib import contextmanager
 from datetime import datetime, timedelta
 from kafka3 import KafkaConsumer, KafkaProducer, KafkaAdminClient
-from kafka3.admin import NewTopic
+from kafka3.admin import NewTopic, NewPartitions
 from kafka3.errors import TopicAlreadyExistsError
 import time
 import logging
-from .. import tunnel
+from .. import tunnel, metrics
 
 producer = None
 kafka_servers = None
+logger = logging.getLogger(__name__)
+
+# bounds the number of asynchronous sends waiting for a broker acknowledgement
+pending_sends = None
+delivery_lock = threading.Lock()
+delivery_counters = {"queued": 0, "delivered": 0, "failed": 0, "cancelled": 0}
 
 def initialize():
-    global producer, kafka_servers
+    """Connects the shared producer.
+
+    Producer tuning is read from the environment:
+        APP_KAFKA_LINGER_MS: how long to wait to fill a batch, defaults to 5
+        APP_KAFKA_BATCH_SIZE: batch size in bytes per partition, defaults to 16384
+        APP_KAFKA_COMPRESSION: gzip, snappy, lz4 or zstd, defaults to none
+        APP_KAFKA_BUFFER_MEMORY: bytes buffered before send() blocks, defaults to 32MB
+        APP_KAFKA_MAX_PENDING: unacknowledged async sends before `send` waits, defaults to 10000
+    """
+    global producer, kafka_servers, pending_sends
 
     kafka_servers = os.getenv("APP_KAFKA_CONNECTION", None)
 
@@ -33,8 +52,13 @@ def initialize():
     producer = KafkaProducer(
         bootstrap_servers=kafka_servers,
         value_serializer=lambda v: json.dumps(v).encode('utf-8'),
-        key_serializer=lambda v: v.encode('utf-8')
+        key_serializer=lambda v: v.encode('utf-8'),
+        linger_ms=int(os.getenv("APP_KAFKA_LINGER_MS", 5)),
+        batch_size=int(os.getenv("APP_KAFKA_BATCH_SIZE", 16384)),
+        compression_type=os.getenv("APP_KAFKA_COMPRESSION") or None,
+        buffer_memory=int(os.getenv("APP_KAFKA_BUFFER_MEMORY", 33554432))
     )
+    pending_sends = asyncio.Semaphore(int(os.getenv("APP_KAFKA_MAX_PENDING", 10000)))
 
     
     # check connectivity
@@ -50,6 +74,14 @@ def initialize():
 def terminate():
     global producer
     producer.flush()
+    producer.close()
+
+
+async def flush(timeout=None):
+    """Waits until every buffered message has been sent, without blocking the event loop."""
+    if producer is None:
+        return
+    await asyncio.get_running_loop().run_in_executor(None, functools.partial(producer.flush, timeout=timeout))
 
 
 def send_message(topic, key, value, wait_for_ack=False):
@@ -61,8 +93,84 @@ def send_message(topic, key, value, wait_for_ack=False):
 
     return True
 
+async def send(topic, key, value):
+    """Queues a message on the producer without blocking the event loop.
+
+    Waits only when APP_KAFKA_MAX_PENDING sends are still unacknowledged.
+    Returns an asyncio future that resolves to the record metadata once the
+    broker acknowledges the message, or raises the delivery error. Callers
+    that do not await it still get failures logged and counted.
+    """
+    loop = asyncio.get_running_loop()
+    await pending_sends.acquire()
+    delivery = loop.create_future()
+    delivery.add_done_callback(functools.partial(_log_delivery_failure, topic, key))
+    delivery.add_done_callback(functools.partial(_observe_delivery, topic, time.perf_counter()))
+    _count_delivery("queued")
+    try:
+        # send() can block on a metadata refresh or a full buffer, keep that off the loop
+        future = await loop.run_in_executor(None, functools.partial(producer.send, topic, key=key, value=value))
+    except Exception as e:
+        _resolve_delivery(delivery, None, e)
+        return delivery
+    except BaseException:
+        # cancelled while waiting for the producer; nothing else would free the slot
+        _cancel_delivery(delivery)
+        raise
+
+    future.add_callback(lambda metadata: loop.call_soon_threadsafe(_resolve_delivery, delivery, metadata, None))
+    future.add_errback(lambda e: loop.call_soon_threadsafe(_resolve_delivery, delivery, None, e))
+    return delivery
+
+
+def _resolve_delivery(delivery, metadata, error):
+    pending_sends.release()
+    if delivery.done():
+        return
+    if error is None:
+        _count_delivery("delivered")
+        delivery.set_result(metadata)
+    else:
+        _count_delivery("failed")
+        delivery.set_exception(error)
+
+
+def _cancel_delivery(delivery):
+    pending_sends.release()
+    _count_delivery("cancelled")
+    delivery.cancel()
+
+
+def _log_delivery_failure(topic, key, delivery):
+    if not delivery.cancelled() and delivery.exception() is not None:
+        logger.error("Failed to deliver message %s to %s: %s", key, topic, delivery.exception())
+
+
+def _observe_delivery(topic, started, delivery):
+    if not delivery.cancelled():
+        metrics.observe_kafka_delivery(topic, time.perf_counter() - started, failed=delivery.exception() is not None)
+
+
+def _count_delivery(counter):
+    with delivery_lock:
+        delivery_counters[counter] += 1
+
+
+def get_delivery_metrics():
+    """Returns async send counters and the number of sends awaiting acknowledgement."""
+    with delivery_lock:
+        snapshot = dict(delivery_counters)
+    snapshot["pending"] = snapshot["queued"] - snapshot["delivered"] - snapshot["failed"] - snapshot["cancelled"]
+    return snapshot
+
+# one consumed message, as yielded in batches by Consumer.batches
+Record = namedtuple("Record", ["topic", "partition", "offset", "key", "value", "size"])
+
 class Consumer:
-    def __init__(self, group_id):
+    def __init__(self, group_id, enable_auto_commit=True, auto_offset_reset='earliest', **config):
+        """`config` is passed through to KafkaConsumer, e.g. max_poll_records or fetch_max_bytes.
+        Pass enable_auto_commit=False to commit with `commit()` once a batch has been processed.
+        """
         self.stop_loop = False
         self.group_id = group_id
 
@@ -70,21 +178,27 @@ class Consumer:
 
         self.consumer = KafkaConsumer(
             bootstrap_servers=kafka_servers,
-            auto_offset_reset='earliest',
-            enable_auto_commit=True,
+            auto_offset_reset=auto_offset_reset,
+            enable_auto_commit=enable_auto_commit,
             group_id=self.group_id,
             value_deserializer=lambda x: json.loads(x.decode('utf-8')),
             key_deserializer=lambda x: x.decode('utf-8'),
-            max_poll_interval_ms=3600000
+            max_poll_interval_ms=3600000,
+            **config
         )
 
+        self.counters_lock = threading.Lock()
+        self.counters = {"records": 0, "bytes": 0, "batches": 0, "commits": 0}
+        self.started = time.monotonic()
 
-    def __call__(self, topics, on_idle=None, on_idle_timeout=10000):
+
+    def __call__(self, topics, on_idle=None, on_idle_timeout=10000, poll_timeout_ms=0):
+        # poll_timeout_ms > 0 lets a dedicated consumer thread wait on the broker instead of spinning
         self.consumer.subscribe(topics)
 
         while not self.stop_loop:
 
-            msg = self.consumer.poll(max_records=1, update_offsets=True)
+            msg = self.consumer.poll(timeout_ms=poll_timeout_ms, max_records=1, update_offsets=True)
             # if msg is an empty dict, then it's an idle timeout
             if len(msg) > 0:
                 for topic_partition, consumer_records in msg.items():
@@ -92,12 +206,114 @@ class Consumer:
                     for consumer_record in consumer_records:
                         key = consumer_record.key
                         value = consumer_record.value
+                        self._count(1, _record_size(consumer_record))
                         yield topic, key, value
             
         self.consumer.unsubscribe()
 
         if self.terminating:
             self.consumer.close()
+
+
+    def batches(self, topics, max_records=500, max_bytes=1048576, linger_ms=100, poll_timeout_ms=500):
+        """Yields lists of `Record`s instead of single messages.
+
+        A batch is returned once it holds `max_records` records or `max_bytes`
+        of serialized keys and values, or `linger_ms` after its first record
+        arrived, whichever comes first. The byte budget is checked between
+        polls, so a batch can overshoot it by one poll.
+        """
+        self.consumer.subscribe(topics)
+
+        while not self.stop_loop:
+            batch = self._collect_batch(max_records, max_bytes, linger_ms, poll_timeout_ms)
+            if len(batch) > 0:
+                self._count(len(batch), sum(record.size for record in batch), batches=1)
+                yield batch
+
+        self.consumer.unsubscribe()
+
+        if self.terminating:
+            self.consumer.close()
+
+
+    def _collect_batch(self, max_records, max_bytes, linger_ms, poll_timeout_ms):
+        batch = []
+        batch_bytes = 0
+        deadline = None
+        while not self.stop_loop and len(batch) < max_records and batch_bytes < max_bytes:
+            if deadline is None:
+                timeout_ms = poll_timeout_ms
+            else:
+                timeout_ms = int((deadline - time.monotonic()) * 1000)
+                if timeout_ms <= 0:
+                    break
+
+            msg = self.consumer.poll(timeout_ms=timeout_ms, max_records=max_records - len(batch), update_offsets=True)
+            if len(msg) == 0:
+                if deadline is None:
+                    # idle, hand control back so the caller can notice stop_consume()
+                    break
+                continue
+
+            for topic_partition, consumer_records in msg.items():
+                for consumer_record in consumer_records:
+                    size = _record_size(consumer_record)
+                    batch.append(Record(
+                        topic_partition.topic,
+                        topic_partition.partition,
+                        consumer_record.offset,
+                        consumer_record.key,
+                        consumer_record.value,
+                        size
+                    ))
+                    batch_bytes += size
+
+            if deadline is None:
+                deadline = time.monotonic() + linger_ms / 1000
+        return batch
+
+
+    def commit(self):
+        """Commits the offsets of every record yielded so far. Use with enable_auto_commit=False."""
+        self.consumer.commit()
+        with self.counters_lock:
+            self.counters["commits"] += 1
+
+
+    def _count(self, records, size, batches=0):
+        with self.counters_lock:
+            self.counters["records"] += records
+            self.counters["bytes"] += size
+            self.counters["batches"] += batches
+
+
+    def lag(self):
+        """Returns {"topic:partition": messages behind the end of the partition} for the current assignment.
+        KafkaConsumer is not thread-safe, so call this from the thread that consumes.
+        """
+        assignment = list(self.consumer.assignment())
+        if len(assignment) == 0:
+            return {}
+        end_offsets = self.consumer.end_offsets(assignment)
+        return {
+            f"{tp.topic}:{tp.partition}": max(end_offsets[tp] - self.consumer.position(tp), 0)
+            for tp in assignment
+        }
+
+
+    def metrics(self, include_lag=False):
+        """Returns consumed record/byte/batch counters and throughput since the consumer was created.
+        `include_lag` adds per-partition lag, which costs a round trip to the brokers.
+        """
+        with self.counters_lock:
+            snapshot = dict(self.counters)
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        snapshot["records_per_second"] = snapshot["records"] / elapsed
+        snapshot["bytes_per_second"] = snapshot["bytes"] / elapsed
+        if include_lag:
+            snapshot["lag"] = self.lag()
+        return snapshot
         
 
     def stop_consume(self):
@@ -109,6 +325,17 @@ class Consumer:
         self.terminating = True
 
 
+    def close(self):
+        """Closes the connection now, for a consumer whose loop failed and will not reach its own close."""
+        self.stop_consume()
+        self.consumer.close()
+
+
+def _record_size(consumer_record):
+    # serialized sizes are -1 when the key or value is null
+    return max(consumer_record.serialized_key_size, 0) + max(consumer_record.serialized_value_size, 0)
+
+
 @contextmanager
 def get_admin_session():
     admin_client = KafkaAdminClient(
@@ -131,3 +358,17 @@ def create_topic(admin, topic, num_partitions=1, replication_factor=1, exist_ok=
             raise e
         return False
 
+
+def ensure_partitions(admin, topic, num_partitions):
+    """Grows `topic` to at least `num_partitions` partitions. Partitions can never be removed."""
+    try:
+        description = admin.describe_topics([topic])[0]
+        current = len(description["partitions"])
+    except Exception as e:
+        logger.error("Failed to describe topic %s: %s", topic, e)
+        return False
+    if current >= num_partitions:
+        return False
+    admin.create_partitions({topic: NewPartitions(total_count=num_partitions)})
+    logger.info("Topic %s grown from %s to %s partitions", topic, current, num_partitions)
+    return True
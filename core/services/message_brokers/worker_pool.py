@@ -0,0 +1,100 @@
+import logging
+import queue
+import threading
+import zlib
+
+from . import Consumer
+
+logger = logging.getLogger(__name__)
+
+# tells a worker thread to exit
+_STOP = object()
+
+
+class Partitioned_Worker_Pool:
+    """Consumes topics in batches and processes the records on a pool of worker threads.
+
+    Records with the same key always go to the same worker, so they are handled
+    in the order they were produced; records without a key are spread by
+    partition. Offsets are committed only after every record of a batch has
+    been handled, so a crash re-delivers the unfinished batch instead of
+    losing it.
+
+    `handler(record)` receives a message_brokers.Record. Exceptions it raises
+    are logged and counted; the record is still considered processed.
+    """
+
+    def __init__(self, group_id, handler, num_workers=4, max_records=500, max_bytes=1048576, linger_ms=100, poll_timeout_ms=500):
+        self.handler = handler
+        self.num_workers = max(1, num_workers)
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.linger_ms = linger_ms
+        self.poll_timeout_ms = poll_timeout_ms
+
+        self.consumer = Consumer(group_id, enable_auto_commit=False, max_poll_records=max_records)
+        self.queues = [queue.Queue() for _ in range(self.num_workers)]
+        self.threads = []
+        self.counters_lock = threading.Lock()
+        self.counters = {"processed": 0, "failed": 0}
+
+    def run(self, topics):
+        """Blocks, consuming `topics` until `stop()` is called."""
+        self.threads = [
+            threading.Thread(target=self._work, args=(q,), name=f"consumer-worker-{i}", daemon=True)
+            for i, q in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+        try:
+            batches = self.consumer.batches(
+                topics,
+                max_records=self.max_records,
+                max_bytes=self.max_bytes,
+                linger_ms=self.linger_ms,
+                poll_timeout_ms=self.poll_timeout_ms
+            )
+            for batch in batches:
+                for record in batch:
+                    self.queues[self._worker_for(record)].put(record)
+                for q in self.queues:
+                    q.join()
+                self.consumer.commit()
+        finally:
+            for q in self.queues:
+                q.put(_STOP)
+            for thread in self.threads:
+                thread.join()
+
+    def stop(self):
+        """Finishes and commits the batch in progress, then makes `run` return. Safe to call from a signal handler."""
+        self.consumer.terminate()
+
+    def metrics(self):
+        with self.counters_lock:
+            snapshot = dict(self.counters)
+        snapshot["queued"] = sum(q.qsize() for q in self.queues)
+        snapshot.update(self.consumer.metrics())
+        return snapshot
+
+    def _worker_for(self, record):
+        if record.key is None:
+            return record.partition % self.num_workers
+        return zlib.crc32(str(record.key).encode("utf-8")) % self.num_workers
+
+    def _work(self, work_queue):
+        while True:
+            record = work_queue.get()
+            if record is _STOP:
+                work_queue.task_done()
+                return
+            try:
+                self.handler(record)
+                counter = "processed"
+            except Exception as e:
+                logger.error("Failed to process %s:%s@%s: %s", record.topic, record.partition, record.offset, e)
+                counter = "failed"
+            with self.counters_lock:
+                self.counters[counter] += 1
+            work_queue.task_done()
@@ -0,0 +1,200 @@
+import asyncio
+import glob
+import logging
+import os
+import tempfile
+import time
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    # only the webserver exposes metrics; without the package every function here is a no-op
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+# set in the parent process before the workers start, see `prepare_multiprocess_dir`
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = prometheus_client.CONTENT_TYPE_LATEST if prometheus_client is not None else "text/plain; charset=utf-8"
+
+if prometheus_client is not None:
+    HTTP_REQUESTS = prometheus_client.Counter(
+        "http_requests_total", "HTTP requests by route template and status", ["method", "route", "status"])
+    HTTP_LATENCY = prometheus_client.Histogram(
+        "http_request_duration_seconds", "Time from request arrival to the last response byte", ["method", "route"], buckets=LATENCY_BUCKETS)
+    HTTP_IN_FLIGHT = prometheus_client.Gauge(
+        "http_requests_in_flight", "HTTP requests being handled", multiprocess_mode="livesum")
+    MONGO_COMMAND_LATENCY = prometheus_client.Histogram(
+        "mongo_command_duration_seconds", "MongoDB command round trips", ["command"], buckets=LATENCY_BUCKETS)
+    MONGO_CHECKOUT_WAIT = prometheus_client.Histogram(
+        "mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled MongoDB connection", buckets=LATENCY_BUCKETS)
+    KAFKA_DELIVERY_LATENCY = prometheus_client.Histogram(
+        "kafka_delivery_duration_seconds", "Time from send to broker acknowledgement", ["topic"], buckets=LATENCY_BUCKETS)
+    KAFKA_DELIVERY_FAILURES = prometheus_client.Counter(
+        "kafka_delivery_failures_total", "Messages the broker did not acknowledge", ["topic"])
+    SOCKET_CONNECTIONS = prometheus_client.Gauge(
+        "socketio_connections", "Connected socket.io clients", multiprocess_mode="livesum")
+    EVENT_LOOP_LAG = prometheus_client.Histogram(
+        "event_loop_lag_seconds", "How late the event loop runs a timer", buckets=LATENCY_BUCKETS)
+    COMPONENT_STATS = prometheus_client.Gauge(
+        "app_component_stat", "Counters and sizes kept by in-process components such as caches and pools, summed over the workers",
+        ["component", "stat"], multiprocess_mode="livesum")
+
+loop_monitor = None
+stats_sampler = None
+# component -> (function returning {stat: number}, the stats to export or None for all)
+stat_sources = {}
+
+
+def prepare_multiprocess_dir():
+    """Lets every worker process write its metrics to a shared directory that `/metrics` aggregates.
+
+    Call it in the parent process before the workers are started. Files left
+    by a previous run are removed.
+    """
+    path = os.getenv(MULTIPROC_DIR_ENV) or os.path.join(tempfile.gettempdir(), "prometheus-multiproc")
+    os.makedirs(path, exist_ok=True)
+    for stale in glob.glob(os.path.join(path, "*.db")):
+        os.remove(stale)
+    os.environ[MULTIPROC_DIR_ENV] = path
+    return path
+
+
+def render():
+    """Returns the metrics in the text exposition format, summed over every worker in multiprocess mode."""
+    if prometheus_client is None:
+        return b"# prometheus_client is not installed\n"
+    # this worker's stats are current, the others' are at most one sampling interval old
+    _sample_stats()
+    if os.getenv(MULTIPROC_DIR_ENV):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return prometheus_client.generate_latest(registry)
+    return prometheus_client.generate_latest()
+
+
+class Metrics_Middleware:
+    """ASGI middleware counting and timing every HTTP request by its route template.
+
+    The time runs until the last body chunk is sent, so streamed responses are
+    measured in full. Requests that match no API route (static files, 404s)
+    share the "<other>" route label to keep the label set bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if prometheus_client is None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_and_record_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # the router stores the matched route in the scope
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "<other>"
+            method = scope["method"]
+            HTTP_REQUESTS.labels(method, route, str(status_code)).inc()
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - started)
+
+
+def register_stats(component, snapshot, stats=None):
+    """Exports the numbers returned by `snapshot()` as app_component_stat{component, stat}.
+
+    Every worker samples its own components periodically, so the exported
+    value is the sum over the workers. Limit `stats` to the values that add
+    up, leaving out ratios and settings.
+    """
+    stat_sources[component] = (snapshot, stats)
+
+
+def _sample_stats():
+    for component, (snapshot, stats) in list(stat_sources.items()):
+        try:
+            values = snapshot()
+        except Exception as e:
+            logger.debug("Failed to sample the stats of %s: %s", component, e)
+            continue
+        for stat, value in values.items():
+            if (stats is None or stat in stats) and isinstance(value, (int, float)) and not isinstance(value, bool):
+                COMPONENT_STATS.labels(component, stat).set(value)
+
+
+async def _sample_stats_periodically(interval):
+    while True:
+        _sample_stats()
+        await asyncio.sleep(interval)
+
+
+def observe_mongo_command(command, duration_ms):
+    if prometheus_client is not None:
+        MONGO_COMMAND_LATENCY.labels(command).observe(duration_ms / 1000)
+
+
+def observe_mongo_checkout_wait(wait_ms):
+    if prometheus_client is not None:
+        MONGO_CHECKOUT_WAIT.observe(wait_ms / 1000)
+
+
+def observe_kafka_delivery(topic, seconds, failed=False):
+    if prometheus_client is not None:
+        KAFKA_DELIVERY_LATENCY.labels(topic).observe(seconds)
+        if failed:
+            KAFKA_DELIVERY_FAILURES.labels(topic).inc()
+
+
+def socket_connected():
+    if prometheus_client is not None:
+        SOCKET_CONNECTIONS.inc()
+
+
+def socket_disconnected():
+    if prometheus_client is not None:
+        SOCKET_CONNECTIONS.dec()
+
+
+async def _monitor_event_loop(interval):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(loop.time() - started - interval, 0.0))
+
+
+def initialize(loop_interval=0.5, stats_interval=5):
+    """Starts sampling the event loop lag and the registered component stats; call it from the running loop."""
+    global loop_monitor, stats_sampler
+    if prometheus_client is None:
+        logger.warning("prometheus_client is not installed, metrics are disabled")
+        return
+    loop = asyncio.get_running_loop()
+    loop_monitor = loop.create_task(_monitor_event_loop(loop_interval))
+    stats_sampler = loop.create_task(_sample_stats_periodically(stats_interval))
+
+
+def terminate():
+    global loop_monitor, stats_sampler
+    if loop_monitor is not None:
+        loop_monitor.cancel()
+        loop_monitor = None
+    if stats_sampler is not None:
+        stats_sampler.cancel()
+        stats_sampler = None
+    if prometheus_client is not None and os.getenv(MULTIPROC_DIR_ENV):
+        # drop this worker's live gauges from the aggregate
+        multiprocess.mark_process_dead(os.getpid())
@@ -1,32 +1,212 @@
+import asyncio
 import os
-import logging
+import socket
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
 import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+from . import metrics, logs, message_brokers
+
+logger = logs.get_logger(__name__, "debug-mainRouter")
+
+# Kafka topic the workers share socket.io emits and room changes through
+SOCKET_TOPIC = "socketio_fanout"
+# a socket can follow at most this many team rooms
+MAX_TEAM_ROOMS = 32
+MAX_TEAM_NAME_LENGTH = 128
+
+
+def team_room(team):
+    return f"team:{team}"
+
+
+def user_room(user_id):
+    return f"user:{user_id}"
+
+
+class Kafka_Client_Manager(AsyncPubSubManager):
+    """socket.io client manager that shares emits between processes through a Kafka topic.
+
+    Every emit is delivered to the clients of this process and published on
+    `channel` with `message_brokers.send`. Each process reads the topic with its
+    own consumer group from the latest offset, so every worker sees every
+    message, and delivers it to its own clients. Messages a process published
+    itself are skipped by its consumer. As with Emit_Relay, the consumer runs on
+    a thread and hands messages to the loop through a bounded queue.
+    """
+    name = "kafka"
+
+    def __init__(self, channel=SOCKET_TOPIC, write_only=False, logger=None, max_queue=1000, poll_timeout_ms=500):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.group_id = f"{channel}-{socket.gethostname()}-{os.getpid()}"
+        self.max_queue = max_queue
+        self.poll_timeout_ms = poll_timeout_ms
+
+        self.loop = None
+        self.queue = None
+        self.consumer = None
+        self.consumer_thread = None
+        self.stopping = threading.Event()
+
+    async def _publish(self, data):
+        # keyed by the publishing process, so its own consumer can skip it
+        await message_brokers.send(self.channel, self.host_id, data)
+
+    async def _listen(self):
+        if self.consumer_thread is None or not self.consumer_thread.is_alive():
+            self.loop = asyncio.get_running_loop()
+            self.queue = asyncio.Queue(maxsize=self.max_queue)
+            self.stopping.clear()
+            self.consumer_thread = threading.Thread(target=self._consume, name=f"socketio-{self.channel}", daemon=True)
+            self.consumer_thread.start()
+        while True:
+            yield await self.queue.get()
+
+    def _consume(self):
+        try:
+            self.consumer = message_brokers.Consumer(self.group_id, auto_offset_reset="latest")
+            if self.stopping.is_set():
+                self.consumer.terminate()
+            batches = self.consumer.batches([self.channel], max_records=self.max_queue, linger_ms=0, poll_timeout_ms=self.poll_timeout_ms)
+            for batch in batches:
+                for record in batch:
+                    if record.key != self.host_id:
+                        self._enqueue(record.value)
+        except Exception as e:
+            logger.error("socket.io consumer for %s stopped unexpectedly: %s", self.channel, e)
+
+    def _enqueue(self, message):
+        future = asyncio.run_coroutine_threadsafe(self.queue.put(message), self.loop)
+        while not self.stopping.is_set():
+            try:
+                future.result(timeout=self.poll_timeout_ms / 1000)
+                return
+            except FutureTimeoutError:
+                continue
+        future.cancel()
+
+    def stop(self):
+        self.stopping.set()
+        if self.consumer is not None:
+            self.consumer.terminate()
 
-APP_ENV = os.getenv("APP_ENV")
 
-LOG_LEVEL = logging.DEBUG if APP_ENV in ["dev", "debug-mainRouter"] else logging.INFO
+def create_client_manager():
+    """Returns the client manager selected by APP_SOCKET_MANAGER.
 
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format='[%(asctime)s] [%(filename)s:%(lineno)s - %(funcName)20s() ] %(levelname)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-logger = logging.getLogger(__name__)
-sio = socketio.AsyncServer(logger=True, async_mode='asgi', cors_allowed_origins='*')
+    "kafka" shares emits between processes through Kafka, "memory" keeps them in
+    this process. It defaults to "kafka" when APP_ENGINE_WORKERS is above 1.
+    """
+    default = "kafka" if int(os.getenv("APP_ENGINE_WORKERS", 1)) > 1 else "memory"
+    kind = os.getenv("APP_SOCKET_MANAGER", default).lower()
+    if kind == "kafka":
+        return Kafka_Client_Manager()
+    if kind != "memory":
+        logger.warning("Unknown APP_SOCKET_MANAGER %s, using the in-process manager", kind)
+    return socketio.AsyncManager()
+
+
+sio = socketio.AsyncServer(client_manager=create_client_manager(), logger=True, async_mode='asgi', cors_allowed_origins='*')
+
+# set by the service: called with the connection's WSGI-style environ, returns
+# (user, credential) or (None, None); `credential` names the token the user signed in with
+authenticate = None
+# credential -> SIDs of this process's sockets signed in with it
+signed_in = {}
+
+
+def terminate():
+    """Stops consuming the socket.io topic, if the Kafka client manager is in use."""
+    if isinstance(sio.manager, Kafka_Client_Manager):
+        sio.manager.stop()
+
+
+def _authenticate(sid=None, environ=None):
+    if authenticate is None:
+        return None, None
+    return authenticate(environ if environ is not None else sio.get_environ(sid))
+
+
+async def sign_out(sid):
+    """Removes a signed-in socket from its user and team rooms and forgets its user."""
+    session = await sio.get_session(sid)
+    if "user_id" not in session:
+        return
+    await sio.leave_room(sid, user_room(session["user_id"]))
+    for team in session["teams"]:
+        await sio.leave_room(sid, team_room(team))
+    _forget(sid, session["credential"])
+    await sio.save_session(sid, {})
+
+
+def _forget(sid, credential):
+    sids = signed_in.get(credential)
+    if sids is not None:
+        sids.discard(sid)
+        if not sids:
+            del signed_in[credential]
+
+
+async def revoke(credential):
+    """Signs out this process's sockets that signed in with `credential`."""
+    for sid in list(signed_in.get(credential, ())):
+        try:
+            await sign_out(sid)
+        except KeyError:
+            # disconnected in the meantime
+            continue
 
 @sio.on("connect")
 async def connect(sid, environ):
-    logger.info(f"New Client Connected: {sid}")
+    logger.info("New Client Connected: %s", sid)
+    metrics.socket_connected()
+    # the cookies are only sent with the handshake, so the client reconnects when it signs in or out
+    user, credential = _authenticate(environ=environ)
+    if user is not None:
+        await sio.save_session(sid, {"user_id": str(user.id), "teams": set(), "credential": credential})
+        await sio.enter_room(sid, user_room(user.id))
+        signed_in.setdefault(credential, set()).add(sid)
 
 @sio.on("message")
 async def message(sid, data):
-    logger.info(f"Server Received a message from client: {data}")
+    logger.info("Server Received a message from client: %s", data)
+
+@sio.on("join_team")
+async def join_team(sid, team):
+    """Follows the events of `team`. Only signed-in sockets can join team rooms."""
+    session = await sio.get_session(sid)
+    if "teams" not in session or not isinstance(team, str) or not 0 < len(team) <= MAX_TEAM_NAME_LENGTH:
+        return False
+    # the token the socket connected with may have expired or been revoked since
+    user, _ = _authenticate(sid)
+    if user is None or str(user.id) != session["user_id"]:
+        await sign_out(sid)
+        return False
+    if team not in session["teams"]:
+        if len(session["teams"]) >= MAX_TEAM_ROOMS:
+            return False
+        session["teams"].add(team)
+        await sio.enter_room(sid, team_room(team))
+    return True
+
+@sio.on("leave_team")
+async def leave_team(sid, team):
+    session = await sio.get_session(sid)
+    if team in session.get("teams", ()):
+        session["teams"].discard(team)
+        await sio.leave_room(sid, team_room(team))
+    return True
 
 @sio.on("disconnect")
 async def disconnect(sid):
-    logger.info(f"Client Disconnected: {sid}")
-    
+    logger.info("Client Disconnected: %s", sid)
+    metrics.socket_disconnected()
+    session = await sio.get_session(sid)
+    if "credential" in session:
+        _forget(sid, session["credential"])
+
 @sio.event
 async def connect_error(sid, error):
-    logger.error(f"Socket connection error for SID {sid}: {error}")
-
+    logger.error("Socket connection error for SID %s: %s", sid, error)
@@ -1,7 +1,6 @@
 from typing import List, Any
 import json
 import signal
-import logging
 from datetime import datetime
 
 import os
@@ -9,31 +8,40 @@ import sys
 dir_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(dir_path, "..", ".."))
 sys.path.append(os.path.join(dir_path, ".."))
-from core.services import message_brokers
+from core.services import message_brokers, logs
+from core.services.message_brokers.worker_pool import Partitioned_Worker_Pool
+
+logger = logs.get_logger(__name__)
+
+def process(record):
+    logger.info("processing request %s", record.key)
+    logger.debug("request value: %s", record.value)
 
 
 if __name__ == '__main__':
-    logging.info("App is starting up.")
+    logs.configure()
+    logger.info("App is starting up.")
     message_brokers.initialize()
 
     notification_topic = "test_topic"
+    # partitions bound how many workers (across all replicas) can consume in parallel
+    num_partitions = int(os.getenv("CONSUMER_PARTITIONS", 4))
+    num_workers = int(os.getenv("CONSUMER_WORKERS", num_partitions))
     
     with message_brokers.get_admin_session() as admin_session:
-        message_brokers.create_topic(admin_session, notification_topic)
+        message_brokers.create_topic(admin_session, notification_topic, num_partitions=num_partitions)
+        message_brokers.ensure_partitions(admin_session, notification_topic, num_partitions)
 
-    consumer = message_brokers.Consumer(notification_topic)
+    pool = Partitioned_Worker_Pool(notification_topic, process, num_workers=num_workers)
     def signal_handler(sig, frame):
-        consumer.stop_consume()
+        pool.stop()
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
-    for _, key, value in consumer([notification_topic]):
-        logging.info("processing request")
-
-        logging.info(key)
-        logging.info(value)
+    pool.run([notification_topic])
 
 
-    logging.info("App is exiting.", "Wait a moment until completely exits.")
+    logger.info("App is exiting. Wait a moment until completely exits.")
     message_brokers.terminate()
+    logs.terminate()
@@ -8,6 +8,10 @@ import sys
 dir_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(dir_path, ".."))
 
+from core.services import logs
+# before the other imports, so the records they log are formatted too
+logs.configure()
+
 from core.services import notification
 
 from mailersend import emails
@@ -8,6 +8,10 @@ import sys
 dir_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(dir_path, ".."))
 
+from core.services import logs
+# before the other imports, so the records they log are formatted too
+logs.configure()
+
 from core import models
 from core.services import database, notification
 
@@ -21,6 +25,7 @@ async def lifespan(app: FastAPI):
     print("Management is starting up.")
     database.initialize()
     models.initialize(database.get_session())
+    models.diaries.backfill_derived_fields(database.get_session())
     yield
     # Clean up
     print("Management is exiting.", "Wait a moment until completely exits.")
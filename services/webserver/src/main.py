@@ -9,8 +9,8 @@ import socketio
 import uuid
 import time
 import asyncio
+import threading
 
-import logging
 from pathlib import Path
 import asyncio
 import os
@@ -23,43 +23,81 @@ dir_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(dir_path, "../.."))
 sys.path.append(os.path.join(dir_path, ".."))
 
+from core.services import logs
+# before the other imports, so the records they log are formatted too
+logs.configure()
+
+from core.services import socket as socket_service
 from core.services.socket import sio
 from utils.serve_react import serve_react_app
+from utils.emit_relay import Emit_Relay
+from utils.diary_events import Diary_Event_Dispatcher, DIARY_EVENT
 from core import models
-from core.services import database, message_brokers
+from core.services import database, message_brokers, hashing, metrics, diagnostics
 
 from routes import security, user, Diary
 
+# sockets of a signed-in user join its user room on connect
+socket_service.authenticate = security.socket_user
 
-dir_path = os.path.dirname(os.path.realpath(__file__))
-APP_ENV = os.getenv("APP_ENV")
-
-LOG_LEVEL = logging.DEBUG if APP_ENV in ["dev", "debug-mainRouter"] else logging.INFO
+# component counters on /metrics as app_component_stat
+metrics.register_stats("feed_cache", Diary.feed_cache.stats, ("entries", "bytes", "hits", "misses", "evictions", "invalidations"))
+metrics.register_stats("token_cache", security.token_cache.stats, ("entries", "revoked", "hits", "misses"))
+metrics.register_stats("hashing", hashing.get_metrics, ("waiting", "in_pool", "completed", "failed", "seconds_in_pool"))
+metrics.register_stats("kafka_producer", message_brokers.get_delivery_metrics)
 
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format='[%(asctime)s] [%(filename)s:%(lineno)s - %(funcName)20s() ] %(levelname)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-logger = logging.getLogger(__name__)
+dir_path = os.path.dirname(os.path.realpath(__file__))
+logger = logs.get_logger(__name__, "debug-mainRouter")
 REQUEST_TOPIC = "request_topic"
 RESPONSE_TOPIC = "response_topic"
+EMIT_TOPIC = "emit_message"
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Load
     logger.debug("Webserver is starting up.")
+    metrics.initialize()
     database.initialize()
     models.initialize(database.get_session())
+    hashing.initialize()
     message_brokers.initialize()
     with message_brokers.get_admin_session() as admin_session:
         message_brokers.create_topic(admin_session, REQUEST_TOPIC)
         message_brokers.create_topic(admin_session, RESPONSE_TOPIC)
-        message_brokers.create_topic(admin_session, "emit_message")
+        message_brokers.create_topic(admin_session, EMIT_TOPIC)
+        message_brokers.create_topic(admin_session, socket_service.SOCKET_TOPIC)
+    # relay diary events from Kafka to socket.io clients for the lifetime of the app
+    diary_event_dispatcher = Diary_Event_Dispatcher(sio, window_ms=int(os.getenv("APP_DIARY_EVENT_WINDOW_MS", 250)))
+    emit_relay = Emit_Relay(
+        sio, EMIT_TOPIC,
+        on_message=Diary.invalidate_feeds,
+        handlers={
+            DIARY_EVENT: diary_event_dispatcher.dispatch,
+            security.TOKEN_REVOKED_EVENT: security.apply_revocation,
+        }
+    )
+    await emit_relay.start()
+    app.state.emit_relay = emit_relay
+    metrics.register_stats("emit_relay", emit_relay.stats, ("records", "bytes", "batches", "queued", "failures"))
+    watchdog = None
+    if diagnostics.enabled():
+        watchdog = diagnostics.Loop_Watchdog(threshold_ms=int(os.getenv("APP_LOOP_BLOCK_MS", 100)))
+        await watchdog.start()
     yield
     # Clean up
     logger.info("Webserver is exiting, Wait a moment until completely exits.")
+    if watchdog is not None:
+        await watchdog.stop()
+    await emit_relay.stop()
+    await diary_event_dispatcher.stop()
+    socket_service.terminate()
+    # deliver whatever the producer still buffers before the process exits
+    await message_brokers.flush(timeout=10)
+    message_brokers.terminate()
+    hashing.terminate()
     database.terminate()
+    metrics.terminate()
+    logs.terminate()
 
 app = FastAPI(
     lifespan=lifespan,
@@ -69,16 +107,6 @@ app = FastAPI(
 )
 app.mount('/socket.io', socketio.ASGIApp(sio, app))
 
-# Kafka consumer background task
-async def kafka_listener():
-    consumer = message_brokers.Consumer("emit_message")
-    while True:
-        for message in consumer(["emit_message"]):
-            topic, key, value = message
-            logger.info(f"Received message from Kafka: {value}")
-            await sio.emit(key, value)
-        break
-        
 #NOTE - (start) Kafka topic sent testing
 # async def process_kafka_messages(unique_key: str):
 #     req_consumer = message_brokers.Consumer(REQUEST_TOPIC)
@@ -90,13 +118,13 @@ async def kafka_listener():
 #     while not (request_processed and response_processed):
 #         for _, key, value in req_consumer([REQUEST_TOPIC]):
 #             if key == unique_key:
-#                 logger.debug(f"Processing request: {value}")
+#                 logger.debug("Processing request: %s", value)
 #                 request_processed = True
 #                 break
         
 #         for _, key, value in res_consumer([RESPONSE_TOPIC]):
 #             if key == unique_key:
-#                 logger.debug(f"Processing response: {value}")
+#                 logger.debug("Processing response: %s", value)
 #                 response_processed = True
 #                 break
     
@@ -105,47 +133,48 @@ async def kafka_listener():
 
 # @app.middleware("http")
 # async def kafka_middleware(request: Request, call_next):
-    unique_key = str(uuid.uuid4())
-    serialized_request = {
-        "method": request.method,
-        "url": str(request.url),
-        "headers": dict(request.headers),
-        "body": (await request.body()).decode()
-    }
+#     unique_key = str(uuid.uuid4())
+#     serialized_request = {
+#         "method": request.method,
+#         "url": str(request.url),
+#         "headers": dict(request.headers),
+#         "body": (await request.body()).decode()
+#     }
     
-    message_brokers.send_message(REQUEST_TOPIC, unique_key, serialized_request)
+#     message_brokers.send_message(REQUEST_TOPIC, unique_key, serialized_request)
     
-    response = await call_next(request)
+#     response = await call_next(request)
     
-    serialized_response = {
-        "status_code": response.status_code,
-        "headers": dict(response.headers)
-    }
-    # If the response is StreamingResponse, we can't access its body directly
-    if isinstance(response, StreamingResponse):
-        serialized_response["body"] = "Streaming content"
-    else:
-        serialized_response["body"] = response.body.decode() if response.body else None
+#     serialized_response = {
+#         "status_code": response.status_code,
+#         "headers": dict(response.headers)
+#     }
+#     # If the response is StreamingResponse, we can't access its body directly
+#     if isinstance(response, StreamingResponse):
+#         serialized_response["body"] = "Streaming content"
+#     else:
+#         serialized_response["body"] = response.body.decode() if response.body else None
     
-    message_brokers.send_message(RESPONSE_TOPIC, unique_key, serialized_response)
+#     message_brokers.send_message(RESPONSE_TOPIC, unique_key, serialized_response)
     
-    background_tasks = BackgroundTasks()
-    background_tasks.add_task(process_kafka_messages, unique_key)
-    response.background = background_tasks
-    return response
+#     background_tasks = BackgroundTasks()
+#     background_tasks.add_task(process_kafka_messages, unique_key)
+#     response.background = background_tasks
+#     return response
 # #NOTE - (end) Kafka topic sent testing
 
 # to catch some request that doesn't hit any route
 @app.middleware("http")
 async def log_all_requests_middleware(request: Request, call_next):
-    logger.info("incoming request")
-    logger.info(f"{request.method} {request.url}")
     response = await call_next(request)
-    if request.url.path in ["/api/v1/diary/", "/api/v1/diary/id/{diary_id}", "/api/v1/diary/my_private"]:
-        await kafka_listener()
-    logger.info(f"with response: {response.status_code} {request.url}")
+    # one line per request; the request ID comes from the log filter
+    logger.info("%s %s %s", request.method, request.url.path, response.status_code)
     return response
 
+app.add_middleware(diagnostics.Request_Context_Middleware)
+# outermost, so the time includes every other middleware
+app.add_middleware(metrics.Metrics_Middleware)
+
 router = APIRouter(prefix="/api/v1")
 router.include_router(security.router)
 router.include_router(user.router)
@@ -156,19 +185,66 @@ app.include_router(router)
 
 @app.get("/test_message")
 async def test_message():
-    message_brokers.send_message("test_topic", "test_key", {"test": "test"})
+    await message_brokers.send("test_topic", "test_key", {"test": "test"})
     return {"message": "Message sent."}
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/api/v1/debug/profile")
+async def profile(
+    seconds: float = Query(10, gt=0, le=60),
+    hz: int = Query(50, ge=1, le=1000),
+    loop_only: bool = Query(False, description="Only sample the event loop thread"),
+    is_admin: bool = Depends(security.check_is_admin)
+):
+    """Samples this worker's stacks and returns them collapsed, ready for flamegraph.pl or speedscope.
+    Only available when APP_DIAGNOSTICS is set.
+    """
+    if not diagnostics.enabled():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Diagnostics are disabled")
+    loop = asyncio.get_running_loop()
+    thread_ids = {threading.get_ident()} if loop_only else None
+    try:
+        stacks = await loop.run_in_executor(None, diagnostics.sample_stacks, seconds, hz, thread_ids)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return Response(content=stacks, media_type="text/plain")
+
 @app.get("/api/v1/ping")
 async def ping():
     return {"status": "ok"}
 
+@app.get("/api/v1/health/database")
+async def database_health():
+    """Pings MongoDB and reports the pool settings, pool usage and per-command latencies of this worker."""
+    started = time.perf_counter()
+    try:
+        await database.get_async_session().command("ping")
+        health = {"status": "ok", "ping_ms": round((time.perf_counter() - started) * 1000, 3)}
+        status_code = status.HTTP_200_OK
+    except Exception as e:
+        logger.error("Database health check failed: %s", e)
+        health = {"status": "error", "error": str(e)}
+        status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    health.update(database.get_metrics())
+    return JSONResponse(content=health, status_code=status_code)
+
+@app.get("/api/v1/health/relay")
+async def relay_health(request: Request):
+    """Reports whether this worker relays the emit_message topic: socket.io emits, feed invalidations and token revocations."""
+    health = request.app.state.emit_relay.health()
+    status_code = status.HTTP_200_OK if health["status"] == "ok" else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(content=health, status_code=status_code)
+
 # Mount the React app
 serve_react_app(app, "react_build")
 
 if __name__ == '__main__':
     import uvicorn
     workers = int(os.getenv("APP_ENGINE_WORKERS", 1))
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, log_level="info", workers=workers)
-    # Start Kafka listener in the background
-    asyncio.create_task(kafka_listener())
\ No newline at end of file
+    if workers > 1:
+        # must happen before the workers import prometheus_client
+        metrics.prepare_multiprocess_dir()
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, log_level="info", workers=workers)
\ No newline at end of file
@@ -1,27 +1,34 @@
-import logging
 from fastapi import APIRouter, FastAPI, Depends, HTTPException, Header, Query, Body, UploadFile, status, Response, Form, Request, File
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import Optional, List, Any
 import os
 
 from core.services.socket import sio
 from core import models
-from core.services import database, message_brokers
+from core.services import database, logs
+from utils.feed_cache import Feed_Cache
+from utils import json_stream, diary_events
 from . import security
 
 DOMAIN = os.getenv("APP_DOMAIN")
-APP_ENV = os.getenv("APP_ENV", "prod")
-LOG_LEVEL = logging.DEBUG if APP_ENV in ["dev", "debug-DiaryRouter"] else logging.INFO
+logger = logs.get_logger(__name__, "debug-DiaryRouter")
 
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format='[%(asctime)s] [%(filename)s:%(lineno)s - %(funcName)20s() ] %(levelname)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
+router = APIRouter(prefix="/diary", tags=["diary"])
+
+# serialized public feeds of this worker, keyed by (team, limit, cursor)
+feed_cache = Feed_Cache(
+    max_entries=int(os.getenv("APP_FEED_CACHE_ENTRIES", 256)),
+    max_bytes=int(os.getenv("APP_FEED_CACHE_BYTES", 32 * 1024 * 1024)),
+    ttl=float(os.getenv("APP_FEED_CACHE_TTL", 60)),
 )
-logger = logging.getLogger(__name__)
 
-router = APIRouter(prefix="/diary", tags=["diary"])
+def invalidate_feeds(event, payload):
+    """Called for every message relayed from the emit_message topic; diary changes drop the cached feeds of their team."""
+    if event == diary_events.DIARY_EVENT:
+        teams = diary_events.affected_teams(payload)
+        if teams:
+            feed_cache.invalidate(*teams, diary_events.ALL_TEAMS)
 
 @router.post("/")
 async def create_diary(
@@ -40,22 +47,23 @@ async def create_diary(
             logger.error("Invalid refresh token")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-        db_session = database.get_session()
+        db_session = database.get_async_session()
         
-        result = models.diaries.add(db_session, new_diary, user)
-        # await sio.emit("new_diary_created", result)
-        message_brokers.send_message("emit_message", "new_diary_created", str(result))     
-        logger.info("sent message to client, new_diary_created id: %s", result)   
-        logger.info("Diary created successfully")
+        result = await models.diaries.add_async(db_session, new_diary, user)
         if isinstance(result, str) and result.startswith("Error"):
-            logger.error(f"Error adding diary: {result}")
+            logger.error("Error adding diary: %s", result)
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=result)
+        event = diary_events.created_event(result, new_diary, user)
+        invalidate_feeds(diary_events.DIARY_EVENT, event)
+        await diary_events.publish(event)
+        logger.info("sent message to client, diary created id: %s", result)
+        logger.info("Diary created successfully")
         
-        logger.debug(f"Diary created with ID: {result}")
+        logger.debug("Diary created with ID: %s", result)
         return JSONResponse(content={"id": result})
     
     except Exception as e:
-        logger.error(f"Error in create_diary: {str(e)}")
+        logger.error("Error in create_diary: %s", e)
         # Extract the original status code if available, otherwise use 500
         status_code = getattr(e, 'status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
         # Raise a new HTTPException with the original status code and error message
@@ -64,6 +72,90 @@ async def create_diary(
             detail=str(e)
         )
         
+@router.post("/import")
+async def import_diaries(request: Request):
+    """Creates diaries from an NDJSON body, one New_Diary per line; a gzip body needs Content-Encoding: gzip.
+    Returns a report with the number of inserted and failed lines and the error of each failed line.
+    Lines longer than json_stream.MAX_LINE_LENGTH fail on their own; a gzip body that decompresses
+    past json_stream.MAX_DECOMPRESSED_SIZE is refused with 413.
+    """
+    logger.info("Requesting import_diaries")
+    try:
+        refresher = request.cookies.get(f"_{DOMAIN}_refresh_token")
+        if refresher is None:
+            logger.error("Missing refresh token")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing refresh token")
+
+        expired, user = security.decode_token(refresher)
+        if user is None:
+            logger.error("Invalid refresh token")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+
+        body = request.stream()
+        if request.headers.get("content-encoding", "").lower() == "gzip":
+            body = json_stream.gunzip_stream(body)
+
+        db_session = database.get_async_session()
+        report = await models.diaries.import_async(db_session, json_stream.ndjson_lines(body), user)
+        if report["inserted"] > 0:
+            # one event for the whole import instead of one per diary
+            event = diary_events.imported_event(report, user)
+            invalidate_feeds(diary_events.DIARY_EVENT, event)
+            await diary_events.publish(event)
+            logger.info("sent message to client, diaries imported: %s", report["inserted"])
+        return JSONResponse(content=report)
+    except Exception as e:
+        logger.error("Error in import_diaries: %s", e)
+        # Extract the original status code if available, otherwise use 500
+        status_code = getattr(e, 'status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Raise a new HTTPException with the original status code and error message
+        raise HTTPException(
+            status_code=status_code,
+            detail=str(e)
+        )
+
+@router.get("/export")
+async def export_diaries(
+    request: Request,
+    team: Optional[str] = Query(None, description="Export the public diaries of this team instead of your own diaries"),
+    compress: bool = Query(False, description="Send the export as a gzip file"),
+):
+    logger.info("Requesting export_diaries")
+    try:
+        refresher = request.cookies.get(f"_{DOMAIN}_refresh_token")
+        if refresher is None:
+            logger.error("Missing refresh token")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing refresh token")
+
+        expired, user = security.decode_token(refresher)
+        if user is None:
+            logger.error("Invalid refresh token")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+
+        db_session = database.get_async_session()
+        body = json_stream.ndjson_stream(models.diaries.export_async(db_session, user, team))
+        filename = f"diaries-{team or user.username}.ndjson"
+        if compress:
+            return StreamingResponse(
+                json_stream.gzip_stream(body),
+                media_type="application/gzip",
+                headers={"Content-Disposition": f'attachment; filename="{filename}.gz"'},
+            )
+        return StreamingResponse(
+            body,
+            media_type=json_stream.NDJSON_MEDIA_TYPE,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+    except Exception as e:
+        logger.error("Error in export_diaries: %s", e)
+        # Extract the original status code if available, otherwise use 500
+        status_code = getattr(e, 'status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Raise a new HTTPException with the original status code and error message
+        raise HTTPException(
+            status_code=status_code,
+            detail=str(e)
+        )
+
 @router.post("/id/{diary_id}")
 async def get_my_diary_id(request: Request, diary_id: str):
     logger.info("Requesting get_my_diary_id")
@@ -78,16 +170,48 @@ async def get_my_diary_id(request: Request, diary_id: str):
             logger.error("Invalid refresh token")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-        db_session = database.get_session()
-        result = models.diaries.get_diary_by_id(db_session, diary_id, user)
+        db_session = database.get_async_session()
+        result = await models.diaries.get_diary_by_id_async(db_session, diary_id, user)
+        if result is None:
+            logger.error("Diary not found")
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Diary not found")
+
+        logger.debug("Diary retrieved: %s", result.id)
+        return JSONResponse(content=jsonable_encoder(result))
+    except Exception as e:
+        logger.error("Error in get_my_diary_id: %s", e)
+        # Extract the original status code if available, otherwise use 500
+        status_code = getattr(e, 'status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Raise a new HTTPException with the original status code and error message
+        raise HTTPException(
+            status_code=status_code,
+            detail=str(e)
+        )
+
+@router.post("/visible/{diary_id}")
+async def get_visible_diary(request: Request, diary_id: str):
+    """Returns a published diary, or one of your own; clients refresh a listed diary with it after a diary event."""
+    logger.info("Requesting get_visible_diary")
+    try:
+        refresher = request.cookies.get(f"_{DOMAIN}_refresh_token")
+        if refresher is None:
+            logger.error("Missing refresh token")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing refresh token")
+
+        expired, user = security.decode_token(refresher)
+        if user is None:
+            logger.error("Invalid refresh token")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+
+        db_session = database.get_async_session()
+        result = await models.diaries.get_visible_diary_async(db_session, diary_id, user)
         if result is None:
             logger.error("Diary not found")
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Diary not found")
 
-        logger.debug(f"Diary retrieved: {result}")
         return JSONResponse(content=jsonable_encoder(result))
     except Exception as e:
-        logger.error(f"Error in get_my_diary_id: {str(e)}")
+        logger.error("Error in get_visible_diary: %s", e)
         # Extract the original status code if available, otherwise use 500
         status_code = getattr(e, 'status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
         # Raise a new HTTPException with the original status code and error message
@@ -97,7 +221,13 @@ async def get_my_diary_id(request: Request, diary_id: str):
         )
         
 @router.post("/my_private")
-async def my_private_diaries(request: Request):
+async def my_private_diaries(
+    request: Request,
+    limit: int = Query(models.diaries.DEFAULT_PAGE_SIZE, ge=1, le=models.diaries.MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    stream: bool = Query(False, description="Stream the diaries as they are read; implied by Accept: application/x-ndjson"),
+    view: str = Query("full", regex="^(full|summary)$", description="'summary' lists the diaries without their content"),
+):
     logger.info("Requesting my_private_diaries")
     try:
         refresher = request.cookies.get(f"_{DOMAIN}_refresh_token")
@@ -110,14 +240,23 @@ async def my_private_diaries(request: Request):
             logger.error("Invalid refresh token")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-        db_session = database.get_session()
-        diaries, count = models.diaries.get_private_diaries(db_session, user)
-        encoded_diaries = jsonable_encoder({"diaries": diaries, "count": count})
+        db_session = database.get_async_session()
+        if stream or json_stream.wants_ndjson(request):
+            try:
+                count, page, documents = await models.diaries.stream_listing_async(db_session, "private", user, limit, cursor, view)
+            except ValueError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+            return json_stream.streaming_response(request, "diaries", documents, lambda: {"count": count, **page})
 
-        logger.debug(f"Private diaries retrieved: {encoded_diaries}")
-        return JSONResponse(content=encoded_diaries)
+        try:
+            diaries, count, next_cursor = await models.diaries.get_private_diaries_async(db_session, user, limit, cursor, validate=False, view=view)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+        logger.debug("Private diaries retrieved: %s", count)
+        return Response(content=models.base.dumps({"diaries": diaries, "count": count, "next_cursor": next_cursor}), media_type="application/json")
     except Exception as e:
-        logger.error(f"Error in my_private_diaries: {str(e)}")
+        logger.error("Error in my_private_diaries: %s", e)
         # Extract the original status code if available, otherwise use 500
         status_code = getattr(e, 'status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
         # Raise a new HTTPException with the original status code and error message
@@ -127,7 +266,13 @@ async def my_private_diaries(request: Request):
         )
         
 @router.post("/my_published")
-async def my_published_diaries(request: Request):
+async def my_published_diaries(
+    request: Request,
+    limit: int = Query(models.diaries.DEFAULT_PAGE_SIZE, ge=1, le=models.diaries.MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    stream: bool = Query(False, description="Stream the diaries as they are read; implied by Accept: application/x-ndjson"),
+    view: str = Query("full", regex="^(full|summary)$", description="'summary' lists the diaries without their content"),
+):
     logger.info("Requesting my_published_diaries")
     try:
         refresher = request.cookies.get(f"_{DOMAIN}_refresh_token")
@@ -140,14 +285,23 @@ async def my_published_diaries(request: Request):
             logger.error("Invalid refresh token")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-        db_session = database.get_session()
-        diaries, count = models.diaries.get_published_diaries(db_session, user)
-        encoded_diaries = jsonable_encoder({"diaries": diaries, "count": count})
+        db_session = database.get_async_session()
+        if stream or json_stream.wants_ndjson(request):
+            try:
+                count, page, documents = await models.diaries.stream_listing_async(db_session, "published", user, limit, cursor, view)
+            except ValueError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+            return json_stream.streaming_response(request, "diaries", documents, lambda: {"count": count, **page})
+
+        try:
+            diaries, count, next_cursor = await models.diaries.get_published_diaries_async(db_session, user, limit, cursor, validate=False, view=view)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-        logger.debug(f"Published diaries retrieved: {encoded_diaries}")
-        return JSONResponse(content=encoded_diaries)
+        logger.debug("Published diaries retrieved: %s", count)
+        return Response(content=models.base.dumps({"diaries": diaries, "count": count, "next_cursor": next_cursor}), media_type="application/json")
     except Exception as e:
-        logger.error(f"Error in my_published_diaries: {str(e)}")
+        logger.error("Error in my_published_diaries: %s", e)
         # Extract the original status code if available, otherwise use 500
         status_code = getattr(e, 'status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
         # Raise a new HTTPException with the original status code and error message
@@ -157,7 +311,14 @@ async def my_published_diaries(request: Request):
         )
         
 @router.post("/publics/{team}")
-async def publics_diaries(request: Request, team: str):
+async def publics_diaries(
+    request: Request,
+    team: str,
+    limit: int = Query(models.diaries.DEFAULT_PAGE_SIZE, ge=1, le=models.diaries.MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    stream: bool = Query(False, description="Stream the diaries as they are read; implied by Accept: application/x-ndjson"),
+    view: str = Query("full", regex="^(full|summary)$", description="'summary' lists the diaries without their content"),
+):
     logger.info("Requesting publics_diaries")
     try:
         refresher = request.cookies.get(f"_{DOMAIN}_refresh_token")
@@ -170,14 +331,38 @@ async def publics_diaries(request: Request, team: str):
             logger.error("Invalid refresh token")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-        db_session = database.get_session()
-        diaries, count = models.diaries.get_public_diaries(db_session, team)
-        encoded_diaries = jsonable_encoder({"diaries": diaries, "count": count})
+        if json_stream.wants_ndjson(request):
+            cached = None
+        else:
+            cache_key = (team, limit, cursor, view)
+            cached = feed_cache.get(cache_key)
+
+        if cached is None and (stream or json_stream.wants_ndjson(request)):
+            # stream misses instead of building the whole body; cache hits are already in memory
+            try:
+                count, page, documents = await models.diaries.stream_listing_async(database.get_async_session(), "public", team, limit, cursor, view)
+            except ValueError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+            return json_stream.streaming_response(request, "diaries", documents, lambda: {"count": count, **page})
 
-        logger.debug(f"Public diaries retrieved: {encoded_diaries}")
-        return JSONResponse(content=encoded_diaries)
+        if cached is None:
+            db_session = database.get_async_session()
+            # an invalidation while the feed is read makes the result unfit for the cache
+            generation = feed_cache.generation(team)
+            try:
+                diaries, count, next_cursor = await models.diaries.get_public_diaries_async(db_session, team, limit, cursor, validate=False, view=view)
+            except ValueError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+            body = models.base.dumps({"diaries": diaries, "count": count, "next_cursor": next_cursor})
+            cached = feed_cache.put(cache_key, body, generation)
+            logger.debug("Public diaries retrieved: %s", count)
+
+        body, etag = cached
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response(content=body, media_type="application/json", headers={"ETag": etag})
     except Exception as e:
-        logger.error(f"Error in publics_diaries: {str(e)}")
+        logger.error("Error in publics_diaries: %s", e)
         # Extract the original status code if available, otherwise use 500
         status_code = getattr(e, 'status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
         # Raise a new HTTPException with the original status code and error message
@@ -186,11 +371,51 @@ async def publics_diaries(request: Request, team: str):
             detail=str(e)
         )
         
+@router.post("/search")
+async def search_diaries(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=256, description="Words or \"phrases\" to search for; -word excludes a word"),
+    team: Optional[str] = Query(None, description="Only search the public diaries of this team"),
+    published: bool = Query(True, description="Search public diaries, or your private diaries when false"),
+    limit: int = Query(models.diaries.DEFAULT_PAGE_SIZE, ge=1, le=models.diaries.MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    view: str = Query("summary", regex="^(full|summary)$", description="'summary' lists the diaries without their content"),
+):
+    logger.info("Requesting search_diaries")
+    try:
+        refresher = request.cookies.get(f"_{DOMAIN}_refresh_token")
+        if refresher is None:
+            logger.error("Missing refresh token")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing refresh token")
+
+        expired, user = security.decode_token(refresher)
+        if user is None:
+            logger.error("Invalid refresh token")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+
+        db_session = database.get_async_session()
+        try:
+            diaries, count, next_cursor = await models.diaries.search_async(db_session, q, user, team, published, limit, cursor, view)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+        logger.debug("Diaries found: %s", count)
+        return Response(content=models.base.dumps({"diaries": diaries, "count": count, "next_cursor": next_cursor}), media_type="application/json")
+    except Exception as e:
+        logger.error("Error in search_diaries: %s", e)
+        # Extract the original status code if available, otherwise use 500
+        status_code = getattr(e, 'status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Raise a new HTTPException with the original status code and error message
+        raise HTTPException(
+            status_code=status_code,
+            detail=str(e)
+        )
+
 @router.put("/id/{diary_id}")
 async def update_diary(diary_id: str, request: Request, diary_data: models.diaries.Edited_Diary):
     logger.info("Requesting update_diary")
     try:
-        db_session = database.get_session()
+        db_session = database.get_async_session()
         refresher = request.cookies.get(f"_{DOMAIN}_refresh_token")
         if refresher is None:
             logger.error("Missing refresh token")
@@ -201,18 +426,22 @@ async def update_diary(diary_id: str, request: Request, diary_data: models.diari
             logger.error("Invalid refresh token")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-        result = models.diaries.update(db_session, diary_id, user, diary_data)
+        try:
+            result, was_published = await models.diaries.update_async(db_session, diary_id, user, diary_data)
+        except models.diaries.Diary_Conflict as e:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
         if not result:
             logger.error("Diary not found or not updated")
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Diary not found or not updated")
         
-        # await sio.emit("diary_id_updated", diary_id)
-        message_brokers.send_message("emit_message", "diary_id_updated", diary_id)
-        logger.info("sent message to client, diary_id_updated: %s", diary_id)
+        event = diary_events.updated_event(result, was_published)
+        invalidate_feeds(diary_events.DIARY_EVENT, event)
+        await diary_events.publish(event)
+        logger.info("sent message to client, diary updated: %s", diary_id)
         logger.info("Diary updated successfully")
-        return JSONResponse(content={"message": "Diary updated successfully"})
+        return JSONResponse(content={"message": "Diary updated successfully", "version": result.version})
     except Exception as e:
-        logger.error(f"Error in update_diary: {str(e)}")
+        logger.error("Error in update_diary: %s", e)
         # Extract the original status code if available, otherwise use 500
         status_code = getattr(e, 'status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
         # Raise a new HTTPException with the original status code and error message
@@ -222,10 +451,10 @@ async def update_diary(diary_id: str, request: Request, diary_data: models.diari
         )
         
 @router.delete("/id/{diary_id}")
-async def delete_diary(diary_id: str, request: Request):
+async def delete_diary(diary_id: str, request: Request, version: Optional[int] = Query(None, description="Only delete the diary if it is still at this version")):
     logger.info("Requesting delete_diary")
     try:
-        db_session = database.get_session()
+        db_session = database.get_async_session()
         refresher = request.cookies.get(f"_{DOMAIN}_refresh_token")
         if refresher is None:
             logger.error("Missing refresh token")
@@ -236,18 +465,22 @@ async def delete_diary(diary_id: str, request: Request):
             logger.error("Invalid refresh token")
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-        result = models.diaries.delete(db_session, diary_id, user)
+        try:
+            result = await models.diaries.delete_async(db_session, diary_id, user, version)
+        except models.diaries.Diary_Conflict as e:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
         if not result:
             logger.error("Diary not found or not deleted")
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Diary not found or not deleted")
         
-        # await sio.emit("diary_id_deleted", diary_id)
-        message_brokers.send_message("emit_message", "diary_id_deleted", diary_id)
-        logger.info("sent message to client, diary_id_deleted: %s", diary_id)
+        event = diary_events.deleted_event(result)
+        invalidate_feeds(diary_events.DIARY_EVENT, event)
+        await diary_events.publish(event)
+        logger.info("sent message to client, diary deleted: %s", diary_id)
         logger.info("Diary deleted successfully")
         return JSONResponse(content={"message": "Diary deleted successfully"})
     except Exception as e:
-        logger.error(f"Error in delete_diary: {str(e)}")
+        logger.error("Error in delete_diary: %s", e)
         # Extract the original status code if available, otherwise use 500
         status_code = getattr(e, 'status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
         # Raise a new HTTPException with the original status code and error message
@@ -1,33 +1,23 @@
-import logging
 from fastapi import APIRouter, FastAPI, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.responses import JSONResponse
 from typing import Optional, Dict
+from http.cookies import SimpleCookie
 import jwt
 from datetime import datetime, timedelta
 import pytz
 import os
 import sys
-import json
-
-# Set up the logging configuration based on environment
-APP_ENV = os.getenv("APP_ENV", "prod")
-LOG_LEVEL = logging.DEBUG if APP_ENV in ["dev", "debug-SecurityRouter"] else logging.INFO
-
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format='[%(asctime)s] [%(filename)s:%(lineno)s - %(funcName)20s() ] %(levelname)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-logger = logging.getLogger(__name__)
-logger.debug("APP_ENV: %s", APP_ENV)
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(dir_path, "..", ".."))
 
 from core.models import users, Token
-from core.services import database
+from core.services import database, logs, message_brokers
+from core.services import socket as socket_service
+from utils.token_cache import Token_Cache
 
+logger = logs.get_logger(__name__, "debug-SecurityRouter")
 
 router = APIRouter(prefix="/authen", tags=["security"])
 
@@ -36,18 +26,26 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 24 * 60 * 2
 REFRESH_TOKEN_EXPIRE_MINUTES = 24 * 60 * 2
 DOMAIN = os.getenv("APP_DOMAIN")
 
+# verified tokens of this worker, so the signature check and User rebuild run once per token
+token_cache = Token_Cache(
+    max_entries=int(os.getenv("APP_TOKEN_CACHE_SIZE", 4096)),
+    max_revoked=int(os.getenv("APP_TOKEN_REVOKED_SIZE", 65536)),
+)
+# emit_message key of a revocation, handled by every worker with `apply_revocation`
+TOKEN_REVOKED_EVENT = "token_revoked"
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = timedelta(minutes=15)):
     SECRET_KEY = os.getenv("APP_SECRET_KEY")
     expire = datetime.now(tz=pytz.utc) + expires_delta
     to_encode = data.copy()
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    logger.debug("Access token created: %s", encoded_jwt)
+    logger.debug("Access token created, expires at %s", expire)
     return encoded_jwt
 
 def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = timedelta(minutes=30)):
     token = create_access_token(data=data, expires_delta=expires_delta)
-    logger.debug("Refresh token created: %s", token)
+    logger.debug("Refresh token created")
     return token
 
 def create_tokens(user: users.User):
@@ -66,6 +64,13 @@ credentials_exception = HTTPException(
 
 def decode_token(token: str):
     logger.info("decoding token")
+    if token_cache.is_revoked(token):
+        logger.error("Token revoked")
+        raise credentials_exception
+    user = token_cache.get(token)
+    if user is not None:
+        return False, user
+
     SECRET_KEY = os.getenv("APP_SECRET_KEY")
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -81,7 +86,33 @@ def decode_token(token: str):
     except jwt.InvalidTokenError:
         logger.error("Invalid token")
         raise credentials_exception
-    return expired, users.User.deserialize(payload)
+    user = users.User.deserialize(payload)
+    if not expired:
+        token_cache.put(token, exp, user)
+    return expired, user
+
+async def revoke_token(token: str):
+    """Evicts `token` from the verified-token cache and rejects it until it expires, on every worker.
+
+    Only tokens we signed are revoked; an expired or forged one is rejected
+    anyway. The other workers learn the revocation through the emit_message
+    topic, which carries the token's digest, not the token.
+    """
+    SECRET_KEY = os.getenv("APP_SECRET_KEY")
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        exp = float(payload["exp"])
+    except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+        return
+    digest = Token_Cache.key(token)
+    token_cache.revoke_digest(digest, exp)
+    await socket_service.revoke(digest)
+    await message_brokers.send("emit_message", TOKEN_REVOKED_EVENT, {"digest": digest, "exp": exp})
+
+async def apply_revocation(value):
+    """Emit_Relay handler of TOKEN_REVOKED_EVENT; also signs out the sockets using the token."""
+    token_cache.revoke_digest(value["digest"], float(value["exp"]))
+    await socket_service.revoke(value["digest"])
 
 def create_token_response(user: users.User):
     logger.info("creating token response")
@@ -97,18 +128,17 @@ def create_token_response(user: users.User):
     # response.set_cookie(f"_{DOMAIN}_refresh_token", tokens.refresh_token, httponly=True, secure=secure_flag, samesite=same_site_flag)
     response.set_cookie(f"_{DOMAIN}_access_token", tokens.access_token, httponly=True, secure=True, samesite="Strict")
     response.set_cookie(f"_{DOMAIN}_refresh_token", tokens.refresh_token, httponly=True, secure=True, samesite="Strict")
-    logger.debug("Token response created for user: %s with status code: %s, headers: %s, body: %s",
-                 user.username, response.status_code, response.headers, response.body)
+    logger.debug("Token response created for user: %s with status code: %s", user.username, response.status_code)
     return response
 
 @router.post('/refresh')
 async def refresh_token(request: Request):
     logger.info("requesting Refresh token")
-    request_str = json.dumps(dict(request.cookies), indent=4)  # Serialize cookies to a string
-    logger.debug("Request cookies: %s", request_str)
+    # names only, the values are credentials
+    logger.debug("Request cookies: %s", list(request.cookies))
     try:  
         token: str = request.cookies.get(f"_{DOMAIN}_refresh_token")
-        logger.debug(f"get cookies_{DOMAIN}_refresh_token: %s", token)
+        logger.debug("Refresh token cookie present: %s", token is not None)
         if not token:
             logger.error("Refresh token not found")
             raise HTTPException(
@@ -117,10 +147,10 @@ async def refresh_token(request: Request):
                 headers={"WWW-Authenticate": "Bearer"},
             )    
         expired, user = decode_token(token)
-        logger.debug("Token verified: %s, Expired: %s, User: %s", token, expired, user)
+        logger.debug("Token verified, Expired: %s, User: %s", expired, user)
         
-        db_session = database.get_session()
-        user = users.get_by_id(db_session, user_id=user.id)
+        db_session = database.get_async_session()
+        user = await users.get_by_id_async(db_session, user_id=user.id)
         if user is not None:
             logger.debug("User found for refresh token")
             return create_token_response(user)
@@ -134,12 +164,12 @@ async def refresh_token(request: Request):
     
     except HTTPException as http_exc:
         # Log the HTTPException details and re-raise it
-        logger.error(f"HTTPException during token refresh: {str(http_exc)}")
+        logger.error("HTTPException during token refresh: %s", http_exc)
         raise http_exc
     
     except Exception as e:
         # Log the general exception details
-        logger.error(f"Unexpected error during token refresh: {str(e)}")
+        logger.error("Unexpected error during token refresh: %s", e)
         # Extract the original status code if available, otherwise use 500
         status_code = getattr(e, 'status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
         # Raise a new HTTPException with the original status code and error message
@@ -160,7 +190,7 @@ async def login(form_data: users.LoginForm):
                 detail="Username and password are required",
             )
         
-        result, user = users.check_password(database.get_session(), form_data.username.lower(), form_data.password)
+        result, user = await users.check_password_async(database.get_async_session(), form_data.username.lower(), form_data.password)
         logger.debug("Login result: %s, User: %s", result, user)
         
         if result:
@@ -180,7 +210,7 @@ async def login(form_data: users.LoginForm):
     
     except Exception as e:
         # Log the exception details
-        logger.error(f"Unexpected error during login: {str(e)}")
+        logger.error("Unexpected error during login: %s", e)
         # Extract the original status code if available, otherwise use 500
         status_code = getattr(e, 'status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
         # Raise a new HTTPException with the original status code and error message
@@ -203,12 +233,12 @@ async def verify(request: Request):
 
     except HTTPException as http_exc:
         # Log the HTTPException details and re-raise it
-        logger.error(f"HTTPException during verify: {str(http_exc)}")
+        logger.error("HTTPException during verify: %s", http_exc)
         raise http_exc
 
     except Exception as e:
         # Log the general exception details
-        logger.error(f"Unexpected error during verify: {str(e)}")
+        logger.error("Unexpected error during verify: %s", e)
         # Extract the original status code if available, otherwise use 500
         status_code = getattr(e, 'status_code', status.HTTP_500_INTERNAL_SERVER_ERROR)
         # Raise a new HTTPException with the original status code and error message
@@ -222,6 +252,10 @@ async def verify(request: Request):
 @router.post("/logout")
 async def logout(request: Request):
     logger.info("requesting Logout")
+    for cookie_name in (f"_{DOMAIN}_access_token", f"_{DOMAIN}_refresh_token"):
+        token = request.cookies.get(cookie_name)
+        if token:
+            await revoke_token(token)
     response = JSONResponse(status_code=status.HTTP_200_OK, content="OK")
     response.delete_cookie(f"_{DOMAIN}_access_token")
     response.delete_cookie(f"_{DOMAIN}_refresh_token")
@@ -229,11 +263,11 @@ async def logout(request: Request):
 
 async def check_token(request: Request):
     logger.info("Checking access token")
-    request_str = json.dumps(dict(request.cookies), indent=4)  # Serialize cookies to a string
-    logger.debug("Request cookies: %s", request_str)
+    # names only, the values are credentials
+    logger.debug("Request cookies: %s", list(request.cookies))
     try:
         token: str = request.cookies.get(f"_{DOMAIN}_access_token")
-        logger.debug(f"get cookies_{DOMAIN}_access_token: %s", token)
+        logger.debug("Access token cookie present: %s", token is not None)
         if not token:
             logger.error("Access token not found")
             raise HTTPException(
@@ -242,7 +276,7 @@ async def check_token(request: Request):
                 headers={"WWW-Authenticate": "Bearer"},
             )
         expired, user = decode_token(token)
-        logger.debug("Token verified: %s, Expired: %s, User: %s", token, expired, user)
+        logger.debug("Token verified, Expired: %s, User: %s", expired, user)
         if expired:
             response = JSONResponse(status_code=status.HTTP_200_OK, content="OK")
             response.delete_cookie(f"_{DOMAIN}_access_token")
@@ -254,11 +288,11 @@ async def check_token(request: Request):
 
 async def verify_credentials(request: Request):
     logger.info("Verifying credential")
-    request_str = json.dumps(dict(request.cookies), indent=4)  # Serialize cookies to a string
-    logger.debug("Request cookies: %s", request_str)
+    # names only, the values are credentials
+    logger.debug("Request cookies: %s", list(request.cookies))
     try:
         token: str = request.cookies.get(f"_{DOMAIN}_access_token")
-        logger.debug(f"get cookies_{DOMAIN}_access_token: %s", token)
+        logger.debug("Access token cookie present: %s", token is not None)
         if not token:
             logger.error("Access token not found")
             raise HTTPException(
@@ -267,7 +301,7 @@ async def verify_credentials(request: Request):
                 headers={"WWW-Authenticate": "Bearer"},
             )
         expired, user = decode_token(token)
-        logger.debug("Token verified: %s, Expired: %s, User: %s", token, expired, user)
+        logger.debug("Token verified, Expired: %s, User: %s", expired, user)
         if expired:
             logger.info("Token expired for user: %s", user.username)
             raise HTTPException(
@@ -285,6 +319,24 @@ async def verify_credentials(request: Request):
     logger.debug("Credentials verified for user: %s", user.username)
     return user 
 
+def socket_user(environ):
+    """Returns the user of a socket.io connection from its refresh token cookie and the token's
+    digest, which revoke_token passes to socket_service.revoke; (None, None) without a valid token.
+    """
+    cookie = SimpleCookie()
+    try:
+        cookie.load(environ.get("HTTP_COOKIE", ""))
+        token = cookie.get(f"_{DOMAIN}_refresh_token")
+        if token is None:
+            return None, None
+        expired, user = decode_token(token.value)
+    except Exception:
+        logger.info("Socket connected without a valid refresh token")
+        return None, None
+    if expired:
+        return None, None
+    return user, Token_Cache.key(token.value)
+
 async def get_active_current_user(user: users.User = Depends(verify_credentials)):
     if not user.activated and user.user_type != users.User_Type.Admin:
         logger.info("Inactive user attempted access: %s", user.username)
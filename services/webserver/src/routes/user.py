@@ -1,23 +1,14 @@
-import logging
 import os
 from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, Body
 from typing import List, Optional
 
 from core import models
-from core.services import database
+from core.services import database, logs
+from utils import json_stream
 from . import security
 
-# Set up the logging configuration based on environment
 DOMAIN = os.getenv("APP_DOMAIN")
-APP_ENV = os.getenv("APP_ENV", "prod")
-LOG_LEVEL = logging.DEBUG if APP_ENV in ["dev", "debug-UserRouter"] else logging.INFO
-
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format='[%(asctime)s] [%(filename)s:%(lineno)s - %(funcName)20s() ] %(levelname)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-logger = logging.getLogger(__name__)
+logger = logs.get_logger(__name__, "debug-UserRouter")
 
 router = APIRouter(prefix="/manage", tags=["user"])
 def normalize_email(email):
@@ -29,36 +20,36 @@ def normalize_email(email):
 @router.post("/user", status_code=status.HTTP_201_CREATED)
 async def register(new_user: models.users.New_User):
     logger.info("requesting registration")
-    logger.debug("registering with new_user: %s", new_user)
+    logger.debug("registering with username: %s", new_user.username)
     if new_user.password == "" or new_user.confirm_password == "":
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Password and confirmation password cannot be empty"
         )
-    db_session = database.get_session()
+    db_session = database.get_async_session()
     try:
         logger.info("Registering a new user")
-        duplicate_username = models.users.get_users(db_session, "username", new_user.username, "asc")
-        logger.debug(f"Duplicate username: {duplicate_username}")
-        duplicate_email = models.users.get_users(db_session, "email", new_user.email, "asc")
-        logger.debug(f"Duplicate email: {duplicate_email}")
+        duplicate_username = await models.users.get_users_async(db_session, "username", new_user.username, "asc")
+        logger.debug("Duplicate username: %s", duplicate_username)
+        duplicate_email = await models.users.get_users_async(db_session, "email", new_user.email, "asc")
+        logger.debug("Duplicate email: %s", duplicate_email)
         if duplicate_username:
-            logger.debug(f"Duplicate username found: {new_user.username}")
+            logger.debug("Duplicate username found: %s", new_user.username)
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail=f"Username already exists: {new_user.username}"
             )
         if duplicate_email:
-            logger.debug(f"Duplicate email found: {new_user.email}")
+            logger.debug("Duplicate email found: %s", new_user.email)
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail=f"Email already exists: {new_user.email}"
             )
         new_user.email = normalize_email(new_user.email)
         new_user.username = new_user.username.lower()
-        user_id = models.users.add(db_session, new_user, models.users.User_Type.Client)
+        user_id = await models.users.add_async(db_session, new_user, models.users.User_Type.Client)
         if user_id:
-            logger.info(f"User registered successfully with user_id={user_id}")
+            logger.info("User registered successfully with user_id=%s", user_id)
             return {"status": "success", "message": "User registered successfully", "user_id": user_id}
         else:
             logger.error("Failed to register user")
@@ -67,10 +58,10 @@ async def register(new_user: models.users.New_User):
                 detail="Failed to register user"
             )
     except HTTPException as e:
-        logger.error(f"HTTPException occurred while registering user: {str(e.detail)}")
+        logger.error("HTTPException occurred while registering user: %s", e.detail)
         raise e
     except Exception as e:
-        logger.error(f"Exception occurred while registering user: {str(e)}")
+        logger.error("Exception occurred while registering user: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An unexpected error occurred"
@@ -80,7 +71,7 @@ async def register(new_user: models.users.New_User):
 async def get_current_user(request: Request):
     logger.info("requesting get current user")
     try:
-        db_session = database.get_session()
+        db_session = database.get_async_session()
         refresher = request.cookies.get(f"_{DOMAIN}_refresh_token")
         if refresher is None:
             logger.error("Missing refresh token")
@@ -93,7 +84,7 @@ async def get_current_user(request: Request):
         
         return {"status": "success", "data": user}
     except Exception as e:
-        logger.error(f"Exception occurred while fetching user: {str(e)}")
+        logger.error("Exception occurred while fetching user: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An unexpected error occurred while fetching current user"
@@ -102,36 +93,41 @@ async def get_current_user(request: Request):
 #Not yet test
 @router.get("/users", status_code=status.HTTP_200_OK)
 async def get_users(
+    request: Request,
     search_criteria: str = Query(..., description="Criteria to search by: 'username' or 'email'"),
     search_value: str = Query(..., description="Value to search for"),
     order: str = Query(..., description="Sort order: 'asc' for ascending, 'desc' for descending"),
+    stream: bool = Query(False, description="Stream the users as they are read; implied by Accept: application/x-ndjson"),
     is_admin: bool = Depends(security.check_is_admin)
 ):
     logger.info("requesting get users")
     try:
         logger.info("Fetching users")
         if search_criteria not in {"username", "email"}:
-            logger.debug(f"Invalid search criteria: {search_criteria}")
+            logger.debug("Invalid search criteria: %s", search_criteria)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid search criteria. Must be 'username' or 'email'."
             )
         if order.lower() not in {"asc", "desc"}:
-            logger.debug(f"Invalid sort order: {order}")
+            logger.debug("Invalid sort order: %s", order)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid sort order. Must be 'asc' or 'desc'."
             )
         order = order.lower()
-        db_session = database.get_session()
-        users = models.users.get_users(db_session, search_criteria, search_value, order)
+        db_session = database.get_async_session()
+        if stream or json_stream.wants_ndjson(request):
+            users = models.users.iter_users_async(db_session, search_criteria, search_value, order)
+            return json_stream.streaming_response(request, "data", users, lambda: {"status": "success"})
+        users = await models.users.get_users_async(db_session, search_criteria, search_value, order)
         if not users:
             logger.info("No users found")
             return {"status": "success", "message": "No users found", "data": []}
-        logger.debug(f"Users found: {users}")
+        logger.debug("Users found: %s", users)
         return {"status": "success", "data": users}
     except Exception as e:
-        logger.error(f"Exception occurred while fetching users: {str(e)}")
+        logger.error("Exception occurred while fetching users: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
@@ -141,19 +137,19 @@ async def get_users(
 async def get_user_by_id(user_id: str, is_admin: bool = Depends(security.check_is_admin)):
     logger.info("requesting get user by id")
     try:
-        logger.info(f"Fetching user by id: {user_id}")
-        db_session = database.get_session()
-        user = models.users.get_by_id(db_session, user_id)
+        logger.info("Fetching user by id: %s", user_id)
+        db_session = database.get_async_session()
+        user = await models.users.get_by_id_async(db_session, user_id)
         if not user:
             logger.debug("User not found")
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="User not found"
             )
-        logger.debug(f"User found: {user}")
+        logger.debug("User found: %s", user)
         return {"status": "success", "data": user}
     except Exception as e:
-        logger.error(f"Exception occurred while fetching user by id: {str(e)}")
+        logger.error("Exception occurred while fetching user by id: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
@@ -164,13 +160,13 @@ async def get_user_by_id(user_id: str, is_admin: bool = Depends(security.check_i
 async def update_user(user_data: models.users.Edited_User_Data, current_user: models.users.User = Depends(security.get_active_current_user)):
     logger.info("requesting update user")
     try:
-        logger.info(f"Updating user with id: {current_user.id}")
-        db_session = database.get_session()
+        logger.info("Updating user with id: %s", current_user.id)
+        db_session = database.get_async_session()
         if user_data.email:
             user_data.email = normalize_email(user_data.email)
         if user_data.username:
             user_data.username = user_data.username.lower()
-        updated = models.users.update(db_session, current_user.id, user_data)
+        updated = await models.users.update_async(db_session, current_user.id, user_data)
         if updated:
             logger.info("User updated successfully")
             return {"status": "success", "message": "User updated successfully"}
@@ -181,7 +177,7 @@ async def update_user(user_data: models.users.Edited_User_Data, current_user: mo
                 detail="Failed to update user"
             )
     except Exception as e:
-        logger.error(f"Exception occurred while updating user: {str(e)}")
+        logger.error("Exception occurred while updating user: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
@@ -192,9 +188,9 @@ async def update_user(user_data: models.users.Edited_User_Data, current_user: mo
 async def delete_user(user_id: str, is_admin: bool = Depends(security.check_is_admin)):
     logger.info("requesting delete user")
     try:
-        logger.info(f"Deleting user with id: {user_id}")
-        db_session = database.get_session()
-        deleted = models.users.delete_user(db_session, user_id)
+        logger.info("Deleting user with id: %s", user_id)
+        db_session = database.get_async_session()
+        deleted = await models.users.delete_user_async(db_session, user_id)
         if deleted:
             logger.info("User deleted successfully")
             return {"status": "success", "message": "User deleted successfully"}
@@ -205,7 +201,7 @@ async def delete_user(user_id: str, is_admin: bool = Depends(security.check_is_a
                 detail="User not found"
             )
     except Exception as e:
-        logger.error(f"Exception occurred while deleting user: {str(e)}")
+        logger.error("Exception occurred while deleting user: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+
+from core.models import diaries
+from core.services import message_brokers
+from core.services.socket import team_room, user_room
+
+logger = logging.getLogger(__name__)
+
+# the Kafka key and socket.io event name of every diary event
+DIARY_EVENT = "diary_event"
+EMIT_TOPIC = "emit_message"
+# every public diary is also listed in the "all" feed
+ALL_TEAMS = "all"
+
+
+def created_event(diary_id, new_diary: diaries.New_Diary, user):
+    return {
+        "type": "created",
+        "id": diary_id,
+        "team": new_diary.team,
+        "published": new_diary.published,
+        "was_published": False,
+        "creator_id": str(user.id),
+        "version": 0,
+        "summary": diaries.summarize(new_diary.content.dict()),
+    }
+
+
+def updated_event(diary: diaries.Diary, was_published):
+    return {
+        "type": "updated",
+        "id": diary.id,
+        "team": diary.team,
+        "published": diary.published,
+        "was_published": was_published,
+        "creator_id": diary.creator.id,
+        "version": diary.version,
+        "summary": diary.summary.dict() if diary.summary is not None else None,
+    }
+
+
+def deleted_event(diary: diaries.Diary_Preview):
+    return {
+        "type": "deleted",
+        "id": diary.id,
+        "team": diary.team,
+        "published": diary.published,
+        "creator_id": diary.creator.id,
+    }
+
+
+def imported_event(report, user):
+    return {
+        "type": "imported",
+        "teams": report["teams"],
+        "count": report["inserted"],
+        "creator_id": str(user.id),
+    }
+
+
+async def publish(event):
+    """Sends `event` to every webserver worker, which delivers it with Diary_Event_Dispatcher."""
+    await message_brokers.send(EMIT_TOPIC, DIARY_EVENT, event)
+
+
+def affected_teams(event):
+    """The teams whose public feeds `event` changes, without "all"; empty when none does."""
+    if event["type"] == "imported":
+        return list(event["teams"])
+    # an update can unpublish a diary that was listed; edits of a private diary concern its owner only
+    if event["published"] or event.get("was_published"):
+        return [event["team"]]
+    return []
+
+
+def _merge(previous, current):
+    # a diary created and edited within one window is still new to the clients
+    # the clients last saw the diary as it was before the first event of the window
+    if previous["type"] == "created" and current["type"] == "updated":
+        return dict(current, type="created", was_published=previous["was_published"])
+    if previous["type"] == "updated" and current["type"] == "updated":
+        return dict(current, was_published=previous["was_published"])
+    return current
+
+
+class Diary_Event_Dispatcher:
+    """Delivers diary events to the sockets that show the diary, coalescing bursts.
+
+    Events of the same diary that arrive within `window_ms` of the first one
+    are merged and delivered once, as the latest state. The owner's user room
+    receives every event. The team rooms (the diary's team and "all") receive
+    the events of public diaries and, so they can drop it, a content-free
+    notice when a diary is unpublished. Emits reach this worker's clients only,
+    like Emit_Relay's.
+    """
+
+    def __init__(self, sio, window_ms=250):
+        self.sio = sio
+        self.window = window_ms / 1000
+        self.pending = {}  # diary ID -> merged event waiting for its window to end
+        self.tasks = set()
+
+    async def dispatch(self, event):
+        if event["type"] == "imported":
+            # one event for a whole import, nothing to coalesce
+            await self._emit(event)
+            return
+        diary_id = event["id"]
+        previous = self.pending.get(diary_id)
+        if previous is not None:
+            self.pending[diary_id] = _merge(previous, event)
+            return
+        self.pending[diary_id] = event
+        task = asyncio.create_task(self._flush_later(diary_id))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _flush_later(self, diary_id):
+        await asyncio.sleep(self.window)
+        event = self.pending.pop(diary_id, None)
+        if event is not None:
+            await self._emit(event)
+
+    async def _emit(self, event):
+        owner = user_room(event["creator_id"])
+        teams = affected_teams(event)
+        if not teams:
+            await self.sio.emit(DIARY_EVENT, event, to=owner, ignore_queue=True)
+            return
+        rooms = [team_room(team) for team in teams] + [team_room(ALL_TEAMS)]
+        if event.get("published", True):
+            # one emit, so a socket in several of the rooms gets the event once
+            await self.sio.emit(DIARY_EVENT, event, to=[owner] + rooms, ignore_queue=True)
+            return
+        await self.sio.emit(DIARY_EVENT, event, to=owner, ignore_queue=True)
+        notice = {key: event[key] for key in ("type", "id", "team", "published")}
+        await self.sio.emit(DIARY_EVENT, notice, to=rooms, ignore_queue=True)
+
+    async def stop(self):
+        """Delivers the events still waiting for their window to end."""
+        for task in list(self.tasks):
+            task.cancel()
+        pending, self.pending = self.pending, {}
+        for event in pending.values():
+            try:
+                await self._emit(event)
+            except Exception as e:
+                logger.error("Failed to emit diary event %s: %s", event.get("id"), e)
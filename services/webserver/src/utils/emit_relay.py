@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from core.services import message_brokers
+
+logger = logging.getLogger(__name__)
+
+
+class Emit_Relay:
+    """Relays messages from a Kafka topic to socket.io clients in the background.
+
+    One long-lived consumer polls the topic in batches on its own thread and
+    hands each message to an asyncio queue; a task on the event loop drains the queue and
+    calls `sio.emit(key, value)`, or the handler registered for the key in
+    `handlers`. Requests never touch Kafka. When the queue is
+    full the consumer thread waits, so a slow emitter applies backpressure
+    instead of buffering without bound.
+
+    By default every process joins its own consumer group, so each webserver
+    worker sees every message (its clients and caches need all of them) and
+    starts from the latest offset instead of replaying history. For the same
+    reason its emits bypass a multi-process client manager: each worker
+    delivers to its own clients only, otherwise every client would get the
+    event once per worker.
+
+    When the consumer fails, for instance because Kafka is not reachable yet,
+    it is recreated after a delay that doubles from `retry_delay` up to
+    `max_retry_delay` seconds. `health()` reports whether it is consuming.
+    """
+
+    def __init__(self, sio, topic, group_id=None, max_queue=1000, poll_timeout_ms=500, on_message=None, handlers=None,
+                 retry_delay=1, max_retry_delay=60):
+        self.sio = sio
+        # called as on_message(key, value) on the event loop before each emit
+        self.on_message = on_message
+        # key -> coroutine function called with the value instead of broadcasting it
+        self.handlers = handlers or {}
+        self.topic = topic
+        self.group_id = group_id or f"{topic}-{socket.gethostname()}-{os.getpid()}"
+        self.max_queue = max_queue
+        self.poll_timeout_ms = poll_timeout_ms
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self.loop = None
+        self.queue = None
+        self.consumer = None
+        self.thread = None
+        self.task = None
+        self.stopping = threading.Event()
+        self.consuming = False
+        self.failures = 0
+        self.last_error = None
+        self.last_failure = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._consume, name=f"emit-relay-{self.topic}", daemon=True)
+        self.thread.start()
+        self.task = asyncio.create_task(self._emit_loop())
+        logger.info("Emit relay started for topic %s", self.topic)
+
+    async def stop(self, timeout=5):
+        self.stopping.set()
+        if self.consumer is not None:
+            self.consumer.terminate()
+        if self.thread is not None:
+            await self.loop.run_in_executor(None, self.thread.join, timeout)
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        logger.info("Emit relay stopped for topic %s", self.topic)
+
+    def health(self):
+        """Whether the relay is consuming, and its failures so far."""
+        return {
+            "status": "ok" if self.consuming else "stopped" if self.stopping.is_set() else "retrying",
+            "topic": self.topic,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "seconds_since_failure": None if self.last_failure is None else round(time.monotonic() - self.last_failure, 3),
+        }
+
+    def stats(self):
+        """Messages waiting to be emitted and the counters of the current consumer."""
+        consumer = self.consumer
+        stats = consumer.metrics() if consumer is not None else {}
+        stats["queued"] = self.queue.qsize() if self.queue is not None else 0
+        stats["failures"] = self.failures
+        return stats
+
+    def _consume(self):
+        delay = self.retry_delay
+        while not self.stopping.is_set():
+            consumer = None
+            try:
+                consumer = self.consumer = message_brokers.Consumer(self.group_id, enable_auto_commit=False, auto_offset_reset="latest")
+                if self.stopping.is_set():
+                    consumer.terminate()
+                # no linger: events should reach clients as soon as they arrive
+                batches = consumer.batches([self.topic], max_records=self.max_queue, linger_ms=0, poll_timeout_ms=self.poll_timeout_ms)
+                # the brokers answered, the consumer is only created when they do
+                self.consuming = True
+                for batch in batches:
+                    delay = self.retry_delay
+                    for record in batch:
+                        self._enqueue((record.key, record.value))
+                if self.stopping.is_set():
+                    break
+                raise RuntimeError("consumer stopped")
+            except Exception as e:
+                self.consuming = False
+                self.failures += 1
+                self.last_error = str(e)
+                self.last_failure = time.monotonic()
+                logger.error("Emit relay consumer for %s failed, retrying in %ss: %s", self.topic, delay, e)
+                if consumer is not None:
+                    try:
+                        consumer.close()
+                    except Exception:
+                        pass
+            if self.stopping.wait(delay):
+                break
+            delay = min(delay * 2, self.max_retry_delay)
+        self.consuming = False
+
+    def _enqueue(self, item):
+        future = asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop)
+        while not self.stopping.is_set():
+            try:
+                future.result(timeout=self.poll_timeout_ms / 1000)
+                return
+            except FutureTimeoutError:
+                continue
+        future.cancel()
+
+    async def _emit_loop(self):
+        while True:
+            key, value = await self.queue.get()
+            try:
+                if self.on_message is not None:
+                    self.on_message(key, value)
+                handler = self.handlers.get(key)
+                if handler is not None:
+                    await handler(value)
+                else:
+                    await self.sio.emit(key, value, ignore_queue=True)
+            except Exception as e:
+                logger.error("Failed to emit %s: %s", key, e)
+            finally:
+                self.queue.task_done()
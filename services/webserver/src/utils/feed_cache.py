@@ -0,0 +1,109 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class Feed_Cache:
+    """Size-bounded LRU cache of serialized feed responses.
+
+    Keys are tuples whose first element is the team the feed belongs to, so a
+    whole team can be invalidated at once. Values are the encoded response
+    body and its ETag. Entries are evicted least recently used first once
+    either `max_entries` or `max_bytes` of bodies is exceeded, and expire
+    `ttl` seconds after they were stored in case an invalidation is missed.
+
+    A feed read from the database while its team is invalidated may already
+    be stale, so readers take `generation(team)` before the read and pass it
+    to `put`, which drops the body when the team was invalidated since.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024, ttl=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (body, etag, stored at)
+        self.size = 0
+        # bumped by invalidate: every feed, and team -> its feeds
+        self.generation_all = 0
+        self.generations = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def etag(body: bytes) -> str:
+        return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+    def generation(self, team):
+        """Changes whenever the feeds of `team` are invalidated."""
+        with self.lock:
+            return self.generation_all, self.generations.get(team, 0)
+
+    def get(self, key):
+        """Returns (body, etag) for `key`, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[2] >= self.ttl:
+                self.entries.pop(key)
+                self.size -= len(entry[0])
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[:2]
+
+    def put(self, key, body: bytes, generation=None):
+        """Stores `body` under `key` and returns (body, etag).
+
+        Nothing is stored when `generation`, taken with `generation(key[0])`
+        before `body` was read, is no longer current.
+        """
+        etag = self.etag(body)
+        if len(body) > self.max_bytes:
+            return body, etag
+        with self.lock:
+            if generation is not None and generation != (self.generation_all, self.generations.get(key[0], 0)):
+                return body, etag
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self.entries[key] = (body, etag, time.monotonic())
+            self.size += len(body)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (evicted, _, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+        return body, etag
+
+    def invalidate(self, *teams):
+        """Drops the cached feeds of `teams`, or every feed when no team is given."""
+        with self.lock:
+            if len(teams) == 0:
+                self.generation_all += 1
+                keys = list(self.entries)
+            else:
+                for team in teams:
+                    self.generations[team] = self.generations.get(team, 0) + 1
+                keys = [key for key in self.entries if key[0] in teams]
+            for key in keys:
+                body = self.entries.pop(key)[0]
+                self.size -= len(body)
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
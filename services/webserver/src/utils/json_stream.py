@@ -0,0 +1,150 @@
+import zlib
+
+from fastapi import HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+
+from core.models import base
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# documents are grouped into chunks of about this size instead of one write each
+CHUNK_SIZE = 64 * 1024
+# longest NDJSON line accepted by ndjson_lines; longer lines are reported, not buffered
+MAX_LINE_LENGTH = 1024 * 1024
+# gunzip_stream stops with 413 past this many decompressed bytes
+MAX_DECOMPRESSED_SIZE = 256 * 1024 * 1024
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def json_object_stream(key, documents, trailer=None):
+    """Encodes `{"<key>": [documents...], <trailer fields>}` incrementally.
+
+    `documents` is an async iterable of JSON-ready dicts. `trailer` is a
+    callable returning the remaining fields; it is called once the documents
+    are exhausted, so it may report values only known at the end, such as the
+    next page cursor.
+    """
+    buffer = bytearray(b"{" + base.dumps(key) + b":[")
+    first = True
+    async for document in documents:
+        if not first:
+            buffer += b","
+        buffer += base.dumps(document)
+        first = False
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]"
+    for name, value in (trailer() if trailer else {}).items():
+        buffer += b"," + base.dumps(name) + b":" + base.dumps(value)
+    buffer += b"}"
+    yield bytes(buffer)
+
+
+async def ndjson_stream(documents, trailer=None):
+    """Encodes one document per line; the fields returned by `trailer` follow as the last line."""
+    buffer = bytearray()
+    async for document in documents:
+        buffer += base.dumps(document) + b"\n"
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if trailer:
+        buffer += base.dumps(trailer()) + b"\n"
+    yield bytes(buffer)
+
+
+async def ndjson_lines(chunks, max_line_length=MAX_LINE_LENGTH):
+    """Splits an async iterable of byte chunks into lines. Yields (line number, line) for every non-blank line.
+
+    A line longer than `max_line_length` bytes is skipped without being held
+    in memory and yielded as (line number, ValueError).
+    """
+    too_long = ValueError(f"line is longer than {max_line_length} bytes")
+    pending = bytearray()
+    skipping = False
+    number = 0
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                if not skipping:
+                    pending += chunk[start:]
+                    if len(pending) > max_line_length:
+                        skipping = True
+                        pending.clear()
+                break
+            number += 1
+            if not skipping:
+                pending += chunk[start:end]
+            if skipping or len(pending) > max_line_length:
+                yield number, too_long
+            elif pending.strip():
+                yield number, bytes(pending)
+            skipping = False
+            pending.clear()
+            start = end + 1
+    if skipping:
+        yield number + 1, too_long
+    elif pending.strip():
+        yield number + 1, bytes(pending)
+
+
+async def gzip_stream(chunks, level=6):
+    """Compresses an async iterable of byte chunks into a gzip stream, chunk by chunk."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def gunzip_stream(chunks, max_size=MAX_DECOMPRESSED_SIZE):
+    """Decompresses an async iterable of gzip byte chunks, at most CHUNK_SIZE bytes at a time.
+
+    Concatenated gzip members, as written by `cat a.gz b.gz` or pigz, are
+    decompressed one after the other. Raises HTTPException 413 once more than
+    `max_size` bytes were decompressed, and 400 for a corrupt or truncated body.
+    """
+    decompressor = None
+    size = 0
+    async for chunk in chunks:
+        while True:
+            if decompressor is None:
+                if not chunk:
+                    break
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                decompressed = decompressor.decompress(chunk, CHUNK_SIZE)
+            except zlib.error as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid gzip body: {e}")
+            size += len(decompressed)
+            if size > max_size:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Decompressed body is larger than {max_size} bytes",
+                )
+            if decompressed:
+                yield decompressed
+            if decompressor.eof:
+                # whatever follows the end of a member starts the next one
+                chunk = decompressor.unused_data
+                decompressor = None
+                continue
+            chunk = decompressor.unconsumed_tail
+            # a full output may leave more inside inflate even when the input is used up
+            if not chunk and len(decompressed) < CHUNK_SIZE:
+                break
+    if decompressor is not None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Truncated gzip body")
+
+
+def streaming_response(request: Request, key, documents, trailer=None, headers=None) -> StreamingResponse:
+    """Streams `documents` as NDJSON when the client accepts it, otherwise as a JSON object under `key`."""
+    if wants_ndjson(request):
+        return StreamingResponse(ndjson_stream(documents, trailer), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+    return StreamingResponse(json_object_stream(key, documents, trailer), media_type="application/json", headers=headers)
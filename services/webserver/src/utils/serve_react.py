@@ -1,9 +1,253 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
 from pathlib import Path
 from typing import Union
 
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
+from fastapi import FastAPI
+from starlette.responses import FileResponse, PlainTextResponse, Response
+
+try:
+    import brotli
+except ImportError:
+    # only used to compress index.html when the build has no .br sibling
+    brotli = None
+
+# files up to this size are read once at startup and served from memory
+MEMORY_MAX_FILE_SIZE = 64 * 1024
+MEMORY_MAX_TOTAL_SIZE = 32 * 1024 * 1024
+# written by Vite with build.manifest; lists every file it named after its content hash
+VITE_MANIFEST = ".vite/manifest.json"
+# without a manifest: Vite names them assets/<name>-<8 character hash>.<ext>
+HASHED_ASSET = re.compile(r"(^|/)assets/[^/]+-[A-Za-z0-9_-]{8}\.\w+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# everything else is revalidated with its ETag on every use
+REVALIDATE_CACHE_CONTROL = "no-cache"
+# Content-Encoding -> suffix of the precompressed sibling, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+class Static_Variant:
+    """One encoding of a static file: its bytes when held in memory, otherwise its path."""
+
+    def __init__(self, path, encoding=None, body=None):
+        self.path = path
+        self.encoding = encoding
+        self.body = body
+        if body is not None:
+            self.size = len(body)
+            self.etag = '"' + hashlib.md5(body, usedforsecurity=False).hexdigest() + '"'
+            self.stat_result = None
+        else:
+            self.stat_result = os.stat(path)
+            self.size = self.stat_result.st_size
+            self.etag = f'"{self.stat_result.st_mtime_ns:x}-{self.size:x}"'
+
+
+class Static_File:
+    def __init__(self, media_type, cache_control, variants):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        # Content-Encoding (None for the identity) -> Static_Variant
+        self.variants = variants
+
+
+def _media_type(path):
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    # starlette adds the charset to text/* types itself
+    if media_type in ("application/javascript", "application/json", "image/svg+xml"):
+        media_type += "; charset=utf-8"
+    return media_type
+
+
+def _hashed_files(build_dir):
+    """The files of the Vite manifest in `build_dir`, or None when the build has none."""
+    try:
+        with open(build_dir / VITE_MANIFEST, "rb") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+    hashed = set()
+    for chunk in manifest.values():
+        hashed.add(chunk["file"])
+        hashed.update(chunk.get("css", ()))
+        hashed.update(chunk.get("assets", ()))
+    return hashed
+
+
+def _accepted_encodings(header):
+    """Parses Accept-Encoding into {encoding: q}."""
+    accepted = {}
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name] = quality
+    return accepted
+
+
+def _etag_matches(header, etag):
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class Zero_Copy_File_Response(FileResponse):
+    """FileResponse that hands the file to the server when it supports the
+    zerocopysend or pathsend ASGI extension, so the body never passes through
+    Python. Otherwise the file is read in chunks as usual.
+    """
+
+    async def __call__(self, scope, receive, send):
+        extensions = scope.get("extensions") or {}
+        if self.send_header_only or self.stat_result is None:
+            await super().__call__(scope, receive, send)
+        elif "http.response.zerocopysend" in extensions:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            with open(self.path, "rb") as file:
+                await send({"type": "http.response.zerocopysend", "file": file, "count": self.stat_result.st_size})
+        elif "http.response.pathsend" in extensions:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+        else:
+            await super().__call__(scope, receive, send)
+
+
+class Static_Site:
+    """ASGI app serving a single-page application build.
+
+    The build directory is indexed once, at construction, so requests never
+    touch the file system to find a file. index.html and files up to
+    MEMORY_MAX_FILE_SIZE are held in memory; larger ones are sent with
+    Zero_Copy_File_Response. A `.br` or `.gz` sibling of a file is served
+    instead of it when the client accepts that encoding. Every response has an
+    ETag and a matching If-None-Match gets a 304. The files named after their
+    content hash, as listed by the Vite manifest, are cached by browsers for a
+    year, everything else is revalidated. Paths without a file extension are
+    client-side routes and get index.html.
+    """
+
+    def __init__(self, build_dir: Path):
+        self.build_dir = build_dir
+        self.files = {}  # path relative to the build directory -> Static_File
+        self.memory_size = 0
+        self.hashed = _hashed_files(build_dir)
+        self._index_files()
+        self.index = self._index_html()
+
+    def _index_files(self):
+        for root, directories, names in os.walk(self.build_dir):
+            if root == str(self.build_dir):
+                # the build metadata, such as the manifest, is not part of the site
+                directories[:] = [directory for directory in directories if directory != ".vite"]
+            names = set(names)
+            for name in names:
+                if any(name.endswith(suffix) and name[:-len(suffix)] in names for _, suffix in ENCODINGS):
+                    # a precompressed sibling, served through the file it compresses
+                    continue
+                path = os.path.join(root, name)
+                relative = Path(path).relative_to(self.build_dir).as_posix()
+                variants = {None: self._variant(path)}
+                for encoding, suffix in ENCODINGS:
+                    if name + suffix in names:
+                        variants[encoding] = self._variant(path + suffix, encoding)
+                hashed = relative in self.hashed if self.hashed is not None else HASHED_ASSET.search(relative)
+                cache_control = IMMUTABLE_CACHE_CONTROL if hashed else REVALIDATE_CACHE_CONTROL
+                self.files[relative] = Static_File(_media_type(name), cache_control, variants)
+
+    def _variant(self, path, encoding=None):
+        size = os.path.getsize(path)
+        if size <= MEMORY_MAX_FILE_SIZE and self.memory_size + size <= MEMORY_MAX_TOTAL_SIZE:
+            with open(path, "rb") as file:
+                body = file.read()
+            self.memory_size += len(body)
+            return Static_Variant(path, encoding, body)
+        return Static_Variant(path, encoding)
+
+    def _index_html(self):
+        index = self.files["index.html"]
+        variants = index.variants
+        # always in memory, and compressed here when the build did not do it
+        if variants[None].body is None:
+            with open(variants[None].path, "rb") as file:
+                variants[None] = Static_Variant(variants[None].path, body=file.read())
+        body = variants[None].body
+        if "gzip" not in variants:
+            variants["gzip"] = Static_Variant(variants[None].path, "gzip", gzip.compress(body, mtime=0))
+        if "br" not in variants and brotli is not None:
+            variants["br"] = Static_Variant(variants[None].path, "br", brotli.compress(body))
+        return index
+
+    def _lookup(self, path):
+        relative = path.lstrip("/")
+        static_file = self.files.get(relative)
+        if static_file is not None:
+            return static_file
+        if relative == "" or relative.endswith("/") or "." not in relative.rsplit("/", 1)[-1]:
+            return self.index
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        method = scope["method"]
+        if method not in ("GET", "HEAD"):
+            response = PlainTextResponse("Method Not Allowed", status_code=405, headers={"allow": "GET, HEAD"})
+            await response(scope, receive, send)
+            return
+
+        static_file = self._lookup(scope["path"])
+        if static_file is None:
+            await PlainTextResponse("Not Found", status_code=404)(scope, receive, send)
+            return
+
+        request_headers = {}
+        for name, value in scope["headers"]:
+            if name in (b"accept-encoding", b"if-none-match"):
+                request_headers[name] = value.decode("latin-1")
+
+        variant = static_file.variants[None]
+        if len(static_file.variants) > 1:
+            accepted = _accepted_encodings(request_headers.get(b"accept-encoding", ""))
+            for encoding, _ in ENCODINGS:
+                if encoding in static_file.variants and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+                    variant = static_file.variants[encoding]
+                    break
+
+        headers = {"cache-control": static_file.cache_control, "etag": variant.etag}
+        if len(static_file.variants) > 1:
+            headers["vary"] = "Accept-Encoding"
+        if variant.encoding is not None:
+            headers["content-encoding"] = variant.encoding
+
+        if_none_match = request_headers.get(b"if-none-match")
+        if if_none_match is not None and _etag_matches(if_none_match, variant.etag):
+            await Response(status_code=304, headers=headers)(scope, receive, send)
+            return
+
+        if variant.body is not None:
+            headers["content-length"] = str(variant.size)
+            body = b"" if method == "HEAD" else variant.body
+            response = Response(body, headers=headers, media_type=static_file.media_type)
+        else:
+            response = Zero_Copy_File_Response(
+                variant.path, headers=headers, media_type=static_file.media_type,
+                stat_result=variant.stat_result, method=method
+            )
+        await response(scope, receive, send)
 
 
 def serve_react_app(app: FastAPI, build_dir: Union[Path, str]) -> FastAPI:
@@ -28,22 +272,8 @@ def serve_react_app(app: FastAPI, build_dir: Union[Path, str]) -> FastAPI:
 
     if not (build_dir / "index.html").exists():
         raise ValueError(f"{build_dir} does not contain an index.html file")
-    
-    app.mount(
-        "/",
-        StaticFiles(directory=build_dir, html=True),
-        name="index",
-    )
-    templates = Jinja2Templates(directory=build_dir.as_posix())
-
-    @app.route("/{full_path:path}")
-    async def serving_react_app(request: Request, full_path: str):
-        """Serve the react app
-        `full_path` variable is necessary to serve each possible endpoint with
-        `index.html` file in order to be compatible with `react-router-dom
-        """
-        if not (build_dir / "index.html").exists():
-            raise HTTPException(status_code=404, detail="React app not found")
-        return templates.TemplateResponse(request, "index.html")
+
+    # every path no API route matched, including the client-side routes of `react-router-dom`
+    app.mount("/", Static_Site(build_dir), name="index")
 
     return app
@@ -0,0 +1,99 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class Token_Cache:
+    """Bounded LRU cache of verified tokens, keyed by the SHA-256 of the token.
+
+    Entries are only returned until the token's `exp`. Revoked tokens are
+    remembered, also until their `exp`, so a cached or replayed token cannot be
+    used after logout. At most `max_revoked` revocations are kept; past that
+    the oldest are forgotten first. Only pass tokens whose signature was
+    verified, otherwise anyone could fill the revocation list.
+
+    The cache belongs to one worker. Revocations reach the other workers only
+    when they are passed on to `revoke_digest`, see security.revoke_token.
+    """
+
+    def __init__(self, max_entries=4096, max_revoked=65536):
+        self.max_entries = max_entries
+        self.max_revoked = max_revoked
+        self.entries = OrderedDict()  # digest -> (exp timestamp, user)
+        self.revoked = OrderedDict()  # digest -> exp timestamp, oldest revocation first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str):
+        """Returns the cached user for `token`, or None if it is unknown or expired."""
+        digest = self.key(token)
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            exp, user = entry
+            if exp <= time.time():
+                del self.entries[digest]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(digest)
+            self.hits += 1
+            return user
+
+    def put(self, token: str, exp: float, user):
+        digest = self.key(token)
+        with self.lock:
+            if digest in self.revoked:
+                return
+            self.entries[digest] = (exp, user)
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def revoke(self, token: str, exp: float):
+        """Drops `token` from the cache and rejects it until `exp`."""
+        self.revoke_digest(self.key(token), exp)
+
+    def revoke_digest(self, digest: str, exp: float):
+        """Like `revoke`, for a token known only by its `key`."""
+        now = time.time()
+        with self.lock:
+            self.entries.pop(digest, None)
+            if exp <= now:
+                return
+            self.revoked[digest] = exp
+            self.revoked.move_to_end(digest)
+            if len(self.revoked) > self.max_revoked:
+                # forget revocations of tokens that have expired on their own
+                self.revoked = OrderedDict((d, e) for d, e in self.revoked.items() if e > now)
+            while len(self.revoked) > self.max_revoked:
+                self.revoked.popitem(last=False)
+
+    def is_revoked(self, token: str) -> bool:
+        digest = self.key(token)
+        with self.lock:
+            exp = self.revoked.get(digest)
+            if exp is None:
+                return False
+            if exp <= time.time():
+                del self.revoked[digest]
+                return False
+            return True
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "revoked": len(self.revoked),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,9 +1,14 @@
 /* eslint-disable no-var */
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import diaries from "../services/diariesApi";
 import socket from "../services/socket";
+import auth from "../services/authenticationApi";
 // interfaces
-import { Post_Interface, Content } from "../interfaces/PostInterface";
+import {
+  Post_Interface,
+  Content,
+  Diary_Event,
+} from "../interfaces/PostInterface";
 // Components
 import ThemeSelector from "../Components/ThemeSelector";
 import Post from "../Components/Post";
@@ -29,6 +34,14 @@ function Diaries({
   const [theme, setTheme] = useState(localStorage.getItem("theme"));
   const [editorOpen, setEditorOpen] = useState(false);
   const [posts, setPosts] = useState<Post_Interface[]>([]);
+  // cursor of the next page of the listing, null once every diary is shown
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  // diaries announced by socket events that are not shown yet
+  const [newDiaries, setNewDiaries] = useState(0);
+  // the socket handlers read the shown posts without being re-registered
+  const postsRef = useRef<Post_Interface[]>([]);
+  postsRef.current = posts;
   const [showConfirmation, setShowConfirmation] = useState(false);
   const [modificationDiaryId, setModificationDiaryId] = useState("");
   const [actionMessage, setActionMessage] = useState("");
@@ -219,41 +232,132 @@ function Diaries({
         ? await diaries.getPublicDiaries(team)
         : await diaries.getUserDiaries(privateDiaries);
       setPosts(fetchedPosts.diaries);
+      setNextCursor(fetchedPosts.next_cursor);
+      setNewDiaries(0);
     } catch (error) {
       console.error("Error in fetching posts:", error);
     }
   };
+
+  // puts the newest diaries on top and keeps the pages already loaded below them
+  const loadNewDiaries = async () => {
+    setNewDiaries(0);
+    try {
+      const fetchedPosts = team
+        ? await diaries.getPublicDiaries(team)
+        : await diaries.getUserDiaries(privateDiaries);
+      const fetchedIds = new Set(fetchedPosts.diaries.map((post) => post.id));
+      const shown = postsRef.current;
+      if (shown.length > 0 && !shown.some((post) => fetchedIds.has(post.id))) {
+        // more than a page is new, so the loaded pages no longer follow on
+        setPosts(fetchedPosts.diaries);
+        setNextCursor(fetchedPosts.next_cursor);
+        return;
+      }
+      setPosts((prevPosts) => [
+        ...fetchedPosts.diaries,
+        ...prevPosts.filter((post) => !fetchedIds.has(post.id)),
+      ]);
+      if (shown.length === 0) {
+        setNextCursor(fetchedPosts.next_cursor);
+      }
+    } catch (error) {
+      console.error("Error in fetching new posts:", error);
+    }
+  };
+
+  const loadMoreDiaries = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const fetchedPosts = team
+        ? await diaries.getPublicDiaries(team, nextCursor)
+        : await diaries.getUserDiaries(privateDiaries, nextCursor);
+      setPosts((prevPosts) => [...prevPosts, ...fetchedPosts.diaries]);
+      setNextCursor(fetchedPosts.next_cursor);
+    } catch (error) {
+      console.error("Error in fetching more posts:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
   useEffect(() => {
     fetchDiaries();
   }, [team, location.pathname]);
 
   useEffect(() => {
-    const handleNewDiaryCreated = async () => {
-      await fetchDiaries();
-      // const newPosts = await diaries.get_diaries_by_id(new_diary_id);
-      // if (newPosts.published && team) {
-      //   setPosts((prevPosts) => [newPosts, ...prevPosts]);
-      // }
+    if (!team) return;
+    // rooms are lost on reconnect, so join again every time
+    const joinTeam = () => socket.emit("join_team", team);
+    joinTeam();
+    socket.on("connect", joinTeam);
+    return () => {
+      socket.off("connect", joinTeam);
+      socket.emit("leave_team", team);
+    };
+  }, [socket, team]);
+
+  useEffect(() => {
+    const removePost = (id: string) =>
+      setPosts((prevPosts) => prevPosts.filter((post) => post.id !== id));
+
+    const isOwn = (event: Diary_Event) =>
+      event.creator_id !== undefined && event.creator_id === auth.getUser()?.id;
+
+    // whether the diary of `event` is listed on this page
+    const belongsHere = (event: Diary_Event) =>
+      team
+        ? event.published && (team === "all" || event.team === team)
+        : isOwn(event) && event.published === !privateDiaries;
+
+    // new diaries of others are only announced, so the sockets of a team do not all refetch at once
+    const announce = async (event: Diary_Event, count: number) => {
+      if (isOwn(event)) {
+        await loadNewDiaries();
+      } else {
+        setNewDiaries((previous) => previous + count);
+      }
     };
 
-    const handleDiaryUpdated = async () => {
-      await fetchDiaries();
+    const refreshPost = async (id: string) => {
+      const diary = await diaries.getVisibleDiary(id);
+      if (!diary) {
+        removePost(id);
+        return;
+      }
+      setPosts((prevPosts) =>
+        prevPosts.map((post) => (post.id === id ? diary : post))
+      );
     };
 
-    const handleDiaryDeleted = async () => {
-      await fetchDiaries();
+    const handleDiaryEvent = async (event: Diary_Event) => {
+      if (event.type === "imported") {
+        const imported = team
+          ? team === "all" || event.teams?.includes(team)
+          : isOwn(event);
+        if (imported) {
+          await announce(event, event.count || 0);
+        }
+        return;
+      }
+      if (event.type === "deleted" || !belongsHere(event)) {
+        removePost(event.id);
+        return;
+      }
+      if (postsRef.current.some((post) => post.id === event.id)) {
+        await refreshPost(event.id);
+      } else {
+        // created, or published and so newly listed here
+        await announce(event, 1);
+      }
     };
 
-    socket.on("new_diary_created", handleNewDiaryCreated);
-    socket.on("diary_id_updated", handleDiaryUpdated);
-    socket.on("diary_id_deleted", handleDiaryDeleted);
+    socket.on("diary_event", handleDiaryEvent);
 
     return () => {
-      socket.off("new_diary_created", handleNewDiaryCreated);
-      socket.off("diary_id_updated", handleDiaryUpdated);
-      socket.off("diary_id_deleted", handleDiaryDeleted);
+      socket.off("diary_event", handleDiaryEvent);
     };
-  }, [socket, team, posts]);
+  }, [socket, team, privateDiaries]);
 
   return (
     <div
@@ -324,14 +428,22 @@ function Diaries({
             />
           )}
           <div id="Posts-container" className="m-10 w-full">
+            {newDiaries > 0 && (
+              <button
+                className="w-full my-4 p-2 rounded-2xl bg-card-bg-lightM dark:bg-card-bg-darkM dark:text-body-text-darkM"
+                onClick={loadNewDiaries}
+              >
+                {`มีไดอารี่ใหม่ ${newDiaries} รายการ`}
+              </button>
+            )}
             {posts.length === 0 ? (
               <p className="dark:text-body-text-darkM">
                 ยังไม่มีไดอารี่ใดๆให้แสดง
               </p>
             ) : (
-              posts.map((post, index) => (
+              posts.map((post) => (
                 <Post
-                  key={index}
+                  key={post.id}
                   time={post.created_stamp}
                   content={post.content}
                   team={post.team}
@@ -342,6 +454,15 @@ function Diaries({
                 />
               ))
             )}
+            {nextCursor && (
+              <button
+                className="w-full my-4 p-2 rounded-2xl bg-card-bg-lightM dark:bg-card-bg-darkM dark:text-body-text-darkM"
+                onClick={loadMoreDiaries}
+                disabled={loadingMore}
+              >
+                {loadingMore ? "กำลังโหลด..." : "โหลดเพิ่มเติม"}
+              </button>
+            )}
           </div>
         </div>
         <div id="ThemeSelector" className="hidden md:block">
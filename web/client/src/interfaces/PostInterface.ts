@@ -18,6 +18,27 @@ export interface Post_Interface {
   published: boolean;
 }
 
+// sent on the "diary_event" socket event to the owner and the team rooms
+export interface Diary_Event {
+  type: "created" | "updated" | "deleted" | "imported";
+  id: string;
+  team: string;
+  published: boolean;
+  was_published?: boolean;
+  creator_id?: string;
+  version?: number;
+  summary?: Diary_Summary | null;
+  teams?: string[];
+  count?: number;
+}
+
+export interface Diary_Summary {
+  title: string;
+  snippet: string;
+  block_count: number;
+  byte_size: number;
+}
+
 export interface Content {
   time: number;
   blocks: Block[];
@@ -1,6 +1,7 @@
 import axios, { AxiosInstance } from "axios";
 import { User } from "../interfaces/userInterface";
 import getLogger from "../utils/logger";
+import { reconnectSocket } from "./socket";
 
 const API_URL = "/api/v1";
 
@@ -105,6 +106,7 @@ class AuthenticationApi {
           activated: userData.activated,
         };
         logger.debug("Logged in user: ", this.user);
+        reconnectSocket();
         return true;
       } else {
         logger.debug(`Error logging in: ${response.statusText}`);
@@ -120,6 +122,7 @@ class AuthenticationApi {
     try {
       const result = await this.client.post("/authen/logout");
       this.user = null;
+      reconnectSocket();
       return result.data;
     } catch (error) {
       logger.error(`Error logging out: ${error}`);
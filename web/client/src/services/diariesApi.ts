@@ -71,11 +71,18 @@ class DiariesApi {
     }
   }
 
-  async getPublicDiaries(team: string = "all"): Promise<{
+  // the listings are paged: pass the next_cursor of a page to get the one after it
+  async getPublicDiaries(
+    team: string = "all",
+    cursor: string | null = null
+  ): Promise<{
     diaries: Post.Post_Interface[];
+    next_cursor: string | null;
   }> {
     try {
-      const response = await this.client.post(`/diary/publics/${team}`);
+      const response = await this.client.post(`/diary/publics/${team}`, null, {
+        params: cursor ? { cursor } : undefined,
+      });
 
       const diaries = response.data.diaries || []; //get id
       logger.debug("getPublicDiaries diaries: ", diaries);
@@ -84,17 +91,24 @@ class DiariesApi {
         created_stamp: convertToBKKTime(diary.created_stamp),
       }));
 
-      return { diaries: convertedDiaries };
+      return {
+        diaries: convertedDiaries,
+        next_cursor: response.data.next_cursor || null,
+      };
     } catch (error) {
       logger.error("Error getting public diaries:", error);
-      return { diaries: [] }; // Return an object with default values
+      return { diaries: [], next_cursor: null }; // Return an object with default values
     }
   }
 
   // false = to get published diaries
   // true = to get private diaries
-  async getUserDiaries(private_flag: boolean = false): Promise<{
+  async getUserDiaries(
+    private_flag: boolean = false,
+    cursor: string | null = null
+  ): Promise<{
     diaries: Post.Post_Interface[];
+    next_cursor: string | null;
   }> {
     try {
       let api_path = "";
@@ -103,7 +117,9 @@ class DiariesApi {
       } else {
         api_path = "/diary/my_published";
       }
-      const response = await this.client.post(api_path); //get _id
+      const response = await this.client.post(api_path, null, {
+        params: cursor ? { cursor } : undefined,
+      }); //get _id
       const diaries = response.data.diaries || [];
 
       logger.debug("getUserDiaries diaries: ", diaries);
@@ -119,10 +135,13 @@ class DiariesApi {
       } else {
         this.cache.publicCount = response.data.count;
       }
-      return { diaries: convertedDiaries };
+      return {
+        diaries: convertedDiaries,
+        next_cursor: response.data.next_cursor || null,
+      };
     } catch (error) {
       logger.error("Error getting user diaries:", error);
-      return { diaries: [] };
+      return { diaries: [], next_cursor: null };
     }
   }
   // false = to get published diaries
@@ -178,6 +197,21 @@ class DiariesApi {
     }
   }
 
+  // a published diary, or one of the user's own; null if it is neither or is gone
+  async getVisibleDiary(id: string): Promise<Post.Post_Interface | null> {
+    try {
+      const response = await this.client.post(`/diary/visible/${id}`);
+      const diary = response.data;
+      return {
+        ...diary,
+        created_stamp: convertToBKKTime(diary.created_stamp),
+      };
+    } catch (error) {
+      logger.error("Error getting diary:", error);
+      return null;
+    }
+  }
+
   async update_diary(
     id: string,
     content?: Post.Content,
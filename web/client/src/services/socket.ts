@@ -23,4 +23,12 @@ socket.on("connect_timeout", (timeout) => {
 socket.on("error", (error) => {
   console.error("Socket error:", error);
 });
+
+// the server reads the session cookie only when the socket connects,
+// so a new connection is opened whenever the user signs in or out
+export function reconnectSocket() {
+  socket.disconnect();
+  socket.connect();
+}
+
 export default socket;
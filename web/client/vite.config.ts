@@ -6,5 +6,7 @@ export default defineConfig({
   plugins: [react()],
   build: {
     chunkSizeWarningLimit: 1600,
+    // lists the content-hashed files, which the webserver caches as immutable
+    manifest: true,
   },
 });